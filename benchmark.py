@@ -0,0 +1,416 @@
+from pathlib import Path
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+from bundle import CSSBundler, is_generated, minify
+from cssparse import clear_cache, parse
+from test import reset_import_graphs, validate_css_imports
+from vendor import ContentCache, CSSVendor, git_blob_sha, setup_openprops_vendor
+
+
+def upstream_files(css_dir: Path, name: str, others: List[str]) -> Dict[str, Path]:
+    """The vendored files of a source, keyed by path relative to its directory"""
+    source_dir = css_dir / name
+    nested = [css_dir / other for other in others if other != name and other.startswith(name + '/')]
+    files = {}
+    for path in sorted(source_dir.rglob('*.css')):
+        if is_generated(path) or any(path.is_relative_to(directory) for directory in nested):
+            continue
+        files[path.relative_to(source_dir).as_posix()] = path
+    return files
+
+
+class FixtureServer:
+    """
+    Local HTTP server standing in for unpkg, raw.githubusercontent.com, the GitHub API and codeload.
+
+    Its content is the vendored css/ tree laid out the way each source of
+    setup_openprops_vendor expects upstream. Requests carry the upstream host
+    as their first path segment (see FixtureTransport). ETags are sent and
+    If-None-Match is answered with 304, so warm syncs behave as they would
+    against the real hosts.
+    """
+
+    def __init__(self, css_dir: str = "css", latency: float = 0.0, jitter: float = 0.0):
+        """
+        Initialize Fixture Server.
+
+        Args:
+            css_dir: Vendored tree to serve
+            latency: Seconds added before every response
+            jitter: Extra random delay of up to this many seconds
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.routes: Dict[str, bytes] = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._build(Path(css_dir))
+        self._server = None
+
+    def _build(self, css_dir: Path):
+        sources = setup_openprops_vendor(cache=ContentCache(tempfile.mkdtemp())).sources
+        for name, source in sources.items():
+            if source['local_dir']:
+                continue
+            files = upstream_files(css_dir, name, list(sources))
+            revisions = [source['pin']] if source['pin'] else [None]
+            if source['github_repo']:
+                owner, repo, branch, prefix = CSSVendor.parse_github_repo(source['github_repo'])
+                prefix = prefix + '/' if prefix else ''
+                tree = [{'path': prefix + key, 'type': 'blob', 'sha': git_blob_sha(path.read_bytes())}
+                        for key, path in files.items()]
+                tree_json = json.dumps({'tree': tree}).encode()
+                # The branch resolves to a commit named after the served tree
+                commit = hashlib.sha1(tree_json).hexdigest()
+                self.routes[f"/api.github.com/repos/{owner}/{repo}/commits/{branch}"] = commit.encode()
+                revisions.append(commit)
+                for revision in revisions:
+                    self.routes[f"/api.github.com/repos/{owner}/{repo}/git/trees/{revision}"] = tree_json
+                    self.routes[f"/codeload.github.com/{owner}/{repo}/tar.gz/{revision}"] = \
+                        self._tarball(f"{repo}-{revision}/{prefix}", files)
+            for revision in revisions:
+                base_url = source['template']['base_url']
+                base = httpx.URL(base_url.replace('{ref}', revision) if revision else base_url)
+                for key, path in files.items():
+                    self.routes[f"/{base.host}{base.path.rstrip('/')}/{key}"] = path.read_bytes()
+
+    @staticmethod
+    def _tarball(root: str, files: Dict[str, Path]) -> bytes:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for key, path in files.items():
+                data = path.read_bytes()
+                info = tarfile.TarInfo(root + key)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, delayed ACKs add ~40 ms per response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                body = server.routes.get(self.path.split('?', 1)[0])
+                with server._lock:
+                    server.requests += 1
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FixtureServer':
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+
+class FixtureTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Send every request to a FixtureServer, with the original host moved into the path"""
+
+    def __init__(self, base_url: str):
+        self.base = httpx.URL(base_url)
+        self._sync = httpx.HTTPTransport()
+        self._async = httpx.AsyncHTTPTransport()
+
+    def _rewrite(self, request: httpx.Request):
+        url = request.url
+        request.url = url.copy_with(scheme=self.base.scheme, host=self.base.host, port=self.base.port,
+                                    raw_path=f"/{url.host}".encode() + url.raw_path)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._rewrite(request)
+        return self._sync.handle_request(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._rewrite(request)
+        return await self._async.handle_async_request(request)
+
+    def close(self):
+        self._sync.close()
+
+    async def aclose(self):
+        await self._async.aclose()
+
+
+def timed(function: Callable, repeat: int) -> Tuple[Dict, object]:
+    """Run a function `repeat` times with its output silenced; returns (timing stats, last result)"""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = function()
+            runs.append(time.perf_counter() - started)
+    return summarize(runs), result
+
+
+def summarize(runs: List[float]) -> Dict:
+    return {'min': min(runs), 'median': statistics.median(runs), 'mean': statistics.fmean(runs),
+            'runs': [round(run, 6) for run in runs]}
+
+
+def bench_sync(server: FixtureServer, repeat: int, concurrent: bool, rate_limit: float = None) -> Dict[str, Dict]:
+    """
+    Time syncs of the openprops sources against the fixture server.
+
+    cold: empty tree, empty cache. warm: same tree, lock and cache again (pinned
+    sources are skipped, the rest answered with 304s). cache: empty tree and
+    lock, cache filled by another project.
+    """
+    template = setup_openprops_vendor(cache=ContentCache(tempfile.mkdtemp()))
+    transport = FixtureTransport(server.url)
+
+    def vendor(workspace: Path, cache_dir: Path) -> CSSVendor:
+        vendor = CSSVendor(str(workspace / "css"), cache=ContentCache(str(cache_dir)),
+                           rate_limit=rate_limit, transport=transport)
+        for name, source in template.sources.items():
+            source = dict(source)
+            if source['local_dir']:
+                source['local_dir'] = str(Path(source['local_dir']).resolve())
+            vendor.sources[name] = source
+        return vendor
+
+    results = {}
+    mode = 'concurrent' if concurrent else 'serial'
+    for phase in ('cold', 'warm', 'cache'):
+        runs = []
+        counts = {}
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                workspace, cache_dir = Path(tmp), Path(tmp) / "cache"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if phase != 'cold':
+                        vendor(workspace, cache_dir).sync_all(concurrent=concurrent)
+                    if phase == 'cache':
+                        shutil.rmtree(workspace / "css")
+                    server.reset_counters()
+                    started = time.perf_counter()
+                    synced = vendor(workspace, cache_dir).sync_all(concurrent=concurrent)
+                    runs.append(time.perf_counter() - started)
+                counts = {'files': sum(synced.values()), 'requests': server.requests, 'bytes': server.bytes_sent}
+        results[f"sync.{phase}.{mode}"] = {'seconds': summarize(runs), **counts}
+    return results
+
+
+def synthetic_tree(css_dir: Path, root: Path, copies: int) -> Path:
+    """
+    Build a tree with `copies` copies of css/ui and an entry importing every copy's main.css.
+
+    Returns:
+        Path of the entry stylesheet
+    """
+    for index in range(copies):
+        shutil.copytree(css_dir / "ui", root / f"ui{index}",
+                        ignore=lambda directory, names: [name for name in names if is_generated(name)])
+    entry = root / "main.css"
+    entry.write_text(''.join(f'@import "./ui{index}/main.css";\n' for index in range(copies)))
+    return entry
+
+
+def bench_bundle(css_dir: Path, copies: int, repeat: int) -> Dict[str, Dict]:
+    """Time parsing, bundling and minification of the real tree (copies=1) or a synthetic larger one"""
+    with tempfile.TemporaryDirectory() as tmp:
+        if copies == 1:
+            base, entry = css_dir, css_dir / "ui" / "main.css"
+        else:
+            base, entry = Path(tmp), synthetic_tree(css_dir, Path(tmp), copies)
+
+        def build() -> str:
+            # Every build parses from scratch, not from the previous run's parses
+            clear_cache()
+            return bundler.build(entry)
+
+        def parse_all() -> list:
+            clear_cache()
+            return [parse(text) for text in texts]
+
+        bundler = CSSBundler(str(base))
+        bundle_time, css = timed(build, repeat)
+        texts = [path.read_text() for path in bundler.files]
+        input_bytes = sum(len(text.encode()) for text in texts)
+        parse_time, _ = timed(parse_all, repeat)
+        minify_time, minified = timed(lambda: [minify(text) for text in texts], repeat)
+
+    name = 'real' if copies == 1 else f"{copies}x"
+    return {
+        f"bundle.{name}": {'seconds': bundle_time, 'files': len(texts), 'input_bytes': input_bytes,
+                           'output_bytes': len(css.encode()),
+                           'mb_per_s': input_bytes / bundle_time['median'] / 1e6},
+        f"parse.{name}": {'seconds': parse_time, 'input_bytes': input_bytes,
+                          'mb_per_s': input_bytes / parse_time['median'] / 1e6},
+        f"minify.{name}": {'seconds': minify_time, 'input_bytes': input_bytes,
+                           'output_bytes': sum(len(text.encode()) for text in minified),
+                           'mb_per_s': input_bytes / minify_time['median'] / 1e6},
+    }
+
+
+def bench_validate(css_dir: Path, copies: int, repeat: int) -> Dict[str, Dict]:
+    """Time validate_css_imports with a fresh import-graph index (cold) and a persisted one (warm)"""
+    with tempfile.TemporaryDirectory() as tmp, contextlib.chdir(tmp):
+        root = Path(tmp) / "tree"
+        entry = synthetic_tree(css_dir, root, copies)
+
+        def cold():
+            reset_import_graphs()
+            shutil.rmtree(".patchwork", ignore_errors=True)
+            return validate_css_imports(str(entry), str(root))
+
+        def warm():
+            reset_import_graphs()
+            return validate_css_imports(str(entry), str(root))
+
+        cold_time, _ = timed(cold, repeat)
+        warm_time, _ = timed(warm, repeat)
+        files = sum(1 for _ in root.rglob('*.css'))
+    return {f"validate.{copies}x.cold": {'seconds': cold_time, 'files': files},
+            f"validate.{copies}x.warm": {'seconds': warm_time, 'files': files}}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    Print median timings against a baseline report.
+
+    Returns:
+        Names of benchmarks that got slower by more than `threshold` (a fraction)
+    """
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in current['benchmarks'].items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before:
+            continue
+        old, new = before['seconds']['median'], result['seconds']['median']
+        change = (new - old) / old if old else 0.0
+        mark = '✗' if change > threshold else '✓'
+        print(f"{mark} {name:<28} {old * 1000:9.1f} ms -> {new * 1000:9.1f} ms ({change:+.1%})")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vendoring, bundling and import validation")
+    parser.add_argument("--css-dir", default="css", help="Vendored tree to serve and bundle")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark")
+    parser.add_argument("--latency", type=float, default=20.0, metavar="MS", help="Latency added per response")
+    parser.add_argument("--jitter", type=float, default=10.0, metavar="MS", help="Random extra latency per response")
+    parser.add_argument("--rate-limit", type=float, default=None, metavar="RPS",
+                        help="Request rate limit of the vendor (default: none, to measure the engine)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 2, 5, 10], metavar="N",
+                        help="Copies of css/ui in the synthetic trees")
+    parser.add_argument("--only", nargs="+", choices=["sync", "bundle", "validate"],
+                        default=["sync", "bundle", "validate"], help="Benchmarks to run")
+    parser.add_argument("-o", "--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="REPORT", help="Earlier JSON report to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown (fraction) reported as a regression by --compare")
+    args = parser.parse_args()
+
+    css_dir = Path(args.css_dir).resolve()
+    benchmarks: Dict[str, Dict] = {}
+
+    if "sync" in args.only:
+        server = FixtureServer(str(css_dir), args.latency / 1000, args.jitter / 1000).start()
+        try:
+            for concurrent in (False, True):
+                benchmarks.update(bench_sync(server, args.repeat, concurrent, args.rate_limit))
+        finally:
+            server.stop()
+
+    for copies in args.scales:
+        if "bundle" in args.only and copies in (1, 10):
+            benchmarks.update(bench_bundle(css_dir, copies, args.repeat))
+        if "validate" in args.only:
+            benchmarks.update(bench_validate(css_dir, copies, args.repeat))
+
+    report = {
+        'version': 1,
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'repeat': args.repeat, 'latency_ms': args.latency, 'jitter_ms': args.jitter,
+                   'rate_limit': args.rate_limit, 'scales': args.scales},
+        'benchmarks': benchmarks,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"✓ Wrote {args.output} ({len(benchmarks)} benchmarks)")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report, args.threshold)
+        if regressions:
+            raise SystemExit(f"✗ {len(regressions)} benchmarks regressed beyond {args.threshold:.0%}")
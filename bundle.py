@@ -0,0 +1,1473 @@
+from pathlib import Path
+import argparse
+import ast
+import gzip
+import hashlib
+import json
+import os
+import re
+import tomllib
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cssparse import AtRule, Block, Declaration, Rule, parse
+
+try:
+    import brotli
+except ImportError:  # optional: only needed for .br precompressed output
+    brotli = None
+
+URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', re.IGNORECASE)
+VAR_PATTERN = re.compile(r'var\(\s*(--[\w-]+)')
+
+
+def scan_imports(text: str) -> List[Dict]:
+    """
+    Find the top-level @import statements of a stylesheet.
+
+    Comments, strings and block contents are skipped, so commented-out imports
+    are never picked up. The parse is shared with every other caller of
+    cssparse.parse on the same text.
+
+    Args:
+        text: Stylesheet source
+
+    Returns:
+        List of dicts with start, end, url, layer, supports and media for each import
+    """
+    return [statement.as_dict() for statement in parse(text).imports]
+
+
+def _skip_string(text: str, i: int) -> int:
+    """Return the index just past the string literal starting at i"""
+    quote = text[i]
+    i += 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == quote or text[i] == '\n':
+            return i + 1
+        i += 1
+    return i
+
+
+def resolve_import(import_path: str, importer: Path, base_dir: Path) -> Path:
+    """Resolve an import the same way validate_css_imports does: '/' is the base dir, otherwise relative"""
+    if import_path.startswith('/'):
+        return base_dir / import_path[1:]
+    return importer.parent / import_path
+
+
+def is_external(import_path: str) -> bool:
+    return bool(re.match(r'^([a-z]+:)?//', import_path, re.IGNORECASE)) or import_path.startswith('data:')
+
+
+def _matching(text: str, i: int, open_char: str, close_char: str) -> int:
+    """Return the index just past the bracket matching the one at i"""
+    depth = 0
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if char in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if char == open_char:
+            depth += 1
+        elif char == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def split_top(text: str, separator: str = ',') -> List[str]:
+    """Split on a separator that is not nested in parentheses, brackets or strings"""
+    parts = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    parts.append(text[start:].strip())
+    return [part for part in parts if part]
+
+
+# Elements every FastHTML page renders regardless of the route
+PAGE_TAGS = {'html', 'head', 'body', 'title', 'meta', 'link', 'script', 'style'}
+
+# At-rules whose blocks contain rules that can be pruned individually
+GROUPING_RULES = {'media', 'supports', 'layer', 'container', 'scope', 'document', 'starting-style'}
+
+# Pseudo-classes that match if any selector in their argument list matches
+MATCHES_ANY = {'is', 'where', 'matches', '-webkit-any', '-moz-any'}
+
+IDENT = r'(?:\\.|[\w-])+'
+_COMPOUND_TOKEN = re.compile(
+    rf'(?P<tag>{IDENT}|\*)|\.(?P<cls>{IDENT})|#(?P<id>{IDENT})|(?P<attr>\[)|(?P<pseudo>::?)(?P<name>{IDENT})(?P<args>\()?|(?P<nest>&)'
+)
+
+
+def _unescape(ident: str) -> str:
+    return re.sub(r'\\(.)', r'\1', ident)
+
+
+def scan_usage(paths: List[str]) -> Dict[str, set]:
+    """
+    Collect the tags, classes and ids a FastHTML app can render.
+
+    Python sources are parsed with `ast`: capitalized calls such as `Button(...)`
+    count as tags, and the string parts of `cls=` and `id=` keywords (including
+    f-strings, lists and tuples) as classes and ids. Any string literal containing
+    HTML markup contributes its tags and class attributes too, and any `var(--x)`
+    in a string (e.g. an inline style) marks that custom property as used.
+
+    Args:
+        paths: Python files or directories to scan recursively
+
+    Returns:
+        dict with 'tags', 'classes', 'ids' and 'props' sets
+    """
+    usage = {'tags': set(PAGE_TAGS), 'classes': set(), 'ids': set(), 'props': set()}
+
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.rglob('*.py')) if path.is_dir() else [path])
+
+    for file in files:
+        try:
+            scan_source(file.read_text(), usage, filename=str(file))
+        except (SyntaxError, UnicodeDecodeError, OSError) as e:
+            print(f"✗ Skipping {file}: {str(e)}")
+    return usage
+
+
+def scan_source(source: str, usage: Dict[str, set] = None, filename: str = '<source>') -> Dict[str, set]:
+    """
+    Collect the tags, classes, ids and custom properties one piece of Python source can render.
+
+    Args:
+        source: Python source, e.g. a module or a single route function
+        usage: Usage dict to add to (default: a new one seeded with the page tags)
+        filename: Name reported in syntax errors
+
+    Returns:
+        The usage dict (see scan_usage)
+    """
+    if usage is None:
+        usage = {'tags': set(PAGE_TAGS), 'classes': set(), 'ids': set(), 'props': set()}
+
+    def strings(node) -> List[str]:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return [node.value]
+        if isinstance(node, ast.JoinedStr):
+            return [part.value for part in node.values
+                    if isinstance(part, ast.Constant) and isinstance(part.value, str)]
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return [s for element in node.elts for s in strings(element)]
+        if isinstance(node, ast.BinOp):
+            return strings(node.left) + strings(node.right)
+        if isinstance(node, ast.IfExp):
+            return strings(node.body) + strings(node.orelse)
+        return []
+
+    for node in ast.walk(ast.parse(source, filename=filename)):
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, 'attr', '')
+            if name[:1].isupper():
+                usage['tags'].add(name.lower())
+            for keyword in node.keywords:
+                if keyword.arg in ('cls', 'klass', 'class_'):
+                    for value in strings(keyword.value):
+                        usage['classes'].update(value.split())
+                elif keyword.arg == 'id':
+                    for value in strings(keyword.value):
+                        usage['ids'].update(value.split())
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            usage['props'].update(VAR_PATTERN.findall(node.value))
+            if '<' not in node.value:
+                continue
+            usage['tags'].update(tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', node.value))
+            for value in re.findall(r'class=["\']([^"\']*)', node.value):
+                usage['classes'].update(value.split())
+
+    return usage
+
+
+def apply_safelist(usage: Dict[str, set], safelist: List[str]) -> Dict[str, set]:
+    """
+    Add safelisted selectors to a usage set.
+
+    Entries are written like selectors: ".dark" is a class, "#app" an id and
+    "dialog" a tag. Glob patterns such as ".toast-*" are allowed.
+    """
+    usage = {key: set(values) for key, values in usage.items()}
+    usage.setdefault('patterns', set())
+    for entry in safelist or []:
+        entry = entry.strip()
+        if any(char in entry for char in '*?['):
+            usage['patterns'].add(entry)
+        elif entry.startswith('.'):
+            usage['classes'].add(entry[1:])
+        elif entry.startswith('#'):
+            usage['ids'].add(entry[1:])
+        elif entry:
+            usage['tags'].add(entry.lower())
+    return usage
+
+
+def _allowed(kind: str, value: str, usage: Dict[str, set]) -> bool:
+    if value in usage[kind]:
+        return True
+    prefix = {'classes': '.', 'ids': '#', 'tags': ''}[kind]
+    return any(fnmatchcase(prefix + value, pattern) for pattern in usage.get('patterns', ()))
+
+
+def selector_can_match(selector: str, usage: Dict[str, set]) -> bool:
+    """
+    Decide conservatively whether a complex selector can match a page built from `usage`.
+
+    Every compound must only require tags, classes and ids that are used.
+    `:is()`/`:where()` match if any of their arguments can; other pseudo-classes,
+    attribute selectors and `&` never rule a selector out.
+    """
+    position = 0
+    for combinator in re.finditer(r'\s*[>+~]\s*|\s+', _mask_nested(selector)):
+        if not _compound_can_match(selector[position:combinator.start()], usage):
+            return False
+        position = combinator.end()
+    return _compound_can_match(selector[position:], usage)
+
+
+def _mask_nested(selector: str) -> str:
+    """Blank out bracketed and parenthesized parts so combinators inside them are ignored"""
+    out = list(selector)
+    depth = 0
+    for index, char in enumerate(selector):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif depth > 0 and char in ' >+~':
+            out[index] = '_'
+    return ''.join(out)
+
+
+def _compound_can_match(compound: str, usage: Dict[str, set]) -> bool:
+    i = 0
+    while i < len(compound):
+        match = _COMPOUND_TOKEN.match(compound, i)
+        if not match:
+            i += 1
+            continue
+        i = match.end()
+
+        if match.group('tag') and match.group('tag') != '*':
+            # Only a leading identifier is a type selector
+            if match.start() == 0 or compound[match.start() - 1] in '&':
+                if not _allowed('tags', _unescape(match.group('tag')).lower(), usage):
+                    return False
+        elif match.group('cls'):
+            if not _allowed('classes', _unescape(match.group('cls')), usage):
+                return False
+        elif match.group('id'):
+            if not _allowed('ids', _unescape(match.group('id')), usage):
+                return False
+        elif match.group('attr'):
+            i = _matching(compound, match.start(), '[', ']')
+        elif match.group('args'):
+            end = _matching(compound, match.end() - 1, '(', ')')
+            arguments = compound[match.end():end - 1]
+            i = end
+            if match.group('pseudo') == ':' and match.group('name').lower() in MATCHES_ANY:
+                if not any(selector_can_match(arg, usage) for arg in split_top(arguments)):
+                    return False
+    return True
+
+
+def style_selectors(css: str) -> List[str]:
+    """
+    List the selectors of every top-level style rule, including those inside grouping at-rules.
+
+    Nested rules are not listed; they can only match where their parent does.
+    """
+    selectors = []
+    pending = list(reversed(parse(css).children))
+    while pending:
+        node = pending.pop()
+        if isinstance(node, Rule):
+            selectors.extend(split_top(node.prelude))
+        elif isinstance(node, AtRule) and node.name in GROUPING_RULES:
+            pending.extend(reversed(node.children))
+    return selectors
+
+
+def custom_property_spans(text: str) -> List[Tuple[str, int, int]]:
+    """
+    Locate every custom-property declaration in a stylesheet.
+
+    Returns:
+        List of (name, start, end) spans, end including the terminating ';' if any
+    """
+    return sorted(((name, declaration.start, declaration.end)
+                   for name, declarations in parse(text).properties.items() for declaration in declarations),
+                  key=lambda span: span[1])
+
+
+def custom_property_graph(texts: List[str]) -> Tuple[Dict[str, set], set]:
+    """
+    Build the var() reference graph of a set of stylesheets.
+
+    Returns:
+        tuple: (definitions mapping each custom property to the properties its values
+        reference, roots referenced from regular properties and at-rule preludes)
+    """
+    definitions: Dict[str, set] = {}
+    roots = set()
+    for text in texts:
+        sheet = parse(text)
+        for name in sheet.properties:
+            definitions.setdefault(name, set())
+        for name, _, owner in sheet.var_refs:
+            if owner is None:
+                roots.add(name)
+            else:
+                definitions[owner].add(name)
+    return definitions, roots
+
+
+def live_properties(definitions: Dict[str, set], roots: set, keep: List[str] = None) -> set:
+    """Return every custom property reachable from the roots or matching a keep pattern"""
+    pending = set(roots)
+    pending.update(name for name in definitions
+                   if any(fnmatchcase(name, pattern) for pattern in keep or []))
+    live = set()
+    while pending:
+        name = pending.pop()
+        if name in live:
+            continue
+        live.add(name)
+        pending.update(definitions.get(name, ()))
+    return live
+
+
+def strip_properties(text: str, live: set) -> str:
+    """Remove the declarations of custom properties that are not live"""
+    out = []
+    position = 0
+    for name, start, end in custom_property_spans(text):
+        if name in live:
+            continue
+        out.append(text[position:start])
+        position = end
+    out.append(text[position:])
+    return ''.join(out)
+
+
+def rule_declarations(rule: Block) -> Tuple[List[Tuple[str, str, bool]], bool]:
+    """
+    Normalize the declarations of a parsed style rule.
+
+    Returns:
+        tuple: (list of (property, value, important) in source order, whether the
+        rule also contains nested rules)
+    """
+    declarations = [(declaration.name, declaration.value if declaration.custom else _collapse(declaration.value, tight=','),
+                     declaration.important) for declaration in rule.declarations]
+    nested = any(isinstance(child, Block) and child.body_start is not None for child in rule.children)
+    return declarations, nested
+
+
+def index_rules(css: str) -> List[Dict]:
+    """
+    Index the style rules of a stylesheet by selector, declarations and cascade context.
+
+    The context of a rule is the list of grouping at-rules around it (@layer,
+    @media, @supports, ...), whitespace-normalized so that two rules in the same
+    layer and under the same conditions have equal contexts. Each anonymous
+    @layer block is a layer of its own and gets a numbered context. Nested rules
+    are not indexed separately; they stay part of their parent.
+
+    Returns:
+        One dict per style rule in source order, with selectors (normalized),
+        declarations (see rule_declarations), nested, context, prelude and body
+    """
+    rules = []
+    _index_block(css, parse(css), (), rules, iter(range(1 << 30)))
+    return rules
+
+
+def _index_block(text: str, block: Block, context: tuple, rules: List[Dict], anonymous):
+    for node in block.children:
+        if isinstance(node, AtRule):
+            if node.name in GROUPING_RULES and not node.statement:
+                condition = _collapse(node.head(text))
+                if node.name == 'layer' and not node.prelude:
+                    condition = f"@layer <anonymous {next(anonymous)}>"
+                _index_block(text, node, context + (condition,), rules, anonymous)
+            continue
+        if not isinstance(node, Rule):
+            continue
+        declarations, nested = rule_declarations(node)
+        rules.append({
+            'selectors': [_minify_selector(selector) for selector in split_top(node.prelude)],
+            'declarations': declarations,
+            'nested': nested,
+            'context': context,
+            'prelude': node.prelude,
+            'body': node.body(text),
+        })
+
+
+def overridden_rules(rules: List[Dict]) -> List[int]:
+    """
+    Find the rules that can never contribute a declaration.
+
+    A rule is overridden when, for each of its selectors, every property it
+    declares is declared again by a later rule with that same selector in the
+    same cascade context (same layer, same conditions), at the same or a
+    higher importance. The later declaration then wins wherever the earlier
+    one applies. Rules with nested rules are never dropped, and later rules
+    whose selector list has a vendor-prefixed pseudo (which invalidates the
+    whole rule in other engines) never count as overriding. As in other
+    optimizers that merge rules, a later value is assumed to be supported, so
+    fallbacks spread over two rules with the same selector are not kept.
+
+    Args:
+        rules: Style rules in cascade order (see index_rules)
+
+    Returns:
+        Indices of the overridden rules, in ascending order
+    """
+    later: Dict[Tuple[tuple, str], Dict[str, bool]] = {}
+    overridden = []
+    for index in range(len(rules) - 1, -1, -1):
+        rule = rules[index]
+        seen = [later.get((rule['context'], selector), {}) for selector in rule['selectors']]
+        if rule['selectors'] and not rule['nested'] and all(
+                name in declared and (declared[name] or not important)
+                for declared in seen for name, _, important in rule['declarations']):
+            overridden.append(index)
+            continue
+
+        if len(rule['selectors']) > 1 and any(re.search(r'::?-', selector) for selector in rule['selectors']):
+            continue
+        for selector in rule['selectors']:
+            declared = later.setdefault((rule['context'], selector), {})
+            for name, _, important in rule['declarations']:
+                declared[name] = declared.get(name, False) or important
+    return overridden[::-1]
+
+
+def drop_overridden(css: str) -> Tuple[str, List[Dict]]:
+    """
+    Remove the style rules that are fully overridden within their cascade layer (see overridden_rules).
+
+    Grouping at-rules left empty are removed; an emptied named @layer block
+    leaves an @layer statement behind to keep the layer order. `/*! */`
+    license comments are kept at the top, other comments are removed.
+
+    Returns:
+        tuple: (the stylesheet without them, the dropped rules)
+    """
+    licenses = re.findall(r'/\*!.*?\*/', css, re.DOTALL)
+    rules = index_rules(css)
+    dropped = overridden_rules(rules)
+    body = _drop_rules(css, parse(css), set(dropped), iter(range(1 << 30)))
+    css = ''.join(license + '\n' for license in licenses) + body + '\n'
+    return css, [rules[index] for index in dropped]
+
+
+def _drop_rules(text: str, block: Block, dropped: set, counter) -> str:
+    out = []
+    for node in block.children:
+        if not isinstance(node, Block) or node.body_start is None:
+            out.append(node.source(text))
+            continue
+
+        head = node.head(text)
+        if isinstance(node, AtRule):
+            if node.name not in GROUPING_RULES:
+                out.append(f"{head} {{{node.body(text)}}}")
+                continue
+            inner = _drop_rules(text, node, dropped, counter)
+            if inner:
+                out.append(f"{head} {{\n{inner}\n}}")
+            elif node.name == 'layer' and node.prelude:
+                out.append(f"{head};")
+            continue
+
+        # Rules are numbered in the order index_rules lists them
+        if next(counter) not in dropped:
+            out.append(f"{head} {{{node.body(text)}}}")
+    return '\n'.join(out)
+
+
+class CSSBundler:
+    """Flatten the @import graph of a stylesheet into a single file"""
+
+    def __init__(self, base_dir: str = "css"):
+        """
+        Initialize CSS Bundler.
+
+        Args:
+            base_dir: Base directory for resolving absolute ('/...') import paths
+        """
+        self.base_dir = Path(base_dir)
+        self.missing: List[str] = []
+        self.external: List[str] = []
+        # Bytes removed from each source file by each optimization pass
+        self.savings: Dict[str, Dict[Path, int]] = {}
+        # File contents keyed by path, reused across builds while mtime and size are unchanged
+        self._read_cache: Dict[Path, Tuple[int, int, str]] = {}
+
+    def bundle(self,
+               entry: str,
+               output: str = None,
+               usage: Dict[str, set] = None,
+               live_props: set = None,
+               include: Callable[[Path], bool] = None,
+               dedupe: bool = False) -> Path:
+        """
+        Bundle an entry stylesheet and everything it imports into one file.
+
+        Args:
+            entry: Path to the entry stylesheet (e.g. css/ui/main.css)
+            output: Output path, defaults to <entry>.bundle.css (or <entry>.pruned.css) next to the entry
+            usage: If given, prune rules that cannot match this usage (see scan_usage)
+            live_props: If given, drop custom-property declarations not in this set (see live_properties)
+            include: If given, only the entry's own imports whose resolved path it accepts are inlined
+            dedupe: Drop rules fully overridden later in the same cascade layer (see drop_overridden)
+
+        Returns:
+            Path of the written bundle
+        """
+        entry_path = Path(entry)
+        suffix = '.pruned.css' if usage is not None else '.bundle.css'
+        output_path = Path(output) if output else entry_path.with_suffix(suffix)
+
+        css = self.build(entry_path, output_path.parent, usage, live_props, include, dedupe)
+        replace_file(output_path, css.encode())
+        print(f"✓ Bundled {entry_path} -> {output_path} ({len(css)} bytes)")
+        self.print_savings()
+        return output_path
+
+    def load(self,
+             entry: Path,
+             output_dir: Path = None,
+             usage: Dict[str, set] = None,
+             include: Callable[[Path], bool] = None) -> Dict[Path, str]:
+        """
+        Read every file in the import graph of an entry.
+
+        Args:
+            entry: Path to the entry stylesheet
+            output_dir: Directory the bundle is written to (for url() rebasing)
+            usage: If given, prune each file to this usage
+            include: If given, only follow the entry's imports whose resolved path it accepts
+
+        Returns:
+            Dictionary mapping resolved file paths to their (possibly pruned) CSS
+        """
+        self.missing = []
+        self.external = []
+        self.savings = {}
+        self._sources: Dict[Path, str] = {}
+        output_dir = output_dir or entry.parent
+
+        # Counting how often each (file, conditions) import occurs also reads the whole graph
+        self._counts: Dict[tuple, int] = {}
+        self._expand(entry, output_dir, (), (), self._counts, mode='count', include=include)
+
+        if usage is not None:
+            self._apply('prune', lambda text: self.prune(text, usage))
+        return self._sources
+
+    def build(self,
+              entry: Path,
+              output_dir: Path = None,
+              usage: Dict[str, set] = None,
+              live_props: set = None,
+              include: Callable[[Path], bool] = None,
+              dedupe: bool = False) -> str:
+        """
+        Flatten an entry stylesheet into a single string.
+
+        Each import is inlined in place and wrapped in the @layer, @supports and
+        @media blocks its import conditions describe, so cascade layer order is
+        unchanged. When the same file is imported with the same conditions more
+        than once, only the last copy is kept (the one that decides the cascade);
+        earlier layered copies leave an empty `@layer name;` behind so the order
+        in which layers are first declared is preserved.
+
+        Optimization passes run on each source file before it is inlined, so
+        their savings can be reported per file. Dropping overridden rules
+        needs the whole cascade, so it runs on the flattened result and its
+        savings are reported against the entry.
+        """
+        output_dir = output_dir or entry.parent
+        self.load(entry, output_dir, usage, include)
+
+        if live_props is not None:
+            self._apply('props', lambda text: strip_properties(text, live_props))
+
+        body = self._expand(entry, output_dir, (), (), self._counts, mode='emit', include=include)
+        if dedupe:
+            body, dropped = drop_overridden(body)
+            self.savings['dedupe'] = {
+                entry: sum(len(rule['prelude']) + len(rule['body']) + 2 for rule in dropped)}
+        header = ''.join(f'@import "{url}";\n' for url in self.external)
+        return self._hoist(header, body)
+
+    @property
+    def files(self) -> set:
+        """Resolved paths of every file in the import graph of the last build"""
+        return set(self._sources)
+
+    def _apply(self, name: str, transform):
+        """Run an optimization pass over every loaded source, recording bytes saved per file"""
+        savings = self.savings.setdefault(name, {})
+        for path, text in self._sources.items():
+            result = transform(text)
+            savings[path] = savings.get(path, 0) + len(text.encode()) - len(result.encode())
+            self._sources[path] = result
+
+    def print_savings(self):
+        """Print the bytes each optimization pass removed from each source file"""
+        for name, savings in self.savings.items():
+            total = sum(savings.values())
+            if not total:
+                continue
+            print(f"  {name}: saved {total} bytes")
+            for path, saved in sorted(savings.items(), key=lambda item: -item[1]):
+                if saved:
+                    print(f"    -{saved:>8} {os.path.relpath(path)}")
+
+    def _read(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self._read_cache.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        text = path.read_text()
+        self._read_cache[path] = (stat.st_mtime_ns, stat.st_size, text)
+        return text
+
+    def _source(self, path: Path, output_dir: Path) -> str:
+        """Read a file once per build, with @charset removed and url() references rebased"""
+        if path not in self._sources:
+            text = self._read(path)
+            text = re.sub(r'@charset\s+"[^"]*"\s*;', '', text, flags=re.IGNORECASE)
+            self._sources[path] = self._rebase_urls(text, path.parent, output_dir)
+        return self._sources[path]
+
+    def _expand(self,
+                path: Path,
+                output_dir: Path,
+                stack: Tuple[Path, ...],
+                context: tuple,
+                counts: Dict[tuple, int],
+                mode: str,
+                include: Callable[[Path], bool] = None) -> str:
+        """
+        Recursively inline the imports of a file.
+
+        Args:
+            path: File to expand
+            output_dir: Directory the bundle is written to
+            stack: Files currently being expanded, for cycle detection
+            context: Import conditions of every enclosing import
+            counts: Remaining occurrences of each (file, conditions) import
+            mode: 'count' to tally occurrences, 'skip' to discount a dropped copy, 'emit' to inline
+            include: Filter for the imports of this file (not of the files it imports)
+        """
+        text = self._source(path, output_dir)
+        emit = mode == 'emit'
+        out = []
+        position = 0
+
+        for statement in scan_imports(text):
+            out.append(text[position:statement['start']])
+            position = statement['end']
+
+            url = statement['url']
+            if is_external(url):
+                if emit and url not in self.external:
+                    self.external.append(url)
+                continue
+
+            target = resolve_import(url, path, self.base_dir).resolve()
+            if include is not None and not include(target):
+                continue
+            if target in stack or target == path.resolve():
+                if emit:
+                    print(f"✗ Import cycle: {path} -> {url}")
+                continue
+            if not target.exists():
+                if emit:
+                    print(f"✗ Missing import: {url} (expected at {target})")
+                    self.missing.append(url)
+                    out.append(f"/* missing: {url} */")
+                continue
+
+            conditions = (statement['layer'], statement['supports'], statement['media'])
+            key = (target, context + (conditions,))
+            inner_stack = stack + (path.resolve(),)
+
+            if not emit:
+                counts[key] = counts.get(key, 0) + (1 if mode == 'count' else -1)
+                self._expand(target, output_dir, inner_stack, key[1], counts, mode)
+                continue
+
+            counts[key] -= 1
+            if counts[key] > 0:
+                # A later identical import decides the cascade; only keep the layer's position
+                self._expand(target, output_dir, inner_stack, key[1], counts, 'skip')
+                if statement['layer'] and not statement['supports'] and not statement['media']:
+                    out.append(f"@layer {statement['layer']};")
+                continue
+
+            inner = self._expand(target, output_dir, inner_stack, key[1], counts, 'emit')
+            out.append(self._wrap(inner, statement))
+
+        out.append(text[position:])
+        return ''.join(out)
+
+    def prune(self, css: str, usage: Dict[str, set]) -> str:
+        """
+        Drop every style rule whose selectors cannot match the given usage.
+
+        Selector lists are filtered selector by selector, nested rules are pruned
+        relative to their parent, and grouping at-rules left empty are removed
+        (an emptied named @layer block leaves an @layer statement to keep its
+        order). @keyframes, @font-face, @property and similar blocks are kept.
+        """
+        return self._prune_block(css, parse(css), usage) + '\n'
+
+    def _prune_block(self, text: str, block: Block, usage: Dict[str, set]) -> str:
+        out = []
+        for node in block.children:
+            if not isinstance(node, Block) or node.body_start is None:
+                out.append(node.source(text))
+                continue
+
+            head = node.head(text)
+            if isinstance(node, AtRule):
+                if node.name not in GROUPING_RULES:
+                    out.append(f"{head} {{{node.body(text)}}}")
+                    continue
+                inner = self._prune_block(text, node, usage)
+                if inner:
+                    out.append(f"{head} {{\n{inner}\n}}")
+                elif node.name == 'layer' and node.prelude:
+                    out.append(f"{head};")
+                continue
+
+            selectors = [selector for selector in split_top(node.prelude) if selector_can_match(selector, usage)]
+            inner = self._prune_block(text, node, usage) if selectors else ''
+            if inner:
+                out.append(f"{', '.join(selectors)} {{\n{inner}\n}}")
+        return '\n'.join(out)
+
+    @staticmethod
+    def _wrap(css: str, statement: Dict) -> str:
+        """Wrap inlined CSS in the blocks equivalent to its import conditions"""
+        css = css.strip('\n')
+        if statement['layer'] is not None:
+            name = f" {statement['layer']}" if statement['layer'] else ''
+            css = f"@layer{name} {{\n{css}\n}}"
+        if statement['supports']:
+            css = f"@supports ({statement['supports']}) {{\n{css}\n}}"
+        if statement['media']:
+            css = f"@media {statement['media']} {{\n{css}\n}}"
+        return css
+
+    @staticmethod
+    def _rebase_urls(text: str, source_dir: Path, output_dir: Path) -> str:
+        """Rewrite relative url() references so they still resolve from the bundle location"""
+        def rebase(match):
+            quote, url = match.group(1), match.group(2).strip()
+            if is_external(url) or url.startswith(('/', '#')):
+                return match.group(0)
+            target = Path(os.path.relpath(os.path.normpath(source_dir / url), output_dir))
+            return f"url({quote}{target.as_posix()}{quote})"
+
+        if source_dir.resolve() == output_dir.resolve():
+            return text
+        return URL_PATTERN.sub(rebase, text)
+
+    @staticmethod
+    def _hoist(header: str, body: str) -> str:
+        """Place external imports after any leading @layer statements, where @import is still valid"""
+        if not header:
+            return body
+        match = re.match(r'(\s*(?:/\*.*?\*/\s*|@layer[^{;]*;\s*)*)', body, re.DOTALL)
+        return body[:match.end()] + header + body[match.end():]
+
+
+def default_entries(base_dir: str = "css") -> List[str]:
+    """The entry stylesheets bundled by default: ui/main.css and custom/custom.css"""
+    return [str(Path(base_dir) / "ui" / "main.css"),
+            str(Path(base_dir) / "custom" / "custom.css")]
+
+
+def bundle_all(base_dir: str = "css",
+               entries: List[str] = None,
+               usage: Dict[str, set] = None,
+               drop_unused_props: bool = False,
+               keep_props: List[str] = None,
+               dedupe: bool = False) -> Dict[str, Path]:
+    """
+    Bundle the default entry points of the vendored tree.
+
+    Args:
+        base_dir: Root of the vendored tree
+        entries: Entry stylesheets, defaults to ui/main.css and custom/custom.css
+        usage: If given, prune each bundle to this usage (see scan_usage)
+        drop_unused_props: Remove custom properties that nothing reachable references
+        keep_props: Glob patterns of custom properties to keep regardless (e.g. ones set from JS)
+        dedupe: Drop rules fully overridden later in the same cascade layer (see drop_overridden)
+
+    Returns:
+        Dictionary mapping entry paths to written bundle paths
+    """
+    bundler = CSSBundler(base_dir)
+    entries = [entry for entry in entries or default_entries(base_dir) if Path(entry).exists()]
+
+    live_props = None
+    if drop_unused_props:
+        # Bundles are loaded together on a page, so props are live if any bundle uses them
+        texts = []
+        for entry in entries:
+            texts.extend(bundler.load(Path(entry), usage=usage).values())
+        definitions, roots = custom_property_graph(texts)
+        roots |= (usage or {}).get('props', set())
+        live_props = live_properties(definitions, roots, keep_props)
+        print(f"Keeping {len(live_props)} of {len(definitions)} custom properties")
+
+    return {entry: bundler.bundle(entry, usage=usage, live_props=live_props, dedupe=dedupe) for entry in entries}
+
+
+# Component groups of ui/main.css that are split into their own deferred chunks
+SPLIT_GROUPS = ('feedback', 'inputs', 'data-display')
+
+# Files this module writes next to the sources: bundles, pruned bundles, split chunks, theme variants
+# and fingerprinted copies
+GENERATED_CSS = re.compile(r'\.(bundle|pruned|critical|theme-[\w-]+|' + '|'.join(map(re.escape, SPLIT_GROUPS))
+                           + r'|[0-9a-f]{8})\.css$')
+
+
+def is_generated(path: Path) -> bool:
+    """True for CSS files written by the bundle step rather than vendored"""
+    return bool(GENERATED_CSS.search(Path(path).name))
+
+
+def split_bundles(entry: str = "css/ui/main.css",
+                  base_dir: str = "css",
+                  groups: Tuple[str, ...] = SPLIT_GROUPS,
+                  critical_usage: Dict[str, set] = None,
+                  dedupe: bool = False) -> Dict[str, Path]:
+    """
+    Split an entry into a critical bundle and one deferred chunk per component group.
+
+    The entry's imports from a group directory (e.g. ./feedback/alert.css) go
+    to <entry>.<group>.css; everything else (open props, normalize, utils,
+    theme and the remaining components) goes to <entry>.critical.css. Every
+    chunk keeps the entry's leading `@layer ...;` statement, so whichever
+    order the chunks load in, the cascade layer order stays that of the entry.
+
+    Args:
+        entry: Entry stylesheet to split
+        base_dir: Root of the vendored tree
+        groups: Directories next to the entry that become deferred chunks
+        critical_usage: If given, prune the critical bundle to what is rendered above the fold
+        dedupe: Drop rules overridden within the same chunk (see drop_overridden)
+
+    Returns:
+        Dictionary mapping chunk names ('critical' and each group) to written paths
+    """
+    entry_path = Path(entry)
+    root = entry_path.parent.resolve()
+    bundler = CSSBundler(base_dir)
+
+    def group_of(target: Path) -> str:
+        parts = Path(os.path.relpath(target, root)).parts
+        return parts[0] if len(parts) > 1 and parts[0] in groups else 'critical'
+
+    chunks = {}
+    for chunk in ('critical',) + tuple(groups):
+        output = entry_path.with_name(f"{entry_path.stem}.{chunk}.css")
+        usage = critical_usage if chunk == 'critical' else None
+        chunks[chunk] = bundler.bundle(str(entry_path), str(output), usage=usage,
+                                       include=lambda target, chunk=chunk: group_of(target) == chunk,
+                                       dedupe=dedupe)
+    return chunks
+
+
+# Theme variants compiled by default, when patchwork.toml has no [themes] table
+DEFAULT_THEMES = {'light': {'scheme': 'light'}, 'dark': {'scheme': 'dark'}}
+
+# Selectors that only ever match the root element; custom properties declared there are the theme
+ROOT_SELECTORS = {':root', 'html', ':where(:root)', ':where(html)', ':is(:root)', ':is(html)'}
+
+_THEME_FUNCTION = re.compile(r'(?<![\w-])(var|light-dark)\(', re.IGNORECASE)
+
+
+def load_themes(path: str = "patchwork.toml") -> Dict[str, Dict]:
+    """
+    Read the theme variants to compile from the [themes] table of the vendor manifest.
+
+    Each `[themes.<name>]` has an optional `scheme` ("light" or "dark", which
+    light-dark() values resolve to) and `properties` overriding root custom
+    properties, e.g. `properties = { "--palette-hue" = "var(--oklch-blue)" }`.
+
+    Returns:
+        Dictionary mapping theme names to {'scheme', 'properties'}; DEFAULT_THEMES without a table
+    """
+    if not Path(path).exists():
+        return DEFAULT_THEMES
+    with open(path, 'rb') as f:
+        themes = tomllib.load(f).get('themes')
+    if not themes:
+        return DEFAULT_THEMES
+    for name, theme in themes.items():
+        if theme.get('scheme') not in (None, 'light', 'dark'):
+            raise ValueError(f"Theme {name} in {path} has scheme {theme['scheme']!r}, not light or dark")
+    return themes
+
+
+class ThemeCompiler:
+    """
+    Resolve the theme custom properties of a flattened stylesheet into literals, once per variant.
+
+    A custom property declared on the root element resolves its var()
+    references there, once, and is inherited as that value. So where a
+    property is only ever declared on the root (html, :root, :where(html),
+    ...), outside @media/@supports and nested rules, its value is the same
+    everywhere and can be computed at build time: var() is a plain token
+    substitution and light-dark() picks a branch once the scheme is fixed.
+    Properties declared anywhere else (e.g. --palette-hue on .red) or under a
+    condition stay dynamic, as does anything that references them.
+    """
+
+    def __init__(self, css: str, other_texts: List[str] = None):
+        """
+        Initialize Theme Compiler.
+
+        Args:
+            css: Flattened stylesheet (see CSSBundler.build)
+            other_texts: Stylesheets loaded on the same pages; what they declare stays dynamic and
+                what they reference is kept declared
+        """
+        self.css = css
+        self.sheet = parse(css)
+        # Winning root declaration of each property, ranked by (layer, source order)
+        self.root: Dict[str, Tuple[tuple, Declaration]] = {}
+        self.root_declarations: set = set()
+        self.scheme_declarations: set = set()
+        self.dynamic: set = set()
+        self.external_refs: set = set()
+        self._collect()
+        for text in other_texts or []:
+            definitions, roots = custom_property_graph([text])
+            self.dynamic.update(definitions)
+            self.external_refs.update(roots)
+            self.external_refs.update(*definitions.values())
+
+    def _collect(self):
+        layers: List[str] = []
+        for node, ancestors in self.sheet.walk():
+            path = [block.prelude or f"<anonymous {block.start}>" for block in ancestors
+                    if isinstance(block, AtRule) and block.name == 'layer']
+            if isinstance(node, AtRule) and node.name == 'layer':
+                names = split_top(node.prelude) if node.statement else [node.prelude or f"<anonymous {node.start}>"]
+                for name in names:
+                    if '.'.join(path + [name]) not in layers:
+                        layers.append('.'.join(path + [name]))
+                continue
+            if not isinstance(node, Declaration):
+                continue
+
+            rules = [block for block in ancestors if isinstance(block, Rule)]
+            at_root = (len(rules) == 1 and ancestors[-1] is rules[0]
+                       and all(block.name == 'layer' for block in ancestors if isinstance(block, AtRule))
+                       and all(_minify_selector(selector) in ROOT_SELECTORS for selector in split_top(rules[0].prelude)))
+            if not node.custom:
+                if at_root and node.name == 'color-scheme':
+                    self.scheme_declarations.add(node)
+                continue
+            if not at_root:
+                self.dynamic.add(node.name)
+                continue
+
+            layer = '.'.join(path)
+            # Unlayered declarations win over every layer
+            rank = (layers.index(layer) if layer in layers else -1) if path else len(layers) + (1 << 20)
+            self.root_declarations.add(node)
+            current = self.root.get(node.name)
+            if current is None or (rank, node.start) >= current[0]:
+                self.root[node.name] = ((rank, node.start), node)
+
+    def compile(self,
+                scheme: Optional[str] = None,
+                properties: Dict[str, str] = None,
+                keep: List[str] = None) -> Tuple[str, Dict[str, int]]:
+        """
+        Write one variant of the stylesheet.
+
+        Args:
+            scheme: "light" or "dark" to resolve light-dark() and root color-scheme, None to leave them dynamic
+            properties: Root custom properties overridden by this variant (e.g. a brand hue)
+            keep: Glob patterns of custom properties to keep declared (e.g. ones read from JS or style="")
+
+        Returns:
+            tuple: (the variant, counts of inlined references and dropped declarations)
+        """
+        properties = properties or {}
+        values = {name: entry[1].value for name, entry in self.root.items()}
+        values.update(properties)
+        # Kept properties may be set at runtime, so their references are not inlined either
+        dynamic = self.dynamic | {name for name in values if any(fnmatchcase(name, pattern) for pattern in keep or [])}
+        memo: Dict[str, Optional[str]] = {}
+
+        def resolve(name: str) -> Optional[str]:
+            """Literal value of a root property, or None if it has to stay dynamic"""
+            if name not in memo:
+                memo[name] = None  # cycles stay dynamic
+                if name in values and name not in dynamic:
+                    memo[name] = self._substitute(values[name].strip(), resolve, scheme, strict=True)
+            return memo[name]
+
+        stats = {'inlined': 0, 'dropped': 0}
+        replacements = []
+        for node, _ in self.sheet.walk():
+            if not isinstance(node, Declaration):
+                continue
+            value = properties.get(node.name, node.value) if node in self.root_declarations else node.value
+            if node in self.scheme_declarations and scheme:
+                value = scheme
+            counter = [0]
+            new_value = self._substitute(value, resolve, scheme, counter=counter)
+            if new_value != node.value:
+                stats['inlined'] += counter[0]
+                important = ' !important' if node.important else ''
+                terminator = ';' if self.css[node.start:node.end].rstrip().endswith(';') else ''
+                replacements.append((node.start, node.end, f"{node.name}: {new_value}{important}{terminator}"))
+
+        css = _splice(self.css, replacements)
+        missing = {name: value for name, value in properties.items()
+                   if not any(declaration.name == name for declaration in self.root_declarations)}
+        if missing:
+            css += ':where(html) {\n' + ''.join(f"  {name}: {value};\n" for name, value in missing.items()) + '}\n'
+
+        # Static properties nothing references any more are dropped; dynamic ones always stay
+        definitions, roots = custom_property_graph([css])
+        live = live_properties(definitions, roots | self.external_refs, keep)
+        static = {name for name in values if name not in dynamic and resolve(name) is not None}
+        drop = {name for name in static if name not in live}
+        stats['dropped'] = sum(len(self.sheet.properties.get(name, [])) for name in drop)
+        return strip_properties(css, set(definitions) - drop), stats
+
+    def _substitute(self,
+                    value: str,
+                    resolve: Callable[[str], Optional[str]],
+                    scheme: Optional[str],
+                    strict: bool = False,
+                    counter: list = None) -> Optional[str]:
+        """
+        Inline var() references that resolve to literals and pick light-dark() branches.
+
+        Returns:
+            The new value; with strict, None unless every reference was inlined
+        """
+        out = []
+        position = 0
+        for match in _THEME_FUNCTION.finditer(value):
+            if match.start() < position:
+                continue
+            end = _matching(value, match.end() - 1, '(', ')')
+            arguments = split_top(value[match.end():end - 1])
+            replacement = None
+
+            if match.group(1).lower() == 'light-dark':
+                if scheme and len(arguments) == 2:
+                    replacement = self._substitute(arguments[scheme == 'dark'], resolve, scheme, strict, counter)
+                    if replacement is None:
+                        return None
+            elif arguments and arguments[0].startswith('--'):
+                name = arguments[0].strip()
+                fallback = value[match.end():end - 1].partition(',')[2].strip() or None
+                resolved = resolve(name)
+                declared = name in self.root or name in self.dynamic
+                if resolved is None and not declared and fallback is not None:
+                    # Never declared anywhere, so the fallback always applies
+                    resolved = self._substitute(fallback, resolve, scheme, strict, counter)
+                if resolved is not None:
+                    replacement = resolved
+                    if counter is not None:
+                        counter[0] += 1
+                elif strict:
+                    return None
+
+            if replacement is None:
+                inner = self._substitute(value[match.end():end - 1], resolve, scheme, strict, counter)
+                if inner is None:
+                    return None
+                replacement = f"{value[match.start():match.end()]}{inner})"
+            elif replacement:
+                # var() substitutes tokens, so keep the literal from fusing with its neighbours
+                before = value[match.start() - 1] if match.start() else ''
+                after = value[end] if end < len(value) else ''
+                replacement = (' ' if before and before not in ' \t\n(,' else '') + replacement \
+                    + (' ' if after and after not in ' \t\n),;' else '')
+            out.append(value[position:match.start()])
+            out.append(replacement)
+            position = end
+        out.append(value[position:])
+        return ''.join(out)
+
+
+def _splice(text: str, replacements: List[Tuple[int, int, str]]) -> str:
+    """Replace non-overlapping (start, end, text) spans of a text"""
+    out = []
+    position = 0
+    for start, end, replacement in sorted(replacements):
+        out.append(text[position:start])
+        out.append(replacement)
+        position = end
+    out.append(text[position:])
+    return ''.join(out)
+
+
+def theme_bundles(entry: str = "css/ui/main.css",
+                  base_dir: str = "css",
+                  themes: Dict[str, Dict] = None,
+                  keep: List[str] = None,
+                  dedupe: bool = False) -> Dict[str, Path]:
+    """
+    Precompile an entry into one bundle per theme variant, e.g. ui/main.theme-dark.css.
+
+    The other default entries (custom/custom.css) are loaded on the same pages,
+    so the properties they reference stay declared and the ones they declare
+    stay dynamic (see ThemeCompiler).
+
+    Args:
+        entry: Entry stylesheet to compile
+        base_dir: Root of the vendored tree
+        themes: Variants to write (see load_themes), default: those of patchwork.toml
+        keep: Glob patterns of custom properties to keep declared
+        dedupe: Drop rules fully overridden in the same cascade layer first (see drop_overridden)
+
+    Returns:
+        Dictionary mapping theme names to written paths
+    """
+    entry_path = Path(entry)
+    bundler = CSSBundler(base_dir)
+    others = [bundler.build(Path(other)) for other in default_entries(base_dir)
+              if Path(other).exists() and Path(other).resolve() != entry_path.resolve()]
+    css = bundler.build(entry_path, dedupe=dedupe)
+    compiler = ThemeCompiler(css, others)
+
+    written = {}
+    for name, theme in (themes or load_themes()).items():
+        output = entry_path.with_name(f"{entry_path.stem}.theme-{name}.css")
+        variant, stats = compiler.compile(theme.get('scheme'), theme.get('properties'), keep)
+        replace_file(output, variant.encode())
+        print(f"✓ Compiled {entry_path} -> {output} ({len(variant)} bytes, "
+              f"{stats['inlined']} var() inlined, {stats['dropped']} declarations dropped)")
+        written[name] = output
+    return written
+
+
+def minify(css: str) -> str:
+    """
+    Minify a stylesheet without changing what it means.
+
+    Comments are removed (except `/*! ... */` license comments, which are kept
+    at the top), whitespace is collapsed, and the spaces around `{ } ; , :` in
+    declarations and around combinators in selectors are dropped. At-rule
+    preludes such as `@layer`, `@import ... layer()` and `@media` only have
+    their whitespace collapsed, and custom-property values are kept verbatim.
+    """
+    licenses = re.findall(r'/\*!.*?\*/', css, re.DOTALL)
+    body = _minify_block(css, parse(css))
+    return ''.join(license + '\n' for license in licenses) + body
+
+
+def _minify_block(text: str, block: Block) -> str:
+    out = []
+    after_statement = False
+    for node in block.children:
+        statement = not isinstance(node, Block) or node.body_start is None
+        if after_statement:
+            out.append(';')
+        after_statement = statement
+
+        if statement:
+            out.append(_minify_statement(node.source(text).rstrip(';')))
+        elif isinstance(node, AtRule):
+            inner = _minify_keyframes(text, node) if node.name.endswith('keyframes') else _minify_block(text, node)
+            out.append(f"{_collapse(node.head(text))}{{{inner}}}")
+        else:
+            out.append(f"{_minify_selector(node.prelude)}{{{_minify_block(text, node)}}}")
+    return ''.join(out)
+
+
+def _minify_keyframes(text: str, block: Block) -> str:
+    return ''.join(f"{_minify_selector(node.prelude)}{{{_minify_block(text, node)}}}"
+                   for node in block.children if isinstance(node, Block) and node.body_start is not None)
+
+
+def _minify_statement(statement: str) -> str:
+    """Minify a declaration; at-rule statements and custom properties only lose surrounding space"""
+    if statement.startswith('@'):
+        return _collapse(statement)
+    name, separator, value = statement.partition(':')
+    if not separator:
+        return _collapse(statement)
+    name = name.strip()
+    if name.startswith('--'):
+        return f"{name}:{value.strip()}"
+    return f"{name}:{_collapse(value, tight=',')}"
+
+
+def _minify_selector(selector: str) -> str:
+    return _collapse(selector, tight=',>+~')
+
+
+def _collapse(text: str, tight: str = '') -> str:
+    """Collapse whitespace runs to one space (none next to `tight` characters), leaving strings intact"""
+    out = []
+    i = 0
+    n = len(text)
+    pending_space = False
+    while i < n:
+        char = text[i]
+        if char.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and out and out[-1] not in tight and char not in tight:
+            out.append(' ')
+        pending_space = False
+        if char in '"\'':
+            end = _skip_string(text, i)
+            out.append(text[i:end])
+            i = end
+            continue
+        out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+def replace_file(path: Path, data: bytes):
+    """
+    Write a file by renaming a temporary sibling over it.
+
+    Vendored files may be hardlinks into the shared content cache (or, while
+    a sync is staged, into the live tree), so they must never be rewritten in place.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def precompress(path: Path) -> List[Path]:
+    """
+    Write `.gz` and `.br` siblings of a file at maximum compression.
+
+    Brotli output needs the optional `brotli` package; without it only gzip
+    is written. A variant is skipped if it would not be smaller than the file.
+
+    Returns:
+        Paths of the written variants
+    """
+    data = path.read_bytes()
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    written = []
+    for suffix, compressed in variants.items():
+        target = path.with_name(path.name + suffix)
+        if len(compressed) < len(data):
+            replace_file(target, compressed)
+            written.append(target)
+        elif target.exists():
+            target.unlink()
+    return written
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def fingerprint(path: Path, logical_name: str, base_dir: Path, length: int = 8) -> Path:
+    """
+    Copy a file to a content-hashed name next to it, e.g. main.3f9a1c2e.css.
+
+    Older fingerprinted copies of the same logical name are removed, so only
+    the current one (and its precompressed siblings) remains.
+
+    Args:
+        path: File whose content is hashed (e.g. ui/main.bundle.css)
+        logical_name: Name the file is requested by, relative to base_dir (e.g. ui/main.css)
+        base_dir: Root of the vendored tree
+        length: Number of hex digits of the sha256 to use
+
+    Returns:
+        Path of the fingerprinted copy
+    """
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()[:length]
+    logical = Path(logical_name)
+    target = base_dir / logical.parent / f"{logical.stem}.{digest}{logical.suffix}"
+
+    stale = re.compile(rf'{re.escape(logical.stem)}\.[0-9a-f]{{{length}}}{re.escape(logical.suffix)}(\.gz|\.br)?$')
+    for existing in target.parent.iterdir():
+        if existing.name != target.name and stale.match(existing.name):
+            existing.unlink()
+
+    if not target.exists():
+        replace_file(target, data)
+    return target
+
+
+def write_manifest(base_dir: Path, hashed: Dict[str, Path]) -> Path:
+    """
+    Merge logical-name -> fingerprinted-name entries into base_dir/manifest.json.
+
+    Names in the manifest are relative to base_dir and use forward slashes.
+    """
+    manifest_path = base_dir / MANIFEST_FILE
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    for logical_name, path in hashed.items():
+        manifest[Path(logical_name).as_posix()] = path.relative_to(base_dir).as_posix()
+    replace_file(manifest_path, (json.dumps(dict(sorted(manifest.items())), indent=2) + "\n").encode())
+    print(f"✓ Wrote {manifest_path} ({len(hashed)} fingerprinted files)")
+    return manifest_path
+
+
+def fingerprint_bundles(base_dir: Path, bundles: Dict[str, Path]) -> Dict[str, Path]:
+    """Fingerprint bundles and record them in the manifest under their entry's logical name"""
+    hashed = {}
+    for entry, bundle_path in bundles.items():
+        logical_name = Path(entry).resolve().relative_to(base_dir.resolve()).as_posix()
+        hashed[logical_name] = fingerprint(bundle_path, logical_name, base_dir)
+    write_manifest(base_dir, hashed)
+    return hashed
+
+
+def optimize_tree(base_dir: str = "css",
+                  bundle: bool = True,
+                  minify_files: bool = True,
+                  compress: bool = True,
+                  hashed_names: bool = True,
+                  split: bool = True,
+                  dedupe: bool = True,
+                  themes: bool = True) -> List[Path]:
+    """
+    Post-sync pipeline stage: bundle, minify, fingerprint and precompress the vendored tree.
+
+    Args:
+        base_dir: Root of the vendored tree
+        bundle: Write the default bundles (see bundle_all)
+        split: Also split ui/main.css into a critical bundle and deferred chunks (see split_bundles)
+        dedupe: Drop rules of the bundles that are fully overridden in the same cascade layer
+        themes: Also precompile ui/main.css into one bundle per theme of patchwork.toml (see theme_bundles)
+        minify_files: Minify every CSS file and bundle in place
+        compress: Write .gz/.br siblings for every CSS file
+        hashed_names: Copy each bundle to a content-hashed name listed in manifest.json
+
+    Returns:
+        Paths of the CSS files that were processed
+    """
+    base_path = Path(base_dir)
+    bundles = bundle_all(str(base_path), dedupe=dedupe) if bundle else {}
+    main = base_path / "ui" / "main.css"
+    if split and main.exists():
+        # Chunks are fingerprinted under their own names, e.g. ui/main.feedback.css
+        bundles.update({str(path): path for path in split_bundles(str(main), str(base_path), dedupe=dedupe).values()})
+    if themes and main.exists():
+        # Fingerprinted under their own names too, e.g. ui/main.theme-dark.css
+        bundles.update({str(path): path for path in theme_bundles(str(main), str(base_path), dedupe=dedupe).values()})
+
+    files = sorted(base_path.rglob('*.css'))
+    saved = 0
+    for path in files:
+        if minify_files:
+            original = path.read_text()
+            minified = minify(original)
+            if minified != original:
+                replace_file(path, minified.encode())
+                saved += len(original) - len(minified)
+
+    if hashed_names and bundles:
+        fingerprint_bundles(base_path, bundles)
+        files = sorted(base_path.rglob('*.css'))
+
+    if compress:
+        for path in files:
+            precompress(path)
+
+    if minify_files:
+        print(f"✓ Minified {len(files)} files (saved {saved} bytes)")
+    if compress:
+        formats = 'gzip/brotli' if brotli is not None else 'gzip (install brotli for .br)'
+        print(f"✓ Precompressed {len(files)} files ({formats})")
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bundle vendored CSS into single files")
+    parser.add_argument("entries", nargs="*", help="Entry stylesheets (default: ui/main.css and custom/custom.css)")
+    parser.add_argument("--base-dir", default="css", help="Root of the vendored tree")
+    parser.add_argument("--prune", nargs="+", metavar="PATH",
+                        help="FastHTML sources to scan; rules they cannot match are dropped")
+    parser.add_argument("--safelist", nargs="+", default=[], metavar="SELECTOR",
+                        help="Classes (.x), ids (#x), tags or glob patterns to always keep")
+    parser.add_argument("--drop-unused-props", action="store_true",
+                        help="Remove custom properties that no reachable var() references")
+    parser.add_argument("--keep-props", nargs="+", default=[], metavar="PATTERN",
+                        help="Custom properties to always keep, e.g. '--palette-*'")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Drop rules fully overridden by a later rule in the same cascade layer")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="Also write content-hashed copies and record them in manifest.json")
+    parser.add_argument("--split", action="store_true",
+                        help="Also split ui/main.css into main.critical.css and one deferred chunk per component group")
+    parser.add_argument("--themes", nargs="*", metavar="NAME",
+                        help="Also precompile ui/main.css into main.theme-<name>.css per theme of patchwork.toml "
+                             "(default: all of them)")
+    args = parser.parse_args()
+
+    usage = apply_safelist(scan_usage(args.prune), args.safelist) if args.prune else None
+    bundles = bundle_all(args.base_dir, args.entries or None, usage, args.drop_unused_props, args.keep_props,
+                         args.dedupe)
+    if args.split:
+        main = str(Path(args.base_dir) / "ui" / "main.css")
+        bundles.update({str(path): path for path in split_bundles(main, args.base_dir, critical_usage=usage,
+                                                                 dedupe=args.dedupe).values()})
+    if args.themes is not None:
+        themes = load_themes()
+        unknown = [name for name in args.themes if name not in themes]
+        if unknown:
+            parser.error(f"unknown theme(s): {', '.join(unknown)} (known: {', '.join(themes)})")
+        main = str(Path(args.base_dir) / "ui" / "main.css")
+        selected = {name: themes[name] for name in args.themes} if args.themes else themes
+        bundles.update({str(path): path for path in theme_bundles(main, args.base_dir, selected, args.keep_props,
+                                                                 args.dedupe).values()})
+    if args.fingerprint:
+        fingerprint_bundles(Path(args.base_dir), bundles)
@@ -0,0 +1,816 @@
+from pathlib import Path
+import argparse
+import asyncio
+import hashlib
+import importlib
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from bundle import (GROUPING_RULES, IDENT, MATCHES_ANY, URL_PATTERN, VAR_PATTERN, CSSBundler,
+                    custom_property_graph, is_external, live_properties, minify, selector_can_match, split_top,
+                    strip_properties)
+from cssparse import AtRule, Block, parse, strip_comments
+
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                 'source', 'track', 'wbr'}
+
+# Attributes that pseudo-classes such as :checked or :placeholder-shown look at
+STATE_ATTRIBUTES = {'checked', 'selected', 'disabled', 'readonly', 'required', 'placeholder', 'value',
+                    'open', 'href', 'lang', 'dir', 'type'}
+
+# Pseudo-elements written with a single colon for historical reasons
+LEGACY_PSEUDO_ELEMENTS = {'before', 'after', 'first-line', 'first-letter'}
+
+FORM_CONTROLS = {'button', 'input', 'select', 'textarea', 'optgroup', 'option', 'fieldset'}
+
+_IDENT = re.compile(IDENT)
+_ATTRIBUTE = re.compile(
+    r'^\s*(?:(?:[\w-]*|\*)\|)?(?P<name>(?:\\.|[\w-])+)\s*'
+    r'(?:(?P<op>[~|^$*]?=)\s*(?P<value>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^\s\]]+)\s*(?P<flag>[iIsS])?)?\s*$')
+_NTH = re.compile(r'^\s*(?:(?P<odd>odd)|(?P<even>even)|(?P<a>[+-]?\d*)n\s*(?:(?P<sign>[+-])\s*(?P<b>\d+))?|(?P<int>[+-]?\d+))\s*$',
+                  re.IGNORECASE)
+_LINK_TAG = re.compile(r'<link\b[^>]*>', re.IGNORECASE)
+_KEYFRAMES = re.compile(r'@(?:-webkit-)?keyframes\s+([\w-]+)\s*\{')
+
+
+class Element:
+    """A node of a parsed HTML document, holding only what selector matching needs"""
+
+    __slots__ = ('tag', 'attrs', 'id', 'classes', 'parent', 'children', 'index', 'has_text')
+
+    def __init__(self, tag: str, attrs: Dict[str, str], parent: Optional['Element']):
+        self.tag = tag
+        self.attrs = attrs
+        self.id = attrs.get('id')
+        self.classes = frozenset((attrs.get('class') or '').split())
+        self.parent = parent
+        self.children: List['Element'] = []
+        self.index = 0
+        self.has_text = False
+
+    def append(self, child: 'Element'):
+        child.parent = self
+        child.index = len(self.children)
+        self.children.append(child)
+
+    def walk(self, depth: int = 0):
+        """Yield (depth, element) for every element below this one, in document order"""
+        for child in self.children:
+            yield depth, child
+            yield from child.walk(depth + 1)
+
+
+class _DocumentParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Element('#document', {}, None)
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        element = Element(tag, {name: value or '' for name, value in attrs}, None)
+        self.stack[-1].append(element)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.stack[-1].append(Element(tag, {name: value or '' for name, value in attrs}, None))
+
+    def handle_endtag(self, tag):
+        # Close up to the matching open element; stray end tags are ignored
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        if data.strip():
+            self.stack[-1].has_text = True
+
+
+def parse_html(html: str) -> Element:
+    """
+    Parse an HTML document into a tree of Elements under a '#document' node.
+
+    Fragments without an <html> element are placed in a synthetic html > body,
+    so that :root and body-relative selectors behave as they would in a page.
+    """
+    parser = _DocumentParser()
+    parser.feed(html)
+    parser.close()
+    root = parser.root
+
+    if not any(child.tag == 'html' for child in root.children):
+        children = root.children
+        root.children = []
+        page = Element('html', {}, None)
+        body = Element('body', {}, None)
+        root.append(page)
+        page.append(body)
+        for child in children:
+            body.append(child)
+    return root
+
+
+# ----------------------------------------------------------------------
+# Selector parsing
+# ----------------------------------------------------------------------
+
+def parse_selector_list(text: str) -> List[list]:
+    """Parse a selector list into complex selectors (see parse_selector)"""
+    return [parse_selector(selector) for selector in split_top(text) if selector.strip()]
+
+
+def parse_selector(text: str) -> List[Tuple[Optional[str], tuple]]:
+    """
+    Parse a complex selector.
+
+    Returns:
+        List of (combinator, compound) from left to right; the combinator is the
+        one before the compound (' ', '>', '+' or '~'), and is only set on the
+        first compound for relative selectors such as the arguments of :has()
+
+    Raises:
+        ValueError: If the selector is not valid
+    """
+    parts = []
+    combinator = None
+    i = 0
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if char.isspace():
+            i += 1
+            if parts and combinator is None:
+                combinator = ' '
+            continue
+        if char in '>+~':
+            combinator = char
+            i += 1
+            continue
+        compound, i = _parse_compound(text, i)
+        parts.append((combinator, compound))
+        combinator = None
+
+    if not parts or combinator not in (None, ' '):
+        raise ValueError(f"Invalid selector: {text!r}")
+    return parts
+
+
+def _read_ident(text: str, i: int) -> Tuple[str, int]:
+    match = _IDENT.match(text, i)
+    if not match:
+        raise ValueError(f"Expected an identifier at {i} in {text!r}")
+    return re.sub(r'\\(.)', r'\1', match.group(0)), match.end()
+
+
+def _read_block(text: str, i: int, close: str) -> Tuple[str, int]:
+    """Read from just after an opening bracket to its matching `close`, honoring nesting and strings"""
+    depth = 1
+    start = i
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char in '"\'':
+            end = text.find(char, i + 1)
+            i = len(text) if end < 0 else end + 1
+            continue
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+            if depth == 0:
+                if char != close:
+                    break
+                return text[start:i], i + 1
+        i += 1
+    raise ValueError(f"Unbalanced brackets in {text!r}")
+
+
+def _parse_compound(text: str, i: int) -> Tuple[tuple, int]:
+    tests = []
+    n = len(text)
+    while i < n and not text[i].isspace() and text[i] not in '>+~,':
+        char = text[i]
+        if char == '*':
+            i += 1
+            if text[i:i + 1] == '|':
+                i += 1
+        elif char == '&':
+            tests.append(('scope',))
+            i += 1
+        elif char == '#':
+            value, i = _read_ident(text, i + 1)
+            tests.append(('id', value))
+        elif char == '.':
+            value, i = _read_ident(text, i + 1)
+            tests.append(('class', value))
+        elif char == '[':
+            inner, i = _read_block(text, i + 1, ']')
+            tests.append(_parse_attribute(inner))
+        elif char == ':':
+            element = text[i + 1:i + 2] == ':'
+            name, i = _read_ident(text, i + (2 if element else 1))
+            name = name.lower()
+            arguments = None
+            if text[i:i + 1] == '(':
+                arguments, i = _read_block(text, i + 1, ')')
+            if not element and name not in LEGACY_PSEUDO_ELEMENTS:
+                tests.append(_parse_pseudo_class(name, arguments))
+            # Pseudo-elements style a part of the element they follow, so they don't filter it
+        else:
+            value, i = _read_ident(text, i)
+            tests.append(('tag', value.lower()))
+    return tuple(tests), i
+
+
+def _parse_attribute(inner: str) -> tuple:
+    match = _ATTRIBUTE.match(inner)
+    if not match:
+        raise ValueError(f"Invalid attribute selector: [{inner}]")
+    value = match.group('value')
+    if value and value[0] in '"\'':
+        value = value[1:-1]
+    if value is not None:
+        value = re.sub(r'\\(.)', r'\1', value)
+    ignore_case = (match.group('flag') or '').lower() == 'i'
+    if ignore_case and value is not None:
+        value = value.lower()
+    return ('attr', match.group('name').lower(), match.group('op'), value, ignore_case)
+
+
+def _parse_pseudo_class(name: str, arguments: Optional[str]) -> tuple:
+    if name in MATCHES_ANY:
+        return ('is', _parse_forgiving(arguments or ''))
+    if name == 'not':
+        return ('not', parse_selector_list(arguments or ''))
+    if name == 'has':
+        return ('has', _parse_forgiving(arguments or ''))
+    if name in ('nth-child', 'nth-last-child', 'nth-of-type', 'nth-last-of-type'):
+        formula, of = arguments or '', None
+        match = re.match(r'(.*?)\s+of\s+(.*)$', formula, re.DOTALL | re.IGNORECASE)
+        if match and 'of-type' not in name:
+            formula, of = match.groups()
+        a, b = _parse_nth(formula)
+        return ('nth', 'last' in name, 'of-type' in name, a, b, parse_selector_list(of) if of else None)
+    return ('pseudo', name, arguments)
+
+
+def _parse_forgiving(arguments: str) -> List[list]:
+    """:is(), :where() and :has() drop invalid arguments instead of failing as a whole"""
+    selectors = []
+    for argument in split_top(arguments):
+        try:
+            selectors.append(parse_selector(argument))
+        except ValueError:
+            continue
+    return selectors
+
+
+def _parse_nth(formula: str) -> Tuple[int, int]:
+    match = _NTH.match(formula)
+    if not match:
+        raise ValueError(f"Invalid an+b: {formula!r}")
+    if match.group('odd'):
+        return 2, 1
+    if match.group('even'):
+        return 2, 0
+    if match.group('int') is not None:
+        return 0, int(match.group('int'))
+    a = match.group('a')
+    a = 1 if a in ('', '+') else -1 if a == '-' else int(a)
+    b = int(match.group('b') or 0)
+    return a, -b if match.group('sign') == '-' else b
+
+
+# ----------------------------------------------------------------------
+# Selector matching
+# ----------------------------------------------------------------------
+
+def matches(element: Element, selector: list, scope: Element = None) -> bool:
+    """True if an element matches a parsed complex selector (relative to `scope` for :has arguments)"""
+    return _match_from(element, selector, len(selector) - 1, scope)
+
+
+def _match_from(element: Element, parts: list, index: int, scope: Optional[Element]) -> bool:
+    combinator, compound = parts[index]
+    if not _match_compound(element, compound):
+        return False
+
+    if index == 0:
+        if scope is None:
+            return True
+        # The first compound of a relative selector is anchored to the scope element
+        combinator = combinator or ' '
+        if combinator == '>':
+            return element.parent is scope
+        if combinator == ' ':
+            return any(ancestor is scope for ancestor in _ancestors(element))
+        siblings = element.parent.children[:element.index] if element.parent else []
+        if combinator == '+':
+            return bool(siblings) and siblings[-1] is scope
+        return any(sibling is scope for sibling in siblings)
+
+    if combinator == '>':
+        return _is_element(element.parent) and _match_from(element.parent, parts, index - 1, scope)
+    if combinator == ' ':
+        return any(_match_from(ancestor, parts, index - 1, scope) for ancestor in _ancestors(element))
+    siblings = element.parent.children[:element.index] if element.parent else []
+    if combinator == '+':
+        return bool(siblings) and _match_from(siblings[-1], parts, index - 1, scope)
+    return any(_match_from(sibling, parts, index - 1, scope) for sibling in reversed(siblings))
+
+
+def _is_element(node: Optional[Element]) -> bool:
+    return node is not None and node.tag != '#document'
+
+
+def _ancestors(element: Element):
+    parent = element.parent
+    while _is_element(parent):
+        yield parent
+        parent = parent.parent
+
+
+def _descendants(element: Element):
+    for _, child in element.walk():
+        yield child
+
+
+def _match_compound(element: Element, compound: tuple) -> bool:
+    for test in compound:
+        kind = test[0]
+        if kind == 'tag':
+            if element.tag != test[1]:
+                return False
+        elif kind == 'class':
+            if test[1] not in element.classes:
+                return False
+        elif kind == 'id':
+            if element.id != test[1]:
+                return False
+        elif kind == 'attr':
+            if not _match_attribute(element, *test[1:]):
+                return False
+        elif kind == 'is':
+            if not any(matches(element, selector) for selector in test[1]):
+                return False
+        elif kind == 'not':
+            if any(matches(element, selector) for selector in test[1]):
+                return False
+        elif kind == 'has':
+            if not _match_has(element, test[1]):
+                return False
+        elif kind == 'nth':
+            if not _match_nth(element, *test[1:]):
+                return False
+        elif kind == 'scope':
+            if element.parent is None or element.parent.tag != '#document':
+                return False
+        elif not _match_pseudo(element, test[1], test[2]):
+            return False
+    return True
+
+
+def _match_attribute(element: Element, name: str, op: Optional[str], value: Optional[str], ignore_case: bool) -> bool:
+    if name not in element.attrs:
+        return False
+    if op is None:
+        return True
+    actual = element.attrs[name].lower() if ignore_case else element.attrs[name]
+    if op == '=':
+        return actual == value
+    if op == '~=':
+        return value in actual.split()
+    if op == '|=':
+        return actual == value or actual.startswith(value + '-')
+    if not value:
+        return False
+    if op == '^=':
+        return actual.startswith(value)
+    if op == '$=':
+        return actual.endswith(value)
+    return value in actual
+
+
+def _match_has(element: Element, selectors: List[list]) -> bool:
+    for selector in selectors:
+        if selector[0][0] in ('+', '~'):
+            following = element.parent.children[element.index + 1:] if element.parent else []
+            candidates = [node for sibling in following for node in [sibling, *_descendants(sibling)]]
+        else:
+            candidates = _descendants(element)
+        if any(matches(candidate, selector, scope=element) for candidate in candidates):
+            return True
+    return False
+
+
+def _match_nth(element: Element, last: bool, of_type: bool, a: int, b: int, of: Optional[List[list]]) -> bool:
+    siblings = element.parent.children if element.parent else [element]
+    if of_type:
+        siblings = [sibling for sibling in siblings if sibling.tag == element.tag]
+    if of is not None:
+        if not any(matches(element, selector) for selector in of):
+            return False
+        siblings = [sibling for sibling in siblings if any(matches(sibling, selector) for selector in of)]
+    position = siblings.index(element) + 1
+    if last:
+        position = len(siblings) - position + 1
+    if a == 0:
+        return position == b
+    return (position - b) % a == 0 and (position - b) // a >= 0
+
+
+def _match_pseudo(element: Element, name: str, arguments: Optional[str]) -> bool:
+    """
+    Match the remaining pseudo-classes.
+
+    Structural and attribute-based states are decided from the document;
+    interaction states (:hover, :focus, :invalid, ...) and anything unknown
+    count as matching, since their rules may apply as soon as the user
+    interacts with the page and must not be missing from the critical CSS.
+    """
+    attrs = element.attrs
+    siblings = element.parent.children if element.parent else [element]
+    if name == 'root':
+        return element.parent is not None and element.parent.tag == '#document'
+    if name == 'empty':
+        return not element.children and not element.has_text
+    if name == 'first-child':
+        return element.index == 0
+    if name == 'last-child':
+        return element.index == len(siblings) - 1
+    if name == 'only-child':
+        return len(siblings) == 1
+    if name in ('first-of-type', 'last-of-type', 'only-of-type'):
+        same = [sibling for sibling in siblings if sibling.tag == element.tag]
+        if name == 'only-of-type':
+            return len(same) == 1
+        return same[0 if name == 'first-of-type' else -1] is element
+    if name in ('link', 'any-link'):
+        return element.tag in ('a', 'area') and 'href' in attrs
+    if name == 'checked':
+        return 'checked' in attrs or (element.tag == 'option' and 'selected' in attrs)
+    if name == 'disabled':
+        return element.tag in FORM_CONTROLS and 'disabled' in attrs
+    if name == 'enabled':
+        return element.tag in FORM_CONTROLS and 'disabled' not in attrs
+    if name == 'required':
+        return 'required' in attrs
+    if name == 'optional':
+        return element.tag in ('input', 'select', 'textarea') and 'required' not in attrs
+    if name in ('read-only', 'read-write'):
+        writable = element.tag in ('input', 'textarea') and 'readonly' not in attrs and 'disabled' not in attrs
+        return writable == (name == 'read-write')
+    if name == 'placeholder-shown':
+        return 'placeholder' in attrs and not attrs.get('value')
+    if name == 'open':
+        return 'open' in attrs
+    if name in ('lang', 'dir') and arguments:
+        wanted = arguments.strip().strip('"\'').lower()
+        for node in [element, *_ancestors(element)]:
+            if name in node.attrs:
+                value = node.attrs[name].lower()
+                return value == wanted or (name == 'lang' and value.startswith(wanted + '-'))
+        return name == 'dir' and wanted == 'ltr'
+    return True
+
+
+# ----------------------------------------------------------------------
+# Critical CSS extraction
+# ----------------------------------------------------------------------
+
+def resolve_nested(selector: str, parent: Optional[str]) -> str:
+    """Turn a nested selector into a standalone one by substituting its parent selector list for `&`"""
+    if parent is None:
+        return selector
+    if '&' in selector:
+        return selector.replace('&', f':is({parent})')
+    return f":is({parent}) {selector.strip()}"
+
+
+class CriticalCSS:
+    """
+    Extract the rules of a set of stylesheets that match a rendered page.
+
+    Results are cached by page structure: the tree of tags, ids, classes and
+    the attributes selectors can test, without text or other attribute values.
+    Repeated renders of the same template therefore skip matching entirely.
+    """
+
+    def __init__(self,
+                 stylesheets: List[str],
+                 base_dir: str = "css",
+                 cache_size: int = 256,
+                 drop_unused_props: bool = True,
+                 prefix: str = "/static/css"):
+        """
+        Initialize Critical CSS.
+
+        Args:
+            stylesheets: Entry stylesheets the page links; their imports are inlined (see bundle.CSSBundler)
+            base_dir: Root of the vendored tree, for resolving absolute import paths
+            cache_size: Number of page structures whose critical CSS is kept
+            drop_unused_props: Drop custom properties nothing in the critical CSS (or an inline style) uses
+            prefix: URL the base_dir folder is served under; relative url()s are resolved against it,
+                since an inline <style> resolves them against the page instead
+        """
+        bundler = CSSBundler(base_dir)
+        css = '\n'.join(bundler.build(Path(path), output_dir=Path(base_dir)) for path in stylesheets)
+        self.css = strip_comments(_absolute_urls(css, prefix))
+        self.sheet = parse(self.css)
+        self.cache_size = cache_size
+        self.drop_unused_props = drop_unused_props
+        self.attributes = set(re.findall(r'\[\s*(?:[\w*-]*\|)?([\w-]+)', self.css)) | STATE_ATTRIBUTES
+        self.hits = 0
+        self.misses = 0
+        self._selectors: Dict[str, Optional[list]] = {}
+        self._cache: OrderedDict = OrderedDict()
+
+    def structure_key(self, root: Element) -> str:
+        """Hash of everything about a document that selector matching can observe"""
+        digest = hashlib.sha1()
+        for depth, element in root.walk():
+            attrs = sorted((name, value) for name, value in element.attrs.items() if name in self.attributes)
+            style_vars = VAR_PATTERN.findall(element.attrs.get('style', ''))
+            digest.update(repr((depth, element.tag, element.id, sorted(element.classes), attrs,
+                                element.has_text, style_vars)).encode())
+        return digest.hexdigest()
+
+    def extract(self, html: str) -> str:
+        """Return the minified critical CSS of an HTML document"""
+        root = parse_html(html)
+        key = self.structure_key(root)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+
+        self.misses += 1
+        critical = self._extract(root)
+        self._cache[key] = critical
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return critical
+
+    def _extract(self, root: Element) -> str:
+        elements = [element for _, element in root.walk()]
+        usage = {'tags': {element.tag for element in elements},
+                 'classes': {name for element in elements for name in element.classes},
+                 'ids': {element.id for element in elements if element.id}}
+
+        text = self._extract_block(self.css, self.sheet, elements, usage, None)
+        if self.drop_unused_props:
+            definitions, roots = custom_property_graph([text])
+            for element in elements:
+                roots.update(VAR_PATTERN.findall(element.attrs.get('style', '')))
+            text = strip_properties(text, live_properties(definitions, roots))
+        return minify(self._drop_unused_keyframes(text))
+
+    def _parsed(self, selector: str) -> Optional[list]:
+        if selector not in self._selectors:
+            try:
+                self._selectors[selector] = parse_selector(selector)
+            except ValueError:
+                # Kept rather than risk a flash of unstyled content
+                self._selectors[selector] = None
+        return self._selectors[selector]
+
+    def _matches_any(self, selector: str, elements: List[Element], usage: Dict[str, set]) -> bool:
+        # Cheap satisfiability check first: most rules mention a class the page doesn't have
+        if not selector_can_match(selector, usage):
+            return False
+        parsed = self._parsed(selector)
+        return parsed is None or any(matches(element, parsed) for element in elements)
+
+    def _extract_block(self, text: str, block: Block, elements: List[Element], usage: Dict[str, set],
+                       parent: Optional[str]) -> str:
+        out = []
+        for node in block.children:
+            if not isinstance(node, Block) or node.body_start is None:
+                out.append(node.source(text))
+                continue
+
+            head = node.head(text)
+            if isinstance(node, AtRule):
+                if node.name not in GROUPING_RULES:
+                    out.append(f"{head} {{{node.body(text)}}}")
+                    continue
+                inner = self._extract_block(text, node, elements, usage, parent)
+                if inner.strip():
+                    out.append(f"{head} {{\n{inner}\n}}")
+                elif node.name == 'layer' and node.prelude:
+                    out.append(f"{head};")
+                continue
+
+            kept = [selector for selector in split_top(node.prelude)
+                    if self._matches_any(resolve_nested(selector, parent), elements, usage)]
+            if kept:
+                nested_parent = ', '.join(resolve_nested(selector, parent) for selector in kept)
+                inner = self._extract_block(text, node, elements, usage, nested_parent)
+                out.append(f"{', '.join(kept)} {{\n{inner}\n}}")
+        return '\n'.join(out)
+
+    @staticmethod
+    def _drop_unused_keyframes(text: str) -> str:
+        """Remove @keyframes whose name no remaining declaration or custom property mentions"""
+        names = set(_KEYFRAMES.findall(text))
+        if not names:
+            return text
+        outside = _filter_keyframes(text, set())
+        used = {name for name in names if re.search(rf'(?<![\w-]){re.escape(name)}(?![\w-])', outside)}
+        return _filter_keyframes(text, used)
+
+    def inline(self, html: str) -> str:
+        """
+        Inline the critical CSS of a document and load its stylesheets without blocking render.
+
+        The critical rules go in a <style> before the first stylesheet link. Each
+        stylesheet link is switched to media="print" and back on load (with a
+        <noscript> fallback), so the full stylesheets still arrive and win the
+        cascade as before. Documents without a <head> (e.g. htmx partials) are
+        returned unchanged.
+        """
+        if not re.search(r'<head[\s>]', html, re.IGNORECASE):
+            return html
+
+        style = f"<style data-critical>{self.extract(html)}</style>"
+        links = [match for match in _LINK_TAG.finditer(html)
+                 if re.search(r'\brel\s*=\s*["\']?stylesheet\b', match.group(0), re.IGNORECASE)]
+        if not links:
+            position = re.search(r'</head\s*>', html, re.IGNORECASE)
+            position = position.start() if position else re.search(r'<head[^>]*>', html, re.IGNORECASE).end()
+            return html[:position] + style + html[position:]
+
+        out = [html[:links[0].start()], style]
+        position = links[0].start()
+        for match in links:
+            out.append(html[position:match.start()])
+            out.append(_defer_link(match.group(0)))
+            position = match.end()
+        out.append(html[position:])
+        return ''.join(out)
+
+
+def _filter_keyframes(text: str, keep: set, block: Optional[Block] = None) -> str:
+    """Drop the @keyframes blocks (at any grouping depth) whose name is not in `keep`"""
+    out = []
+    for node in (parse(text) if block is None else block).children:
+        if not isinstance(node, Block) or node.body_start is None:
+            out.append(node.source(text))
+            continue
+        head = node.head(text)
+        keyframes = _KEYFRAMES.match(head + '{')
+        if keyframes:
+            if keyframes.group(1) in keep:
+                out.append(f"{head} {{{node.body(text)}}}")
+        elif isinstance(node, AtRule) and node.name in GROUPING_RULES:
+            out.append(f"{head} {{\n{_filter_keyframes(text, keep, node)}\n}}")
+        else:
+            out.append(f"{head} {{{node.body(text)}}}")
+    return '\n'.join(out)
+
+
+def _absolute_urls(css: str, prefix: str) -> str:
+    """Resolve url() references relative to the served base_dir folder against its public URL"""
+    base = prefix.rstrip('/') + '/'
+
+    def resolve(match):
+        quote, url = match.group(1), match.group(2).strip()
+        if is_external(url) or url.startswith(('/', '#')):
+            return match.group(0)
+        return f"url({quote}{urljoin(base, url)}{quote})"
+
+    return URL_PATTERN.sub(resolve, css)
+
+
+def _defer_link(tag: str) -> str:
+    """Rewrite a stylesheet <link> to load without blocking render"""
+    media = re.search(r'\smedia\s*=\s*(["\'])(.*?)\1', tag, re.IGNORECASE)
+    original = media.group(2) if media else 'all'
+    deferred = tag if media is None else tag[:media.start()] + tag[media.end():]
+    deferred = deferred[:-1].rstrip().rstrip('/').rstrip()
+    return f"{deferred} media=\"print\" onload=\"this.media='{original}'\"><noscript>{tag}</noscript>"
+
+
+class CriticalCSSMiddleware:
+    """
+    ASGI middleware that inlines critical CSS into every full HTML page a FastHTML app renders.
+
+    Responses that are not uncompressed text/html, or that have no <head>, are
+    passed through untouched, and so are HEAD requests, whose content-length
+    must stay the one the GET body would have.
+    """
+
+    def __init__(self, app, critical: CriticalCSS):
+        self.app = app
+        self.critical = critical
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('method') == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        start = None
+        chunks = []
+
+        async def capture(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                           for name, value in message.get('headers', [])}
+                if headers.get('content-type', '').startswith('text/html') and 'content-encoding' not in headers:
+                    start = message
+                    return
+            elif message['type'] == 'http.response.body' and start is not None:
+                chunks.append(message.get('body', b''))
+                if message.get('more_body'):
+                    return
+                original = b''.join(chunks)
+                html = original.decode('utf-8', errors='replace')
+                inlined = self.critical.inline(html)
+                if inlined == html:
+                    # Nothing was inlined (no <head>): the response goes out exactly as the app sent it
+                    await send(start)
+                    await send({'type': 'http.response.body', 'body': original})
+                    return
+                body = inlined.encode()
+                headers = [(name, value) for name, value in start.get('headers', [])
+                           if name.lower() != b'content-length']
+                await send({**start, 'headers': headers + [(b'content-length', str(len(body)).encode())]})
+                await send({'type': 'http.response.body', 'body': body})
+                return
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+
+def inline_critical(app, stylesheets: List[str], base_dir: str = "css", prefix: str = "/static/css") -> CriticalCSS:
+    """
+    Inline critical CSS into every page of a FastHTML (or any Starlette) app.
+
+    Example:
+        app, rt = fast_app(hdrs=stylesheet_links("ui/main.css"), pico=False)
+        inline_critical(app, ["css/ui/main.css"])
+
+    Returns:
+        The CriticalCSS, e.g. to check its cache hits and misses
+    """
+    critical = CriticalCSS(stylesheets, base_dir, prefix=prefix)
+    app.add_middleware(CriticalCSSMiddleware, critical=critical)
+    return critical
+
+
+def render_route(app, path: str = "/") -> str:
+    """Render a route of an ASGI app in-process and return the response body"""
+    async def fetch() -> str:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            response = await client.get(path)
+            response.raise_for_status()
+            return response.text
+
+    return asyncio.run(fetch())
+
+
+def load_app(spec: str):
+    """Import an app from a "module:attribute" spec (default attribute: app)"""
+    module, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module), attribute or 'app')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inline the critical CSS of a rendered page")
+    parser.add_argument("page", nargs="?", help="Rendered HTML file (or use --app and --route)")
+    parser.add_argument("--app", help="FastHTML app to render in-process, as module:attribute")
+    parser.add_argument("--route", default="/", help="Route of --app to render")
+    parser.add_argument("--css", nargs="+", default=["css/ui/main.css"], metavar="ENTRY",
+                        help="Entry stylesheets the page links")
+    parser.add_argument("--base-dir", default="css", help="Root of the vendored tree")
+    parser.add_argument("--prefix", default="/static/css", help="URL the vendored tree is served under")
+    parser.add_argument("--keep-props", action="store_true", help="Keep every custom property the page matches")
+    parser.add_argument("-o", "--output", help="Write the page with inlined critical CSS here")
+    args = parser.parse_args()
+
+    if args.app:
+        html = render_route(load_app(args.app), args.route)
+    elif args.page:
+        html = Path(args.page).read_text()
+    else:
+        parser.error("give a page or --app")
+
+    critical = CriticalCSS(args.css, args.base_dir, drop_unused_props=not args.keep_props, prefix=args.prefix)
+    started = time.perf_counter()
+    css = critical.extract(html)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"✓ Critical CSS: {len(css)} of {len(critical.css)} bytes ({elapsed:.0f} ms)")
+
+    if args.output:
+        Path(args.output).write_text(critical.inline(html))
+        print(f"✓ Wrote {args.output}")
@@ -0,0 +1,384 @@
+from pathlib import Path
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Only the tokens that decide structure; the text between them (identifiers, numbers, whitespace)
+# is never visited. Quoted strings and comments may be unterminated at the end of the input.
+_TOKEN = re.compile(r'''
+    (?P<comment>/\*.*?(?:\*/|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\.)*(?:"|$)|'(?:[^'\\\n]|\\.)*(?:'|$))
+  | (?P<url>(?<![\w-])url\(\s*(?:[^)"'\s\\]|\\.)*\s*\))
+  | (?P<var>(?<![\w-])var\(\s*--(?:[\w-]|\\.)+)
+  | (?P<escape>\\.)
+  | (?P<delim>[{}()\[\];])
+''', re.DOTALL | re.IGNORECASE | re.MULTILINE | re.VERBOSE)
+
+_COMMENTS = re.compile(r'("(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')|/\*.*?(?:\*/|\Z)', re.DOTALL)
+_IMPORTANT = re.compile(r'\s*!\s*important\s*$', re.IGNORECASE)
+# A comment that cannot run past its own end, for patterns that continue after it
+_COMMENT = r'/\*(?:[^*]|\*(?!/))*(?:\*/|\Z)'
+_SKIP = re.compile(rf'(?:\s|{_COMMENT})*')
+_CUSTOM = re.compile(rf'(?:\s|{_COMMENT})*--(?:[\w-]|\\.)+(?:\s|{_COMMENT})*:')
+
+# Parsed stylesheets kept in memory, keyed by a digest of their text
+CACHE_SIZE = 512
+
+
+def tokenize(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Split a stylesheet into tokens in one pass.
+
+    Only what decides the structure is reported: comments, strings, unquoted
+    url(), var() references (up to the property name), escapes and the
+    delimiters {}()[];. Everything in between is skipped by the regex engine,
+    which keeps the pass fast on large minified files.
+
+    Yields:
+        (kind, start, end) for each token, in source order
+    """
+    for match in _TOKEN.finditer(text):
+        yield match.lastgroup, match.start(), match.end()
+
+
+def strip_comments(text: str) -> str:
+    """Remove /* */ comments, leaving string literals untouched"""
+    if '/*' not in text:
+        return text
+    return _COMMENTS.sub(lambda match: match.group(1) or '', text)
+
+
+def _strip(text: str) -> str:
+    """Remove comments from a prelude or value, leaving strings untouched"""
+    return strip_comments(text).strip()
+
+
+class Node:
+    """A node of the stylesheet tree, spanning text[start:end] of the parsed source"""
+    __slots__ = ('start', 'end')
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+
+    def source(self, text: str) -> str:
+        """The node as written in text (the source it was parsed from), without comments"""
+        return _strip(text[self.start:self.end])
+
+
+class Declaration(Node):
+    """`name: value` inside a block; name is lowercased unless it is a custom property"""
+    __slots__ = ('name', 'value', 'important')
+
+    def __init__(self, start: int, end: int, name: str, value: str, important: bool):
+        super().__init__(start, end)
+        self.name = name
+        self.value = value
+        self.important = important
+
+    @property
+    def custom(self) -> bool:
+        return self.name.startswith('--')
+
+
+class Block(Node):
+    """A rule or at-rule with a `{}` block; its body is text[body_start:end - 1]"""
+    __slots__ = ('prelude', 'body_start', 'children')
+
+    def __init__(self, start: int, prelude: str, body_start: int):
+        super().__init__(start, body_start)
+        self.prelude = prelude
+        self.body_start = body_start
+        self.children: List[Node] = []
+
+    @property
+    def declarations(self) -> List[Declaration]:
+        return [child for child in self.children if isinstance(child, Declaration)]
+
+    def head(self, text: str) -> str:
+        """Everything before the `{` as written (the selector list, or the at-rule with its keyword), without comments"""
+        return _strip(text[self.start:self.body_start - 1])
+
+    def body(self, text: str) -> str:
+        """The text between the braces, without comments"""
+        end = self.end - 1 if text[self.end - 1:self.end] == '}' else self.end
+        return strip_comments(text[self.body_start:end])
+
+
+class Rule(Block):
+    """A style rule; prelude is its selector list. Nested rules are among its children"""
+    __slots__ = ()
+
+
+class AtRule(Block):
+    """An at-rule such as @media or @layer; statements (`@layer a, b;`) have no children and body_start None"""
+    __slots__ = ('name',)
+
+    def __init__(self, start: int, name: str, prelude: str, body_start: Optional[int]):
+        super().__init__(start, prelude, body_start)
+        self.name = name
+
+    @property
+    def statement(self) -> bool:
+        return self.body_start is None
+
+
+class Import(AtRule):
+    """An @import statement with its url and layer/supports/media conditions (see parse_import)"""
+    __slots__ = ('url', 'layer', 'supports', 'media')
+
+    def __init__(self, start: int, prelude: str, conditions: Dict):
+        super().__init__(start, 'import', prelude, None)
+        self.url = conditions['url']
+        self.layer = conditions['layer']
+        self.supports = conditions['supports']
+        self.media = conditions['media']
+
+    def as_dict(self) -> Dict:
+        """The import as bundle.scan_imports used to report it"""
+        return {'url': self.url, 'layer': self.layer, 'supports': self.supports, 'media': self.media,
+                'start': self.start, 'end': self.end}
+
+
+class Stylesheet(Block):
+    """
+    Root of a parsed stylesheet, with indexes built during the same pass.
+
+    Stylesheets are cached and shared between callers (see parse), so they
+    must be treated as read-only.
+    """
+    __slots__ = ('imports', 'layers', 'var_refs', 'properties')
+
+    def __init__(self, length: int):
+        super().__init__(0, '', 0)
+        self.end = length
+        # Top-level @import statements; imports after other rules are ignored by browsers but still listed
+        self.imports: List[Import] = []
+        # Named layers in the order they are first declared, by statements or blocks; nested ones by full name
+        self.layers: List[str] = []
+        # (referenced property, offset, custom property whose value holds the reference or None)
+        self.var_refs: List[Tuple[str, int, Optional[str]]] = []
+        # Declarations of each custom property, in source order
+        self.properties: Dict[str, List[Declaration]] = {}
+
+    def walk(self) -> Iterator[Tuple[Node, Tuple[Block, ...]]]:
+        """Yield every node depth first, with the blocks around it (outermost first, the stylesheet excluded)"""
+        pending = [(child, ()) for child in reversed(self.children)]
+        while pending:
+            node, ancestors = pending.pop()
+            yield node, ancestors
+            if isinstance(node, Block):
+                pending.extend((child, ancestors + (node,)) for child in reversed(node.children))
+
+
+def parse_import(prelude: str) -> Optional[Dict]:
+    """
+    Parse the part of an @import statement after the keyword.
+
+    Returns:
+        dict: url, layer (None, '' for an anonymous layer, or the layer name), supports and media
+    """
+    prelude = prelude.strip()
+    match = re.match(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)|([\'"])(.*?)\3', prelude, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return None
+
+    url = match.group(2) if match.group(2) is not None else match.group(4)
+    rest = prelude[match.end():].strip()
+
+    layer = None
+    layer_match = re.match(r'layer(?:\(\s*([^)]*?)\s*\))?(?=\s|$|supports|\()', rest, re.IGNORECASE)
+    if layer_match:
+        layer = layer_match.group(1) or ''
+        rest = rest[layer_match.end():].strip()
+
+    supports = None
+    if rest.lower().startswith('supports('):
+        depth = 0
+        for index, char in enumerate(rest):
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    supports = rest[len('supports('):index].strip()
+                    rest = rest[index + 1:].strip()
+                    break
+
+    return {'url': url, 'layer': layer, 'supports': supports, 'media': rest or None}
+
+
+class _Parser:
+    """Build a Stylesheet from the token stream, keeping only a stack of the open blocks"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.sheet = Stylesheet(len(text))
+        self.stack: List[Block] = [self.sheet]
+        self._reset(0)
+
+    def parse(self) -> Stylesheet:
+        text = self.text
+        for kind, start, end in tokenize(text):
+            if kind == 'var':
+                self.refs.append((text[start:end].split('(', 1)[1].strip(), start))
+                self.depth += 1
+                continue
+            if kind != 'delim':
+                continue
+
+            char = text[start]
+            if char in '([':
+                self.depth += 1
+            elif char in ')]':
+                self.depth = max(self.depth - 1, 0)
+            elif self.custom:
+                if char == '{':
+                    self.braces += 1
+                elif char == '}' and self.braces:
+                    self.braces -= 1
+                elif char == ';' and not self.braces and not self.depth:
+                    self._finish(end)
+                elif char == '}':
+                    self._finish(start)
+                    self._close(start)
+            elif self.depth:
+                continue
+            elif char == ';':
+                self._finish(end)
+            elif char == '{':
+                self._open(start)
+            elif char == '}':
+                self._finish(start)
+                self._close(start)
+
+        self._finish(len(text))
+        while len(self.stack) > 1:
+            self._close(len(text) - 1)
+        return self.sheet
+
+    def _reset(self, boundary: int):
+        """Start a new item after the `;`, `{` or `}` ending at boundary"""
+        self.boundary = boundary
+        self.refs: List[Tuple[str, int]] = []  # var() references of the current item
+        self.depth = 0                          # () and [] nesting inside the current item
+        self.braces = 0                         # {} nesting inside a custom-property value
+        # Custom-property values may hold braces and semicolons in brackets; they do not open blocks
+        self.custom = _CUSTOM.match(self.text, boundary) is not None
+
+    def _item_start(self) -> int:
+        """Offset of the first character of the current item, past whitespace and comments"""
+        return _SKIP.match(self.text, self.boundary).end()
+
+    def _finish(self, end: int):
+        """End the current item as a declaration or an at-rule statement"""
+        start = self._item_start()
+        item = _strip(self.text[start:end].rstrip(';')) if start < end else ''
+        parent = self.stack[-1]
+        node = None
+
+        if item.startswith('@'):
+            name = re.match(r'@([\w-]*)', item).group(1).lower()
+            prelude = item[len(name) + 1:].strip()
+            if name == 'import' and parent is self.sheet:
+                conditions = parse_import(prelude)
+                if conditions:
+                    node = Import(start, prelude, conditions)
+                    self.sheet.imports.append(node)
+            else:
+                node = AtRule(start, name, prelude, None)
+                if name == 'layer':
+                    self._declare_layers(prelude)
+        else:
+            name, separator, value = item.partition(':')
+            name = name.strip()
+            if separator and name:
+                if name.startswith('--'):
+                    # Custom-property values are kept verbatim, apart from !important
+                    value, important = _IMPORTANT.subn('', value)
+                else:
+                    name = name.lower()
+                    value, important = _IMPORTANT.subn('', value.strip())
+                node = Declaration(start, end, name, value.strip(), bool(important))
+                if node.custom:
+                    self.sheet.properties.setdefault(name, []).append(node)
+
+        if node is not None:
+            node.end = end
+            parent.children.append(node)
+            owner = node.name if isinstance(node, Declaration) and node.custom else None
+            self.sheet.var_refs.extend((ref, offset, owner) for ref, offset in self.refs)
+        self._reset(end)
+
+    def _open(self, brace: int):
+        """Open a rule or at-rule block at the `{` at offset brace"""
+        start = self._item_start()
+        prelude = _strip(self.text[start:brace])
+        if prelude.startswith('@'):
+            name = re.match(r'@([\w-]*)', prelude).group(1).lower()
+            block = AtRule(start, name, prelude[len(name) + 1:].strip(), brace + 1)
+            if name == 'layer':
+                self._declare_layers(block.prelude)
+        else:
+            block = Rule(start, prelude, brace + 1)
+        # var() in an at-rule prelude (e.g. @container style(--x: var(--y))) is a plain reference
+        self.sheet.var_refs.extend((ref, offset, None) for ref, offset in self.refs)
+        self.stack[-1].children.append(block)
+        self.stack.append(block)
+        self._reset(brace + 1)
+
+    def _close(self, brace: int):
+        if len(self.stack) > 1:
+            self.stack.pop().end = brace + 1
+        self._reset(brace + 1)
+
+    def _declare_layers(self, prelude: str):
+        """Record the layers a statement or block names, under the full names the enclosing layers give them"""
+        parents = [block.prelude for block in self.stack if isinstance(block, AtRule) and block.name == 'layer']
+        if not all(parents):
+            return  # inside an anonymous layer, which nothing outside can refer to
+        prefix = ''.join(f"{parent}." for parent in parents)
+        for name in prelude.split(','):
+            name = name.strip()
+            if name and prefix + name not in self.sheet.layers:
+                self.sheet.layers.append(prefix + name)
+
+
+_cache: 'OrderedDict[str, Stylesheet]' = OrderedDict()
+
+
+def parse(text: str) -> Stylesheet:
+    """
+    Parse a stylesheet into a tree of slotted nodes with source offsets.
+
+    Results are cached by a digest of the text, so every tool that parses the
+    same file content (import validation, bundling, pruning, ...) shares one
+    parse per process.
+
+    Args:
+        text: Stylesheet source
+
+    Returns:
+        The shared, read-only Stylesheet
+    """
+    key = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    sheet = _cache.get(key)
+    if sheet is not None:
+        _cache.move_to_end(key)
+        return sheet
+    sheet = _Parser(text).parse()
+    _cache[key] = sheet
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return sheet
+
+
+def parse_file(path: Path) -> Stylesheet:
+    """Parse a stylesheet file (see parse)"""
+    return parse(Path(path).read_text())
+
+
+def clear_cache():
+    """Forget every cached parse"""
+    _cache.clear()
@@ -0,0 +1,239 @@
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+from bundle import CSSBundler, default_entries, drop_overridden, index_rules, is_generated, minify
+
+
+def _scope(rule: Dict, same_layer: bool) -> tuple:
+    """The context rules are compared in: always the same conditions, and the same layer if asked"""
+    if same_layer:
+        return rule['context']
+    return tuple(condition for condition in rule['context'] if not condition.startswith('@layer'))
+
+
+def _rule_key(rule: Dict, same_layer: bool = True) -> tuple:
+    return _scope(rule, same_layer), tuple(rule['selectors']), tuple(rule['declarations'])
+
+
+class RuleIndex:
+    """
+    Normalized index of the style rules of every vendored stylesheet, across sources.
+
+    Each rule is indexed by its selectors, declarations and the cascade context
+    its file gives it (see bundle.index_rules), so the same rule written in two
+    styles (minified or not, upstream or local copy) gets the same key.
+    Contexts are file-local: the layer an importer adds with `@import ...
+    layer(x)` is not part of them. Copies of a rule often sit in different
+    layers (a local utils.css in `@layer utils`, the upstream one unlayered),
+    so duplicates and shadowing are matched across layers by default (but
+    always under the same @media, @supports, ... conditions).
+    """
+
+    def __init__(self, base_dir: str = "css"):
+        """
+        Initialize Rule Index.
+
+        Args:
+            base_dir: Root of the vendored tree, for resolving entry imports and display paths
+        """
+        self.base_dir = Path(base_dir)
+        self.rules: List[Dict] = []
+        # Digest of each file's minified content, so reformatted copies still compare equal
+        self.digests: Dict[Path, str] = {}
+
+    def add_file(self, path: Path):
+        """Index the rules of one stylesheet"""
+        path = Path(path)
+        text = path.read_text()
+        self.digests[path] = hashlib.sha256(minify(text).encode()).hexdigest()
+        for rule in index_rules(text):
+            rule['file'] = path
+            self.rules.append(rule)
+
+    def add_tree(self, root: str):
+        """Index every stylesheet under a directory, except the ones the bundle step generated"""
+        for path in sorted(Path(root).rglob('*.css')):
+            if not is_generated(path):
+                self.add_file(path)
+
+    def duplicate_files(self) -> List[List[Path]]:
+        """Groups of files whose minified contents are identical"""
+        groups: Dict[str, List[Path]] = {}
+        for path, digest in self.digests.items():
+            groups.setdefault(digest, []).append(path)
+        return [paths for paths in groups.values() if len(paths) > 1]
+
+    def _candidates(self, skip_files: List[List[Path]] = None) -> List[Dict]:
+        """Rules with declarations, counting each group of identical files once"""
+        skipped = {path for paths in skip_files or [] for path in paths[1:]}
+        return [rule for rule in self.rules if rule['file'] not in skipped and rule['declarations']]
+
+    def duplicate_rules(self, skip_files: List[List[Path]] = None, same_layer: bool = False) -> List[List[Dict]]:
+        """
+        Groups of rules with the same selectors and declarations.
+
+        Args:
+            skip_files: Groups of duplicate files; only the first file of each is considered,
+                so whole-file copies are reported once by duplicate_files instead of rule by rule
+            same_layer: Only group rules that are also in the same cascade layer
+        """
+        groups: Dict[tuple, List[Dict]] = {}
+        for rule in self._candidates(skip_files):
+            groups.setdefault(_rule_key(rule, same_layer), []).append(rule)
+        return [rules for rules in groups.values() if len(rules) > 1]
+
+    def shadowed_rules(self,
+                       skip_files: List[List[Path]] = None,
+                       same_layer: bool = False) -> List[Tuple[Dict, List[Dict]]]:
+        """
+        Rules that other rules shadow for each of their selectors.
+
+        A rule is shadowed when, for every one of its selectors, some other rule
+        with that selector declares every property it does (with at least the
+        same importance) under the same conditions. Which of the two wins
+        depends on load order and layers, so each is reported as a candidate
+        rather than dropped. Two rules declaring the same properties shadow each
+        other and are reported once; exact duplicates are left to duplicate_rules.
+
+        Args:
+            skip_files: See duplicate_rules
+            same_layer: Only count rules in the same cascade layer as shadowing
+
+        Returns:
+            List of (shadowed rule, the rules that shadow it)
+        """
+        rules = self._candidates(skip_files)
+        by_selector: Dict[Tuple[tuple, str], List[Dict]] = {}
+        for rule in rules:
+            for selector in rule['selectors']:
+                by_selector.setdefault((_scope(rule, same_layer), selector), []).append(rule)
+
+        shadowed = []
+        reported = set()
+        for rule in rules:
+            shadows = []
+            for selector in rule['selectors']:
+                cover = next((other for other in by_selector[(_scope(rule, same_layer), selector)]
+                              if other is not rule and not other['nested']
+                              and _rule_key(other, same_layer) != _rule_key(rule, same_layer)
+                              and _covers(other, rule)), None)
+                if cover is None:
+                    break
+                shadows.append(cover)
+            else:
+                shadows = list({id(other): other for other in shadows}.values())
+                if len(shadows) == 1 and (id(shadows[0]), id(rule)) in reported:
+                    continue
+                reported.add((id(rule), id(shadows[0])))
+                shadowed.append((rule, shadows))
+        return shadowed
+
+    def overridden_in(self, entry: str) -> List[Dict]:
+        """
+        Rules of an entry's bundle that a later rule fully overrides (what `bundle.py --dedupe` drops).
+
+        Each rule gets a `files` list of the indexed files that define it.
+        """
+        bundler = CSSBundler(str(self.base_dir))
+        _, dropped = drop_overridden(bundler.build(Path(entry)))
+        for rule in dropped:
+            key = (tuple(rule['selectors']), tuple(rule['declarations']))
+            rule['files'] = sorted({indexed['file'] for indexed in self.rules
+                                    if (tuple(indexed['selectors']), tuple(indexed['declarations'])) == key})
+        return dropped
+
+
+def _covers(other: Dict, rule: Dict) -> bool:
+    """True if `other` declares every property of `rule` at the same or a higher importance"""
+    declared = {}
+    for name, _, important in other['declarations']:
+        declared[name] = declared.get(name, False) or important
+    return all(name in declared and (declared[name] or not important)
+               for name, _, important in rule['declarations'])
+
+
+def _describe(rule: Dict, selectors: bool = True) -> str:
+    """file: context selectors, e.g. `css/custom/utils.css: @layer utils :where(.flex)`"""
+    parts = list(rule['context']) or ['(unlayered)']
+    if selectors:
+        parts.append(', '.join(rule['selectors']))
+    return f"{os.path.relpath(rule['file'])}: {' '.join(parts)}"
+
+
+def _as_json(rule: Dict) -> Dict:
+    return {
+        'file': os.path.relpath(rule['file']) if 'file' in rule else None,
+        'context': list(rule['context']),
+        'selectors': rule['selectors'],
+        'declarations': [[name, value, important] for name, value, important in rule['declarations']],
+    }
+
+
+def analyze(roots: List[str], base_dir: str = "css", entries: List[str] = None) -> Dict:
+    """
+    Report duplicate files, exact duplicate rules, shadowed rules and overridden bundle rules.
+
+    Args:
+        roots: Directories to index (e.g. css, and custom to compare the local sources)
+        base_dir: Root of the vendored tree
+        entries: Entry stylesheets whose bundles are checked for overridden rules
+
+    Returns:
+        The report as a JSON-serializable dict
+    """
+    index = RuleIndex(base_dir)
+    for root in roots:
+        index.add_tree(root)
+
+    files = index.duplicate_files()
+    duplicates = index.duplicate_rules(files)
+    shadowed = index.shadowed_rules(files)
+    entries = [entry for entry in entries or default_entries(base_dir) if Path(entry).exists()]
+    overridden = {entry: index.overridden_in(entry) for entry in entries}
+
+    print(f"Indexed {len(index.rules)} rules in {len(index.digests)} files")
+    for paths in files:
+        print(f"✗ Identical files: {', '.join(os.path.relpath(path) for path in paths)}")
+    for rules in duplicates:
+        print(f"✗ Duplicate rule {', '.join(rules[0]['selectors'])}: "
+              f"{'; '.join(_describe(rule, selectors=False) for rule in rules)}")
+    for rule, shadows in shadowed:
+        print(f"✗ Shadowed {_describe(rule)} by {'; '.join(_describe(other) for other in shadows)}")
+    for entry, rules in overridden.items():
+        for rule in rules:
+            sources = ', '.join(os.path.relpath(path) for path in rule['files']) or 'unknown source'
+            kind = 'Overridden' if rule['declarations'] else 'No valid declarations'
+            print(f"✗ {kind} in {entry}: {' '.join(rule['context'])} {', '.join(rule['selectors'])} ({sources})")
+        if not rules:
+            print(f"✓ No overridden rules in {entry}")
+
+    return {
+        'files': len(index.digests),
+        'rules': len(index.rules),
+        'duplicate_files': [[os.path.relpath(path) for path in paths] for paths in files],
+        'duplicate_rules': [[_as_json(rule) for rule in rules] for rules in duplicates],
+        'shadowed_rules': [{'rule': _as_json(rule), 'by': [_as_json(other) for other in shadows]}
+                           for rule, shadows in shadowed],
+        'overridden_rules': {entry: [dict(_as_json(rule), files=[os.path.relpath(path) for path in rule['files']])
+                                     for rule in rules]
+                             for entry, rules in overridden.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find duplicate and shadowed CSS rules across vendored sources")
+    parser.add_argument("roots", nargs="*", default=["css"], help="Directories to index (default: css)")
+    parser.add_argument("--base-dir", default="css", help="Root of the vendored tree")
+    parser.add_argument("--entries", nargs="+", metavar="ENTRY",
+                        help="Bundles to check for overridden rules (default: ui/main.css and custom/custom.css)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    report = analyze(args.roots, args.base_dir, args.entries)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"✓ Wrote {args.json}")
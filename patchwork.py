@@ -0,0 +1,412 @@
+from pathlib import Path
+import gzip
+import hashlib
+import inspect
+import json
+import mimetypes
+import textwrap
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bundle import PAGE_TAGS, SPLIT_GROUPS, load_themes, scan_source, selector_can_match, style_selectors
+
+try:
+    from fasthtml.common import Link
+except ImportError:  # optional: only needed when rendering FastHTML headers
+    Link = None
+
+try:
+    import brotli
+except ImportError:  # optional: .br variants are only served when present or when brotli is installed
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Files in the css folder that are build bookkeeping rather than assets
+PRIVATE_FILES = {"vendor.lock.json"}
+
+
+class AssetManifest:
+    """Resolve logical stylesheet names to fingerprinted URLs using css/manifest.json"""
+
+    def __init__(self, manifest_path: str = "css/manifest.json", prefix: str = "/static/css"):
+        """
+        Initialize Asset Manifest.
+
+        Args:
+            manifest_path: Path to the manifest.json written by the bundle step
+            prefix: URL prefix the css folder is served under
+        """
+        self.manifest_path = Path(manifest_path)
+        self.prefix = prefix.rstrip('/')
+        self._entries: Dict[str, str] = None
+        self._mtime: float = None
+
+    @property
+    def entries(self) -> Dict[str, str]:
+        """Manifest entries, re-read whenever the file changes on disk"""
+        try:
+            mtime = self.manifest_path.stat().st_mtime
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            self._entries = json.loads(self.manifest_path.read_text())
+            self._mtime = mtime
+        return self._entries
+
+    def url(self, name: str) -> str:
+        """
+        Return the URL for a logical name such as "ui/main.css".
+
+        Names missing from the manifest fall back to the unhashed file, so an
+        app still works before the first fingerprinted build.
+        """
+        name = name.lstrip('/')
+        return f"{self.prefix}/{self.entries.get(name, name)}"
+
+    def is_fingerprinted(self, path: str) -> bool:
+        """True if a path (relative to the css folder) is a fingerprinted file listed in the manifest"""
+        return path.lstrip('/') in set(self.entries.values())
+
+    def link(self, name: str, **kwargs):
+        """Return a FastHTML stylesheet Link for a logical name"""
+        if Link is None:
+            raise ImportError("python-fasthtml is required to build Link tags")
+        return Link(rel='stylesheet', href=self.url(name), **kwargs)
+
+
+def stylesheet_links(*names: str,
+                     manifest_path: str = "css/manifest.json",
+                     prefix: str = "/static/css") -> tuple:
+    """
+    Build FastHTML `hdrs` entries for stylesheets resolved through the manifest.
+
+    Example:
+        hdrs = stylesheet_links("ui/main.css", "custom/custom.css")
+    """
+    manifest = AssetManifest(manifest_path, prefix)
+    return tuple(manifest.link(name) for name in names)
+
+
+def route_usage(route: Callable) -> Dict[str, set]:
+    """Tags, classes and ids a route function renders, from its source (see bundle.scan_source)"""
+    return scan_source(textwrap.dedent(inspect.getsource(route)), filename=inspect.getsourcefile(route))
+
+
+class SplitStylesheets:
+    """
+    Per-route Link tags for a split bundle (see bundle.split_bundles).
+
+    Every page gets the critical bundle as a regular stylesheet. The deferred
+    chunks a route can use are preloaded and applied without blocking render;
+    chunks the route cannot use are not requested at all.
+
+    Example:
+        css = SplitStylesheets("ui/main.css")
+
+        @rt
+        def index(): return Title("Buttons"), *css.links(index), Main(...)
+    """
+
+    def __init__(self,
+                 entry: str = "ui/main.css",
+                 root: str = "css",
+                 prefix: str = "/static/css",
+                 groups: Tuple[str, ...] = SPLIT_GROUPS,
+                 manifest: AssetManifest = None):
+        """
+        Initialize Split Stylesheets.
+
+        Args:
+            entry: Logical name of the split entry, relative to root
+            root: The vendored css folder the chunks were written to
+            prefix: URL prefix the css folder is served under
+            groups: Component groups that were split into deferred chunks
+            manifest: Manifest resolving chunk names to fingerprinted URLs
+        """
+        self.root = Path(root)
+        self.manifest = manifest or AssetManifest(str(self.root / "manifest.json"), prefix)
+        stem = Path(entry).with_suffix('').as_posix()
+        self.critical = f"{stem}.critical.css"
+        self.chunks = [f"{stem}.{group}.css" for group in groups]
+        self._selectors: Dict[str, List[str]] = {}
+        self._routes: Dict[Callable, Tuple[str, ...]] = {}
+
+    def selectors(self, name: str) -> List[str]:
+        """
+        Top-level selectors of a chunk that depend on what a page renders, read once.
+
+        Selectors that would match an empty page (e.g. [dir="rtl"]) say nothing
+        about which components a route uses, so they are left out.
+        """
+        if name not in self._selectors:
+            path = self.root / name
+            empty_page = {'tags': set(PAGE_TAGS), 'classes': set(), 'ids': set()}
+            self._selectors[name] = [selector for selector in style_selectors(path.read_text())
+                                     if not selector_can_match(selector, empty_page)] if path.exists() else []
+        return self._selectors[name]
+
+    def needed(self, usage: Dict[str, set]) -> Tuple[str, ...]:
+        """Names of the deferred chunks with at least one rule that can match the usage"""
+        return tuple(name for name in self.chunks
+                     if any(selector_can_match(selector, usage) for selector in self.selectors(name)))
+
+    def links(self, route: Callable = None, usage: Dict[str, set] = None) -> tuple:
+        """
+        Build the Link tags for a route.
+
+        Args:
+            route: Route function whose source decides which chunks are needed
+            usage: Explicit usage instead (e.g. to add components rendered by helpers);
+                   with neither, every chunk is loaded deferred
+
+        Returns:
+            Tuple of FastHTML Link tags; FastHTML moves them into <head>
+        """
+        if Link is None:
+            raise ImportError("python-fasthtml is required to build Link tags")
+        if usage is not None:
+            names = self.needed(usage)
+        elif route is not None:
+            if route not in self._routes:
+                try:
+                    self._routes[route] = self.needed(route_usage(route))
+                except (OSError, TypeError):
+                    # No source to scan (e.g. a lambda defined in a REPL): load everything deferred
+                    self._routes[route] = tuple(self.chunks)
+            names = self._routes[route]
+        else:
+            names = tuple(self.chunks)
+
+        tags = [self.manifest.link(self.critical)]
+        for name in names:
+            url = self.manifest.url(name)
+            tags.append(Link(rel='preload', href=url, **{'as': 'style'}))
+            # Applied once loaded, so below-the-fold components never block the first paint
+            tags.append(Link(rel='stylesheet', href=url, media='print', onload="this.media='all'"))
+        return tuple(tags)
+
+
+class ThemedStylesheets:
+    """
+    Pick the precompiled theme variant of a bundle per request (see bundle.theme_bundles).
+
+    The theme comes from a cookie naming one of the variants, then from the
+    Sec-CH-Prefers-Color-Scheme client hint, then the default. Browsers only
+    send the hint after a response asked for it, so send `hint_headers` with
+    the pages that use the variants; their Vary also names Cookie, so shared
+    caches never serve one visitor's chosen theme to another.
+
+    Example:
+        themes = ThemedStylesheets("ui/main.css")
+
+        @rt
+        def index(request): return Title("Home"), themes.link(request), Main(...)
+    """
+
+    HINT = 'Sec-CH-Prefers-Color-Scheme'
+
+    def __init__(self,
+                 entry: str = "ui/main.css",
+                 themes: Tuple[str, ...] = None,
+                 default: str = "light",
+                 cookie: str = "theme",
+                 prefix: str = "/static/css",
+                 manifest: AssetManifest = None):
+        """
+        Initialize Themed Stylesheets.
+
+        Args:
+            entry: Logical name of the themed entry
+            themes: Names of the compiled variants, default: the [themes] of patchwork.toml
+            default: Variant for requests with neither a cookie nor a hint
+            cookie: Cookie holding the visitor's chosen variant
+            prefix: URL prefix the css folder is served under
+            manifest: Manifest resolving variant names to fingerprinted URLs
+        """
+        self.themes = tuple(themes or load_themes())
+        if default not in self.themes:
+            raise ValueError(f"Default theme {default!r} is not one of {', '.join(self.themes)}")
+        self.default = default
+        self.cookie = cookie
+        self.manifest = manifest or AssetManifest(prefix=prefix)
+        self.stem = Path(entry).with_suffix('').as_posix()
+        # The cookie is checked before the hint, so the page depends on both
+        self.hint_headers = {'Accept-CH': self.HINT, 'Vary': f"{self.HINT}, Cookie"}
+
+    def name(self, theme: str) -> str:
+        """Logical name of a variant, e.g. ui/main.theme-dark.css"""
+        return f"{self.stem}.theme-{theme}.css"
+
+    def theme(self, request) -> str:
+        """The variant for a request (anything with Starlette-style `cookies` and `headers`)"""
+        chosen = request.cookies.get(self.cookie)
+        if chosen in self.themes:
+            return chosen
+        hint = request.headers.get(self.HINT.lower(), '').strip().strip('"').lower()
+        return hint if hint in self.themes else self.default
+
+    def url(self, request) -> str:
+        return self.manifest.url(self.name(self.theme(request)))
+
+    def link(self, request, **kwargs):
+        """FastHTML stylesheet Link for the request's variant"""
+        return self.manifest.link(self.name(self.theme(request)), **kwargs)
+
+
+class StaticIndex:
+    """In-memory index of a vendored css tree: bytes, strong ETags and precompressed variants"""
+
+    ENCODINGS = ('br', 'gzip')
+
+    def __init__(self, root: str = "css", manifest: AssetManifest = None):
+        """
+        Initialize Static Index.
+
+        Args:
+            root: Directory to index (the vendored css folder)
+            manifest: Manifest whose fingerprinted files are served as immutable
+        """
+        self.root = Path(root)
+        self.manifest = manifest or AssetManifest(str(self.root / "manifest.json"))
+        self.files: Dict[str, Dict] = {}
+        self.reload()
+
+    def reload(self):
+        """(Re)build the index from disk; nothing is read from disk per request"""
+        files = {}
+        for path in sorted(self.root.rglob('*')):
+            if not path.is_file() or path.suffix in ('.gz', '.br') or path.name in PRIVATE_FILES:
+                continue
+            key = path.relative_to(self.root).as_posix()
+            files[key] = self._entry(path, key)
+        self.files = files
+        print(f"✓ Indexed {len(files)} static files from {self.root}")
+
+    def _entry(self, path: Path, key: str) -> Dict:
+        data = path.read_bytes()
+        etag = hashlib.sha256(data).hexdigest()[:20]
+        media_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        if media_type.startswith('text/') or media_type.endswith(('javascript', 'json', 'svg+xml')):
+            media_type += '; charset=utf-8'
+
+        variants = {None: (data, f'"{etag}"')}
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            sibling = path.with_name(path.name + suffix)
+            if sibling.exists():
+                body = sibling.read_bytes()
+            elif encoding == 'gzip':
+                body = gzip.compress(data, compresslevel=9, mtime=0)
+            elif brotli is not None:
+                body = brotli.compress(data, quality=11)
+            else:
+                continue
+            if len(body) < len(data):
+                # Each representation needs its own strong validator
+                variants[encoding] = (body, f'"{etag}-{suffix[1:]}"')
+
+        cache_control = IMMUTABLE if self.manifest.is_fingerprinted(key) else REVALIDATE
+        return {'media_type': media_type, 'cache_control': cache_control, 'variants': variants}
+
+    def lookup(self, path: str) -> Optional[Dict]:
+        return self.files.get(path.lstrip('/'))
+
+    def select(self, entry: Dict, accept_encoding: str) -> Tuple[Optional[str], bytes, str]:
+        """Pick the best variant for an Accept-Encoding header: (encoding, body, etag)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in self.ENCODINGS:
+            if encoding in entry['variants'] and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return (encoding,) + entry['variants'][encoding]
+        return (None,) + entry['variants'][None]
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as RFC 9110 requires for 304s"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in candidates
+
+
+class CSSStaticMiddleware:
+    """
+    ASGI middleware serving the vendored css tree from a StaticIndex.
+
+    Requests under `prefix` for indexed files are answered from memory with a
+    strong ETag, a 304 when If-None-Match matches, and a br/gzip variant picked
+    from Accept-Encoding. Everything else is passed to the wrapped app.
+    """
+
+    def __init__(self, app, root: str = "css", prefix: str = "/static/css", index: StaticIndex = None):
+        self.app = app
+        self.prefix = prefix.rstrip('/') + '/'
+        self.index = index or StaticIndex(root)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD') \
+                or not scope['path'].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+
+        entry = self.index.lookup(scope['path'][len(self.prefix):])
+        if entry is None:
+            return await self.app(scope, receive, send)
+
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        encoding, body, etag = self.index.select(entry, headers.get('accept-encoding', ''))
+
+        response_headers = [
+            (b'etag', etag.encode()),
+            (b'cache-control', entry['cache_control'].encode()),
+            (b'vary', b'Accept-Encoding'),
+        ]
+        if etag_matches(headers.get('if-none-match'), etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        response_headers += [
+            (b'content-type', entry['media_type'].encode()),
+            (b'content-length', str(len(body)).encode()),
+        ]
+        if encoding:
+            response_headers.append((b'content-encoding', encoding.encode()))
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+
+def serve_css(app, root: str = "css", prefix: str = "/static/css") -> StaticIndex:
+    """
+    Serve the vendored css tree from memory on a FastHTML (or any Starlette) app.
+
+    Example:
+        app, rt = fast_app(hdrs=stylesheet_links("ui/main.css"), pico=False)
+        serve_css(app)
+
+    Returns:
+        The StaticIndex, e.g. to call reload() after re-vendoring
+    """
+    index = StaticIndex(root, AssetManifest(str(Path(root) / "manifest.json"), prefix))
+    app.add_middleware(CSSStaticMiddleware, root=root, prefix=prefix, index=index)
+    return index
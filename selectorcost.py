@@ -0,0 +1,325 @@
+from pathlib import Path
+import argparse
+import json
+import os
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from bundle import (GROUPING_RULES, default_entries, is_external, is_generated, minify, resolve_import,
+                    split_top)
+from critical import parse_selector, resolve_nested
+from cssparse import AtRule, Block, Rule, parse_file
+
+# Cost of the rightmost compound, by the most selective test browsers can bucket it under.
+# A universal key (only pseudo-classes, :has(), *, ...) is tried against every element.
+KEY_COSTS = {'id': 1, 'class': 2, 'root': 2, 'attr': 3, 'tag': 4, 'universal': 10}
+
+# Cost of each compound to the left of the key, by the combinator in front of the one it leads to.
+# Descendant and sibling combinators may walk every ancestor or earlier sibling before failing.
+COMBINATOR_COSTS = {' ': 3, '~': 3, '>': 1, '+': 1}
+
+# A compound left of the key that filters nothing, e.g. the `*` of `.list > * + *`
+UNIVERSAL_COST = 1
+# :has() matches by walking the subtree (or later siblings) of every candidate, and invalidates upwards
+HAS_COST = 10
+# Each :is()/:where()/:not() argument beyond the first is another selector to try
+ARGUMENT_COST = 1
+
+LAYER_UNLAYERED = '(unlayered)'
+
+_LEADING = re.compile(r'(?:\s|/\*(?:[^*]|\*(?!/))*\*/)*')
+
+
+def _key(compound: tuple) -> str:
+    """Cheapest bucket a compound can be found under (see KEY_COSTS)"""
+    kinds = set()
+    for test in compound:
+        if test[0] in ('id', 'class', 'tag', 'attr'):
+            kinds.add(test[0])
+        elif test[0] == 'pseudo' and test[1] == 'root':
+            kinds.add('root')
+        elif test[0] == 'is' and test[1]:
+            # Every argument is tried, so the worst argument's key is the one that counts
+            kinds.add(max((_key(selector[-1][1]) for selector in test[1]), key=KEY_COSTS.get))
+    return min(kinds, key=KEY_COSTS.get) if kinds else 'universal'
+
+
+def selector_cost(selector: list) -> Tuple[int, Dict]:
+    """
+    Score a parsed complex selector (see critical.parse_selector) by how much work matching it takes.
+
+    The score adds the cost of the rightmost compound's key, each combinator
+    and compound to its left, and what :has(), :is(), :where(), :not() and
+    `:nth-*(... of S)` add on top of their arguments.
+
+    Returns:
+        tuple: (score, features: key, depth, has (number of :has()), universal (any compound that filters nothing))
+    """
+    key = _key(selector[-1][1])
+    score = KEY_COSTS[key]
+    features = {'key': key, 'depth': len(selector), 'has': 0, 'universal': key == 'universal'}
+    for index, (combinator, compound) in enumerate(selector):
+        if index < len(selector) - 1:
+            score += COMBINATOR_COSTS[selector[index + 1][0] or ' ']
+            if _key(compound) == 'universal':
+                score += UNIVERSAL_COST
+                features['universal'] = True
+        elif combinator:
+            # Relative selector (a :has() argument): the combinator decides how far the walk goes
+            score += COMBINATOR_COSTS[combinator]
+        for test in compound:
+            score += _test_cost(test, features)
+    return score, features
+
+
+def _test_cost(test: tuple, features: Dict) -> int:
+    """What a pseudo-class with selector arguments adds beyond the key it may provide"""
+    if test[0] == 'has':
+        features['has'] += 1
+        return HAS_COST + sum(_argument_costs(test[1], features))
+    if test[0] in ('is', 'not'):
+        costs = _argument_costs(test[1], features, extra_only=True)
+        return max(costs, default=0) + ARGUMENT_COST * max(len(costs) - 1, 0)
+    if test[0] == 'nth' and test[5]:
+        return max(_argument_costs(test[5], features, extra_only=True), default=0) + ARGUMENT_COST
+    return 0
+
+
+def _argument_costs(selectors: List[list], features: Dict, extra_only: bool = False) -> List[int]:
+    costs = []
+    for selector in selectors:
+        score, inner = selector_cost(selector)
+        features['has'] += inner['has']
+        features['universal'] = features['universal'] or (inner['universal'] and inner['key'] != 'universal')
+        # Arguments of :is()/:not() share the candidate element, so their key is already paid for
+        costs.append(score - KEY_COSTS[inner['key']] if extra_only else score)
+    return costs
+
+
+def import_layers(entries: List[str], base_dir: str = "css") -> Dict[Path, str]:
+    """
+    Layer each file is imported into from the entries, e.g. opbeta/index.css -> "openprops".
+
+    Files imported more than once keep the layer of their first import;
+    files nothing imports are unlayered ("").
+    """
+    layers: Dict[Path, str] = {}
+    pending = [(Path(entry).resolve(), '') for entry in reversed(entries) if Path(entry).exists()]
+    while pending:
+        path, layer = pending.pop()
+        if path in layers or not path.exists():
+            continue
+        layers[path] = layer
+        imports = []
+        for statement in parse_file(path).imports:
+            if is_external(statement.url):
+                continue
+            inner = layer
+            if statement.layer is not None:
+                name = statement.layer or f"<anonymous {path.name}:{statement.start}>"
+                inner = f"{layer}.{name}" if layer else name
+            imports.append((resolve_import(statement.url, path, Path(base_dir)).resolve(), inner))
+        pending.extend(reversed(imports))
+    return layers
+
+
+class SelectorIndex:
+    """
+    Every selector of the vendored stylesheets, scored by selector_cost.
+
+    Selectors are indexed by source file and by the cascade layer they end up
+    in: the layer the file is imported into (see import_layers) followed by
+    the @layer blocks around the rule. Nested rules are scored as the
+    standalone selectors they stand for (see critical.resolve_nested).
+    """
+
+    def __init__(self, base_dir: str = "css", entries: List[str] = None):
+        """
+        Initialize Selector Index.
+
+        Args:
+            base_dir: Root of the vendored tree, for resolving imports
+            entries: Entry stylesheets whose imports decide each file's layer (default: the bundle entries)
+        """
+        self.base_dir = Path(base_dir)
+        self.layers = import_layers(entries or default_entries(base_dir), base_dir)
+        self.selectors: List[Dict] = []
+        self.files: Dict[Path, Dict] = {}
+        self.errors: List[Dict] = []
+
+    def add_file(self, path: Path):
+        """Index and score the selectors of one stylesheet"""
+        path = Path(path)
+        text = path.read_text()
+        stats = {'rules': 0, 'selectors': 0, 'bytes': len(text.encode()),
+                 'minified_bytes': len(minify(text).encode()), 'max_score': 0, 'total_score': 0}
+        self.files[path] = stats
+        base_layer = self.layers.get(path.resolve(), '')
+        self._add_block(parse_file(path), text, path, stats, [base_layer] if base_layer else [], (), None)
+
+    def add_tree(self, root: str):
+        """Index every stylesheet under a directory, except the ones the bundle step generated"""
+        for path in sorted(Path(root).rglob('*.css')):
+            if not is_generated(path):
+                self.add_file(path)
+
+    def _add_block(self,
+                   block: Block,
+                   text: str,
+                   path: Path,
+                   stats: Dict,
+                   layer: List[str],
+                   conditions: tuple,
+                   parent: Optional[str]):
+        for node in block.children:
+            if isinstance(node, AtRule):
+                if node.statement or node.name not in GROUPING_RULES:
+                    # @keyframes steps, @font-face, ... are not matched against elements
+                    continue
+                if node.name == 'layer':
+                    name = node.prelude or f"<anonymous {node.start}>"
+                    self._add_block(node, text, path, stats, layer + [name], conditions, parent)
+                else:
+                    self._add_block(node, text, path, stats, layer,
+                                    conditions + (f"@{node.name} {node.prelude}".strip(),), parent)
+            elif isinstance(node, Rule):
+                stats['rules'] += 1
+                line = text.count('\n', 0, _LEADING.match(text, node.start).end()) + 1
+                selectors = [' '.join(selector.split()) for selector in split_top(node.prelude)]
+                resolved = [resolve_nested(selector, parent) for selector in selectors]
+                for selector, standalone in zip(selectors, resolved):
+                    self._add_selector(selector, standalone, path, line, stats, layer, conditions)
+                self._add_block(node, text, path, stats, layer, conditions, ', '.join(resolved))
+
+    def _add_selector(self,
+                      selector: str,
+                      resolved: str,
+                      path: Path,
+                      line: int,
+                      stats: Dict,
+                      layer: List[str],
+                      conditions: tuple):
+        try:
+            score, features = selector_cost(parse_selector(resolved))
+        except ValueError as e:
+            self.errors.append({'file': path, 'line': line, 'selector': selector, 'error': str(e)})
+            return
+        stats['selectors'] += 1
+        stats['max_score'] = max(stats['max_score'], score)
+        stats['total_score'] += score
+        # The selector as written, and for nested rules the standalone selector that was scored
+        self.selectors.append(dict(features, selector=selector, resolved=resolved, score=score,
+                                   file=path, line=line, layer='.'.join(layer) or LAYER_UNLAYERED,
+                                   conditions=list(conditions)))
+
+    def worst(self, count: int = None) -> List[Dict]:
+        """The most expensive selectors, worst first"""
+        ranked = sorted(self.selectors, key=lambda record: -record['score'])
+        return ranked if count is None else ranked[:count]
+
+    def by_layer(self) -> Dict[str, Dict]:
+        """Selector count and scores per cascade layer, in first-seen order"""
+        layers: Dict[str, Dict] = {}
+        for record in self.selectors:
+            stats = layers.setdefault(record['layer'], {'selectors': 0, 'max_score': 0, 'total_score': 0})
+            stats['selectors'] += 1
+            stats['max_score'] = max(stats['max_score'], record['score'])
+            stats['total_score'] += record['score']
+        return layers
+
+
+def _as_json(record: Dict) -> Dict:
+    return dict(record, file=os.path.relpath(record['file']))
+
+
+def _describe(record: Dict) -> str:
+    """score file:line [layer] selector, e.g. `24  css/ui/data-display/list.css:12 [components.base] ...`"""
+    conditions = ' '.join(record['conditions'])
+    return (f"{record['score']:>4}  {os.path.relpath(record['file'])}:{record['line']} [{record['layer']}]"
+            f"{' ' + conditions if conditions else ''} {record['selector']}")
+
+
+def analyze(roots: List[str],
+            base_dir: str = "css",
+            entries: List[str] = None,
+            top: int = 20,
+            max_score: int = None) -> Dict:
+    """
+    Report the most expensive selectors, and rules, bytes and scores per component and layer.
+
+    Args:
+        roots: Directories to index
+        base_dir: Root of the vendored tree
+        entries: Entry stylesheets whose imports decide each file's layer
+        top: Number of selectors to list, worst first
+        max_score: Budget; selectors scoring above it are listed as over budget
+
+    Returns:
+        The report as a JSON-serializable dict
+    """
+    index = SelectorIndex(base_dir, entries)
+    for root in roots:
+        index.add_tree(root)
+
+    worst = index.worst(top)
+    layers = index.by_layer()
+    components = sorted(index.files.items(), key=lambda item: -item[1]['total_score'])
+    over = [record for record in index.worst() if max_score is not None and record['score'] > max_score]
+
+    rules = sum(stats['rules'] for stats in index.files.values())
+    print(f"Indexed {len(index.selectors)} selectors in {rules} rules across {len(index.files)} files")
+    print("Most expensive selectors:")
+    for record in worst:
+        print(f"  {_describe(record)}")
+    print("Components by total score:")
+    for path, stats in components[:top]:
+        print(f"  {os.path.relpath(path)}: {stats['rules']} rules, {stats['selectors']} selectors, "
+              f"{stats['bytes']} bytes ({stats['minified_bytes']} minified), "
+              f"worst {stats['max_score']}, total {stats['total_score']}")
+    print("Layers:")
+    for name, stats in layers.items():
+        print(f"  {name}: {stats['selectors']} selectors, worst {stats['max_score']}, total {stats['total_score']}")
+    for error in index.errors:
+        print(f"✗ Could not score {os.path.relpath(error['file'])}:{error['line']} {error['selector']} "
+              f"({error['error']})")
+    if max_score is not None:
+        if over:
+            print(f"✗ {len(over)} selectors score above {max_score}")
+        else:
+            print(f"✓ No selector scores above {max_score}")
+
+    return {
+        'files': len(index.files),
+        'rules': rules,
+        'selectors': len(index.selectors),
+        'weights': {'key': KEY_COSTS, 'combinator': COMBINATOR_COSTS, 'universal': UNIVERSAL_COST,
+                    'has': HAS_COST, 'argument': ARGUMENT_COST},
+        'worst': [_as_json(record) for record in worst],
+        'components': {os.path.relpath(path): stats for path, stats in components},
+        'layers': layers,
+        'errors': [_as_json(error) for error in index.errors],
+        'max_score': max_score,
+        'over_budget': [_as_json(record) for record in over],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the selectors of the vendored CSS by matching cost")
+    parser.add_argument("roots", nargs="*", default=["css"], help="Directories to index (default: css)")
+    parser.add_argument("--base-dir", default="css", help="Root of the vendored tree")
+    parser.add_argument("--entries", nargs="+", metavar="ENTRY",
+                        help="Entry stylesheets whose imports decide each file's layer "
+                             "(default: ui/main.css and custom/custom.css)")
+    parser.add_argument("--top", type=int, default=20, help="Number of selectors and components to list")
+    parser.add_argument("--max-score", type=int, metavar="SCORE",
+                        help="Exit with status 1 if any selector scores above this (for CI)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    report = analyze(args.roots, args.base_dir, args.entries, args.top, args.max_score)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"✓ Wrote {args.json}")
+    if report['over_budget']:
+        sys.exit(1)
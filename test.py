@@ -1,14 +1,206 @@
 from pathlib import Path
+import argparse
+import bisect
+import hashlib
+import json
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-def validate_css_imports(main_css_path: str, base_dir: str = "."):
+from bundle import default_entries, is_external, is_generated, resolve_import
+from cssparse import AtRule, clear_cache, parse_file
+
+# A var() reference, noting whether a fallback follows the property name
+_VAR_FALLBACK = re.compile(r'var\(\s*--(?:[\w-]|\\.)+\s*(,)?', re.IGNORECASE)
+
+INDEX_DIR = Path(".patchwork")
+
+
+class ImportGraph:
+    """Persistent @import graph of a CSS tree, re-parsed incrementally by file mtime and size"""
+
+    def __init__(self, css_dir: str = "css", index_path: Path = None):
+        """
+        Initialize Import Graph.
+
+        Args:
+            css_dir: CSS directory to index
+            index_path: Where the index is persisted between runs (default: one file per directory in .patchwork/)
+        """
+        self.css_dir = Path(css_dir)
+        if index_path is None:
+            digest = hashlib.sha1(os.path.abspath(css_dir).encode()).hexdigest()[:12]
+            index_path = INDEX_DIR / f"import-graph-{digest}.json"
+        self.index_path = Path(index_path)
+        self.files: Dict[str, Dict] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            data = json.loads(self.index_path.read_text())
+        except (ValueError, OSError):
+            return
+        if data.get('version') == 1:
+            self.files = data.get('files', {})
+
+    def save(self):
+        """Persist the index if anything changed since it was loaded"""
+        if not self._dirty:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.index_path.write_text(json.dumps({'version': 1, 'files': self.files}))
+        self._dirty = False
+
+    @staticmethod
+    def key(path: Path) -> str:
+        return os.path.abspath(path)
+
+    def _walk(self, directory: Path):
+        """Yield (path, stat) for every CSS file under a directory"""
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._walk(Path(entry.path))
+                elif entry.name.endswith('.css'):
+                    yield Path(entry.path), entry.stat()
+
+    def refresh(self) -> int:
+        """
+        Bring the index up to date with the tree, re-parsing only changed files.
+
+        Returns:
+            Number of files that were (re-)parsed
+        """
+        seen = set()
+        parsed = 0
+        if self.css_dir.exists():
+            for path, stat in self._walk(self.css_dir):
+                key = self.key(path)
+                seen.add(key)
+                if self._update(key, path, stat):
+                    parsed += 1
+
+        # Files outside css_dir are only indexed when something imports them
+        for key in list(self.files):
+            if key not in seen and (Path(key).is_relative_to(self.key(self.css_dir)) or not os.path.exists(key)):
+                del self.files[key]
+                self._dirty = True
+
+        self.save()
+        return parsed
+
+    def _update(self, key: str, path: Path, stat: os.stat_result) -> bool:
+        entry = self.files.get(key)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return False
+        imports = [statement.url for statement in parse_file(path).imports]
+        self.files[key] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'imports': imports}
+        self._dirty = True
+        return True
+
+    def entry(self, path: Path) -> Optional[Dict]:
+        """Index entry for a file, indexing it on demand if it lives outside css_dir"""
+        key = self.key(path)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return None
+        self._update(key, Path(key), stat)
+        return self.files[key]
+
+    def resolved_imports(self, path: Path, base_dir: Path) -> List[Tuple[str, Path]]:
+        """Return (import path, resolved file) pairs for a file's local imports"""
+        entry = self.entry(path)
+        if entry is None:
+            return []
+        return [(url, Path(os.path.normpath(resolve_import(url, Path(path), base_dir))))
+                for url in entry['imports'] if not is_external(url)]
+
+    def walk(self, entry: Path, base_dir: Path) -> List[Tuple[Path, str, Path]]:
+        """
+        List every import reachable from an entry, depth first.
+
+        Returns:
+            List of (importing file, import path, resolved file) triples; each
+            file's imports are listed once even if it is imported repeatedly
+        """
+        edges = []
+        visited = set()
+        pending = [Path(os.path.normpath(entry))]
+        while pending:
+            path = pending.pop()
+            if self.key(path) in visited:
+                continue
+            visited.add(self.key(path))
+            children = self.resolved_imports(path, base_dir)
+            edges.extend((path, url, target) for url, target in children)
+            pending.extend(target for _, target in reversed(children) if target.exists())
+        return edges
+
+    def find_cycles(self, base_dir: Path) -> List[List[str]]:
+        """Return each import cycle in the indexed tree as a list of file paths"""
+        graph = {key: [self.key(target) for _, target in self.resolved_imports(Path(key), base_dir)]
+                 for key in list(self.files)}
+        cycles = []
+        state: Dict[str, int] = {}
+        stack: List[str] = []
+
+        def visit(key: str):
+            state[key] = 1
+            stack.append(key)
+            for child in graph.get(key, []):
+                if state.get(child) == 1:
+                    cycles.append(stack[stack.index(child):] + [child])
+                elif child in graph and not state.get(child):
+                    visit(child)
+            stack.pop()
+            state[key] = 2
+
+        for key in graph:
+            if not state.get(key):
+                visit(key)
+        return cycles
+
+    def importers(self, path: Path, base_dir: Path) -> List[str]:
+        """Return the files that import the given file"""
+        target = self.key(path)
+        return sorted(key for key in self.files
+                      if any(self.key(resolved) == target for _, resolved in self.resolved_imports(Path(key), base_dir)))
+
+
+_graphs: Dict[str, ImportGraph] = {}
+
+
+def get_import_graph(css_dir: str = "css") -> ImportGraph:
+    """Return the refreshed import graph for a directory, shared by every call in this process"""
+    cache_key = os.path.abspath(css_dir)
+    if cache_key not in _graphs:
+        _graphs[cache_key] = ImportGraph(css_dir)
+    graph = _graphs[cache_key]
+    graph.refresh()
+    return graph
+
+
+def reset_import_graphs():
+    """Forget the graphs and parses shared in this process, so the next call loads from the persisted index"""
+    _graphs.clear()
+    clear_cache()
+
+
+def validate_css_imports(main_css_path: str, base_dir: str = ".", recursive: bool = True):
     """
     Validate that all files imported in main.css exist in the expected locations
 
     Args:
         main_css_path: Path to the main.css file
         base_dir: Base directory for resolving import paths
+        recursive: Also validate the imports of imported files (e.g. custom.css -> view-transition.css)
 
     Returns:
         tuple: (is_valid, list of missing files)
@@ -20,32 +212,27 @@ def validate_css_imports(main_css_path: str, base_dir: str = "."):
         print(f"Error: Main CSS file {main_css} does not exist")
         return False, []
 
-    content = main_css.read_text()
-
-    # Find all @import statements
-    import_pattern = r'@import\s+[\'"]([^\'"]+)[\'"]'
-    imports = re.findall(import_pattern, content)
+    inside_base = main_css.resolve().is_relative_to(base_path.resolve()) and base_path.resolve() != Path.cwd()
+    graph = get_import_graph(str(base_path if inside_base else main_css.parent))
+    if recursive:
+        edges = graph.walk(main_css, base_path)
+    else:
+        edges = [(main_css, url, target) for url, target in graph.resolved_imports(main_css, base_path)]
+    graph.save()
 
     missing_files = []
     all_valid = True
 
-    print(f"Validating {len(imports)} imports in {main_css_path}...")
-
-    for import_path in imports:
-        # Handle absolute paths (starting with /)
-        if import_path.startswith('/'):
-            # Remove the leading slash for file system path
-            file_path = base_path / import_path[1:]
-        else:
-            # Handle relative paths
-            file_path = main_css.parent / import_path
+    print(f"Validating {len(edges)} imports in {main_css_path}...")
 
+    for importer, import_path, file_path in edges:
+        label = import_path if Path(importer) == Path(os.path.normpath(main_css)) else f"{import_path} (from {importer})"
         if not file_path.exists():
-            print(f"❌ Missing file: {import_path} (expected at {file_path})")
+            print(f"❌ Missing file: {label} (expected at {file_path})")
             missing_files.append(import_path)
             all_valid = False
         else:
-            print(f"✅ Found: {import_path}")
+            print(f"✅ Found: {label}")
 
     if all_valid:
         print("\n✅ All imports are valid!")
@@ -54,6 +241,168 @@ def validate_css_imports(main_css_path: str, base_dir: str = "."):
 
     return all_valid, missing_files
 
+def css_symbols(path: str) -> Dict:
+    """
+    Symbol table of one stylesheet, built in a worker process by lint_css.
+
+    Lines are 1-based. Layer names are prefixed with the @layer blocks around
+    them in the same file, but not with the layer the file is imported into.
+
+    Returns:
+        dict: defines and uses ({property: [line, ...]}; uses with a var() fallback are
+        listed under fallbacks instead), statements ([names, line] of `@layer a, b;`),
+        blocks ([name, line] of `@layer name {}`) and imports ([url, layer, line])
+    """
+    text = Path(path).read_text()
+    sheet = parse_file(Path(path))
+    newlines = [index for index, char in enumerate(text) if char == '\n']
+
+    def line(offset: int) -> int:
+        return bisect.bisect_left(newlines, offset) + 1
+
+    table = {'defines': {}, 'uses': {}, 'fallbacks': {}, 'statements': [], 'blocks': [], 'imports': []}
+    for name, declarations in sheet.properties.items():
+        table['defines'][name] = [line(declaration.start) for declaration in declarations]
+    for name, offset, _ in sheet.var_refs:
+        match = _VAR_FALLBACK.match(text, offset)
+        kind = 'fallbacks' if match and match.group(1) else 'uses'
+        table[kind].setdefault(name, []).append(line(offset))
+
+    table['imports'] = [[statement.url, statement.layer, line(statement.start)] for statement in sheet.imports]
+    for node, ancestors in sheet.walk():
+        if not isinstance(node, AtRule):
+            continue
+        if node.name == 'property' and node.prelude.startswith('--'):
+            # A registered property has an initial value, so it is defined even if never declared
+            table['defines'].setdefault(node.prelude.strip(), []).append(line(node.start))
+        elif node.name == 'layer':
+            path_names = [block.prelude for block in ancestors if isinstance(block, AtRule) and block.name == 'layer']
+            if not all(path_names):
+                continue  # inside an anonymous layer, which nothing else can refer to
+            prefix = ''.join(f"{name}." for name in path_names)
+            if node.statement:
+                table['statements'].append([[prefix + name.strip() for name in node.prelude.split(',')],
+                                            line(node.start)])
+            elif node.prelude:
+                table['blocks'].append([prefix + node.prelude, line(node.start)])
+    return table
+
+
+def _layer_known(name: str, declared: List[str]) -> bool:
+    """True if a layer is in a declared order: listed, the parent of one listed, or inside a listed leaf"""
+    if name in declared or any(layer.startswith(name + '.') for layer in declared):
+        return True
+    parent = name.rpartition('.')[0]
+    while parent:
+        if parent in declared:
+            # Sub-layers of a listed layer whose own sub-layers aren't listed are ordered by its files
+            return not any(layer.startswith(parent + '.') for layer in declared)
+        parent = parent.rpartition('.')[0]
+    return False
+
+
+def _check_layers(entry: Path, tables: Dict[Path, Dict], base_dir: Path) -> List[str]:
+    """Layer problems of the files reachable from an entry, against the order its first @layer statement sets"""
+    statements = tables[entry]['statements']
+    if not statements:
+        return []
+    declared = statements[0][0]
+    problems = []
+    visited = set()
+    pending = [(entry, '')]
+    while pending:
+        path, prefix = pending.pop()
+        if (path, prefix) in visited or path not in tables:
+            continue
+        visited.add((path, prefix))
+        table = tables[path]
+        label = os.path.relpath(path)
+
+        used = [(f"{prefix}{name}", line) for name, line in table['blocks']]
+        children = []
+        for url, layer, line in table['imports']:
+            if is_external(url):
+                continue
+            inner = prefix
+            if layer:
+                inner = f"{prefix}{layer}."
+                used.append((f"{prefix}{layer}", line))
+            children.append((Path(os.path.normpath(resolve_import(url, path, base_dir))).resolve(), inner))
+        pending.extend(reversed(children))
+
+        for names, line in table['statements']:
+            if path == entry and line == statements[0][1]:
+                continue
+            names = [f"{prefix}{name}" for name in names]
+            used.extend((name, line) for name in names)
+            ranks = [(declared.index(name), name) for name in names if name in declared]
+            for (rank, name), (next_rank, next_name) in zip(ranks, ranks[1:]):
+                if next_rank < rank:
+                    problems.append(f"{label}:{line}: @layer lists {name} before {next_name}, "
+                                    f"but {os.path.relpath(entry)} orders {next_name} first")
+        for name, line in used:
+            if not _layer_known(name, declared):
+                problems.append(f"{label}:{line}: layer {name} is missing from the @layer statement "
+                                f"of {os.path.relpath(entry)}")
+    return problems
+
+
+def lint_css(css_dir: str = "css", entries: List[str] = None, workers: int = None) -> Dict:
+    """
+    Lint the whole tree: undefined and unused custom properties, and layers the entries don't order.
+
+    Files are parsed into symbol tables (see css_symbols) in a process pool and
+    the tables are merged here, so the checks see every file at once.
+
+    Args:
+        css_dir: CSS directory to lint
+        entries: Stylesheets whose first @layer statement sets the layer order (default: ui/main.css
+            and custom/custom.css)
+        workers: Worker processes (default: one per CPU; 1 parses in this process)
+
+    Returns:
+        dict: undefined ([file, line, property]), unused ({file: [property, ...]}), layers (problems),
+        files and seconds
+    """
+    started = time.perf_counter()
+    css_path = Path(css_dir)
+    files = [path.resolve() for path in sorted(css_path.rglob('*.css')) if not is_generated(path)]
+    if workers == 1:
+        tables = dict(zip(files, map(css_symbols, map(str, files))))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(files) // (4 * (workers or os.cpu_count() or 1)))
+            tables = dict(zip(files, pool.map(css_symbols, map(str, files), chunksize=chunksize)))
+
+    defined = {name for table in tables.values() for name in table['defines']}
+    used = {name for table in tables.values() for kind in ('uses', 'fallbacks') for name in table[kind]}
+    undefined = sorted([os.path.relpath(path), line, name] for path, table in tables.items()
+                       for name, lines in table['uses'].items() if name not in defined for line in lines)
+    unused = {os.path.relpath(path): sorted(name for name in table['defines'] if name not in used)
+              for path, table in tables.items()}
+    unused = {path: names for path, names in unused.items() if names}
+
+    layers = []
+    for entry in entries or default_entries(css_dir):
+        entry = Path(entry).resolve()
+        if entry in tables:
+            layers.extend(_check_layers(entry, tables, css_path))
+    seconds = time.perf_counter() - started
+
+    for path, line, name in undefined:
+        print(f"❌ {path}:{line}: var({name}) is not defined by any file and has no fallback")
+    for path, names in unused.items():
+        shown = ', '.join(names[:5]) + (', ...' if len(names) > 5 else '')
+        print(f"⚠️  {path}: {len(names)} custom properties nothing uses ({shown})")
+    for problem in layers:
+        print(f"❌ {problem}")
+    print(f"\nLinted {len(files)} files in {seconds:.2f}s: {len(undefined)} undefined references, "
+          f"{sum(map(len, unused.values()))} unused properties, {len(layers)} layer problems")
+    if not undefined and not layers:
+        print("✅ No undefined properties or unordered layers.")
+    return {'files': len(files), 'seconds': seconds, 'undefined': undefined, 'unused': unused, 'layers': layers}
+
+
 def analyze_css_structure(css_dir: str = "css"):
     """
     Analyze the CSS directory structure and provide information about file locations
@@ -69,8 +418,11 @@ def analyze_css_structure(css_dir: str = "css"):
 
     print(f"\nAnalyzing CSS directory structure in {css_dir}...")
 
-    # Get all CSS files
-    all_files = list(css_path.glob('**/*.css'))
+    # Get all CSS files from the import graph index (only changed files are re-parsed)
+    graph = get_import_graph(css_dir)
+    css_root = Path(graph.key(css_path))
+    all_files = [css_path / Path(key).relative_to(css_root)
+                 for key in sorted(graph.files) if Path(key).is_relative_to(css_root)]
 
     print(f"Found {len(all_files)} CSS files")
 
@@ -102,18 +454,48 @@ def analyze_css_structure(css_dir: str = "css"):
         for main_css in main_css_files:
             rel_path = main_css.relative_to(css_path)
             print(f"  - {rel_path}")
+            layers = parse_file(main_css).layers
+            if layers:
+                print(f"    Layer order: {', '.join(layers)}")
 
             # Optionally validate the main.css imports
             validate_css_imports(str(main_css), css_dir)
     else:
         print("\nNo main.css files found.")
 
+    cycles = graph.find_cycles(css_path)
+    for cycle in cycles:
+        print(f"❌ Import cycle: {' -> '.join(os.path.relpath(key) for key in cycle)}")
+    if not cycles:
+        print("\n✅ No import cycles.")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the @import graph of the vendored CSS")
+    parser.add_argument("main_css", nargs="?", help="Validate this file's imports (default: analyze the whole tree)")
+    parser.add_argument("base_dir", nargs="?", default=".", help="Base directory for '/' imports")
+    parser.add_argument("--shallow", action="store_true", help="Only validate the file's own imports")
+    parser.add_argument("--importers", metavar="FILE", help="List the files that import FILE")
+    parser.add_argument("--css-dir", default="css", help="CSS directory to index")
+    parser.add_argument("--lint", action="store_true",
+                        help="Report undefined and unused custom properties and layers missing from the @layer order")
+    parser.add_argument("--workers", type=int, metavar="N", help="Worker processes for --lint (default: one per CPU)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the --lint report as JSON")
+    args = parser.parse_args()
+
+    if args.lint:
+        report = lint_css(args.css_dir, workers=args.workers)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+            print(f"✅ Wrote {args.json}")
+        if report['undefined'] or report['layers']:
+            sys.exit(1)
+    elif args.importers:
+        graph = get_import_graph(args.css_dir)
+        for importer in graph.importers(Path(args.importers), Path(args.css_dir)):
+            print(os.path.relpath(importer))
     # If a specific main.css path is provided, validate it
-    if len(sys.argv) > 1:
-        main_css_path = sys.argv[1]
-        base_dir = sys.argv[2] if len(sys.argv) > 2 else "."
-        validate_css_imports(main_css_path, base_dir)
+    elif args.main_css:
+        validate_css_imports(args.main_css, args.base_dir, recursive=not args.shallow)
     else:
         # Otherwise analyze the whole CSS structure
-        analyze_css_structure()
+        analyze_css_structure(args.css_dir)
@@ -0,0 +1,154 @@
+"""
+Behavior checks for the fetch path of vendor.py, driven by httpx.MockTransport.
+
+Run with: python -m unittest test_vendor
+"""
+from pathlib import Path
+import contextlib
+import io
+import json
+import tarfile
+import tempfile
+import unittest
+from typing import Callable, List
+from unittest import mock
+
+import httpx
+
+from vendor import CSSVendor, ContentCache, RetryPolicy
+
+URL = "https://cdn.example/ui/main.css"
+
+
+class FetchTests(unittest.TestCase):
+    """Retries, rate-limit hints, re-queuing and conditional requests against a mock server"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.output_dir = root / "css"
+        self.cache = ContentCache(str(root / "cache"))
+        self.requests: List[httpx.Request] = []
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def vendor(self, handler: Callable[[httpx.Request], httpx.Response], **retry) -> CSSVendor:
+        """A vendor whose every request is answered by handler, without rate limiting or backoff"""
+        def record(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return handler(request)
+
+        vendor = CSSVendor(str(self.output_dir), cache=self.cache, rate_limit=None,
+                           retry=RetryPolicy(base_delay=0, **retry), transport=httpx.MockTransport(record))
+        self.addCleanup(vendor.close)
+        return vendor
+
+    @property
+    def output_path(self) -> Path:
+        return self.output_dir / "ui" / "main.css"
+
+    def test_429_waits_for_retry_after(self):
+        responses = iter([httpx.Response(429, headers={'Retry-After': '2'}),
+                          httpx.Response(200, content=b".a{}", headers={'ETag': '"v1"'})])
+        vendor = self.vendor(lambda request: next(responses))
+        with mock.patch('vendor.time.sleep') as sleep:
+            self.assertTrue(vendor.fetch_file(URL, self.output_path))
+
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(sleep.call_args_list[0], mock.call(2.0))
+        self.assertEqual(self.output_path.read_bytes(), b".a{}")
+        self.assertEqual(vendor.file_metrics[-1].retries, 1)
+        self.assertEqual(vendor.lock["ui/main.css"]['etag'], '"v1"')
+
+    def test_5xx_exhausts_retries_then_requeues(self):
+        vendor = self.vendor(lambda request: httpx.Response(503), attempts=3, requeue=1)
+        self.assertEqual(vendor.fetch_jobs([(URL, self.output_path, None)]), 0)
+
+        # Three attempts, then one more pass of three once the job was re-queued
+        self.assertEqual(len(self.requests), 6)
+        self.assertFalse(self.output_path.exists())
+        self.assertNotIn(URL, vendor.permanent_failures)
+        self.assertEqual(vendor.file_metrics[-1].status, 'failed')
+
+    def test_404_is_not_retried(self):
+        vendor = self.vendor(lambda request: httpx.Response(404), attempts=3, requeue=1)
+        self.assertEqual(vendor.fetch_jobs([(URL, self.output_path, None)]), 0)
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn(URL, vendor.permanent_failures)
+
+    def test_304_materializes_from_cache(self):
+        self.cache.put(URL, b".cached{}", etag='"v1"')
+        vendor = self.vendor(lambda request: httpx.Response(304))
+        self.assertTrue(vendor.fetch_file(URL, self.output_path))
+
+        self.assertEqual(self.requests[0].headers['if-none-match'], '"v1"')
+        self.assertEqual(self.output_path.read_bytes(), b".cached{}")
+        metrics = vendor.file_metrics[-1]
+        self.assertEqual((metrics.status, metrics.cache, metrics.bytes), ('cached', 'hit', 0))
+
+    def test_etag_mismatch_gets_full_body(self):
+        self.cache.put(URL, b".old{}", etag='"v1"')
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.headers.get('if-none-match') == '"v2"':
+                return httpx.Response(304)
+            return httpx.Response(200, content=b".new{}", headers={'ETag': '"v2"'})
+
+        vendor = self.vendor(handler)
+        self.assertTrue(vendor.fetch_file(URL, self.output_path))
+
+        self.assertEqual(self.requests[0].headers['if-none-match'], '"v1"')
+        self.assertEqual(self.output_path.read_bytes(), b".new{}")
+        self.assertEqual(vendor.lock["ui/main.css"]['etag'], '"v2"')
+        self.assertEqual(self.cache.lookup(URL)['etag'], '"v2"')
+
+        # The next sync revalidates against the new ETag and keeps the file
+        self.assertTrue(vendor.fetch_file(URL, self.output_path))
+        self.assertEqual(self.requests[1].headers['if-none-match'], '"v2"')
+        self.assertEqual(vendor.file_metrics[-1].status, 'unchanged')
+
+    def test_stages_fetch_before_the_client_closes(self):
+        vendor = self.vendor(lambda request: httpx.Response(200, content=b"asset"))
+        clients = []
+
+        def stage(vendor: CSSVendor, results):
+            vendor._request(URL, lambda response: response.read())
+            clients.append(vendor._client)
+
+        vendor.add_stage(stage)
+        vendor.sync_all()
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertTrue(clients[0].is_closed)
+        self.assertIsNone(vendor._client)
+
+    def test_concurrent_sync_with_archive_records_every_file(self):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            for index in range(20):
+                data = f".a{index}{{}}".encode()
+                member = tarfile.TarInfo(f"repo-main/src/a{index}.css")
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "codeload.github.com":
+                return httpx.Response(200, content=archive.getvalue())
+            return httpx.Response(200, content=request.url.path.encode())
+
+        vendor = self.vendor(handler)
+        vendor.add_source("ui", "https://raw.example/ui", auto_pull=True, github_repo="owner/repo/main/src",
+                          archive=True)
+        vendor.add_source("extra", "https://cdn.example/extra", files=[f"b{index}.css" for index in range(20)])
+        results = vendor.sync_all(concurrent=True)
+
+        self.assertEqual(results, {"ui": 20, "extra": 20})
+        files = json.loads((self.output_dir / CSSVendor.LOCK_FILE).read_text())['files']
+        self.assertEqual(len(files), 40)
+        self.assertEqual(len(self.cache.index['urls']), 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
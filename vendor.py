@@ -1,21 +1,828 @@
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+import argparse
+import asyncio
+import base64
+import ctypes
+import glob
+import hashlib
+import importlib.util
+import io
 import httpx
 import json
+import math
+import mimetypes
+import os
+import random
+import re
+import select
 import shutil
-from typing import Dict, List, Optional
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tomllib
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote, urljoin, urlsplit
+
+from bundle import URL_PATTERN, CSSBundler, default_entries, is_external, is_generated, optimize_tree, replace_file
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; reflinks are skipped there
+    fcntl = None
+
+# HTTP/2 is only available when the optional `h2` package is installed (`pip install httpx[http2]`)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Responses and archive members are copied in chunks of this size, never held whole in memory
+CHUNK_SIZE = 64 * 1024
+
+# Declarative list of the vendored sources (see load_manifest)
+MANIFEST_FILE = "patchwork.toml"
+
+# Directory (under the output dir) that url() assets of the vendored CSS are written to
+ASSETS_DIR = "assets"
+# url() assets up to this many bytes are inlined as data: URIs instead
+INLINE_LIMIT = 4 * 1024
+# Media types mimetypes may not know, for data: URIs
+ASSET_TYPES = {'.woff2': 'font/woff2', '.woff': 'font/woff', '.ttf': 'font/ttf', '.otf': 'font/otf',
+               '.svg': 'image/svg+xml', '.webp': 'image/webp', '.avif': 'image/avif'}
+
+# Refs that name an immutable revision: a full commit SHA, or an exact npm version
+COMMIT_SHA = re.compile(r'^[0-9a-f]{40}$')
+EXACT_VERSION = re.compile(r'^\d+\.\d+\.\d+(?:-[\w.]+)?(?:\+[\w.]+)?$')
+
+
+class _ChunkReader(io.RawIOBase):
+    """Expose an iterator of byte chunks (e.g. a streamed response) as a readable file object"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def git_blob_hasher(size: int):
+    """Start a sha1 of a blob of known size the way git (and GitHub) hashes it"""
+    return hashlib.sha1(b"blob %d\0" % size)
+
+
+def git_blob_sha(content: bytes) -> str:
+    """Compute the sha GitHub reports for a blob, so archive and tree syncs share lock entries"""
+    blob = git_blob_hasher(len(content))
+    blob.update(content)
+    return blob.hexdigest()
+
+class FileWatcher:
+    """
+    Report changed files under a set of directories.
+
+    Uses inotify through ctypes on Linux and falls back to polling file
+    mtimes elsewhere (or when inotify is unavailable).
+    """
+
+    # inotify event masks (see inotify(7))
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_NONBLOCK = 0o4000
+
+    def __init__(self, files: List[Path], poll_interval: float = 0.05):
+        """
+        Initialize File Watcher.
+
+        Args:
+            files: Files to watch; their parent directories are watched
+            poll_interval: Seconds between scans when polling
+        """
+        self.files = {os.path.abspath(path) for path in files}
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._wds: Dict[int, str] = {}
+        self._mtimes = {path: self._mtime(path) for path in self.files}
+
+        if sys.platform.startswith('linux'):
+            try:
+                self._start_inotify()
+            except OSError as e:
+                print(f"✗ inotify unavailable ({str(e)}), polling every {poll_interval * 1000:.0f} ms")
+                self._fd = None
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._fd is not None else 'polling'
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _start_inotify(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+
+        self._watch_directories({os.path.dirname(path) for path in self.files})
+
+    def _watch_directories(self, directories: set):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in directories - set(self._wds.values()):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self._wds[wd] = directory
+
+    def add(self, files: List[Path]):
+        """Watch more files, e.g. ones created after the watch started"""
+        added = {os.path.abspath(path) for path in files} - self.files
+        self.files |= added
+        for path in added:
+            self._mtimes[path] = self._mtime(path)
+        if self._fd is not None:
+            self._watch_directories({os.path.dirname(path) for path in added})
+
+    def _read_events(self) -> set:
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            path = os.path.join(self._wds.get(wd, ''), os.fsdecode(name))
+            if path in self.files:
+                changed.add(path)
+        return changed
+
+    def poll(self, timeout: float = None) -> List[Path]:
+        """
+        Wait for changes and return the changed files.
+
+        Editors often save in several steps, so events arriving within a few
+        milliseconds of the first one are folded into the same batch.
+        """
+        if self._fd is not None:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if not ready:
+                return []
+            changed = self._read_events()
+            while select.select([self._fd], [], [], 0.01)[0]:
+                changed |= self._read_events()
+            return sorted(Path(path) for path in changed)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = []
+            for path in self.files:
+                mtime = self._mtime(path)
+                if mtime != self._mtimes[path]:
+                    self._mtimes[path] = mtime
+                    changed.append(Path(path))
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return sorted(changed)
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class RetryPolicy:
+    """
+    Bounded retries with jittered exponential backoff.
+
+    Connection errors, 429/5xx responses and GitHub's rate-limit 403 are retried.
+    A server hint (Retry-After, or X-RateLimit-Reset once the remaining quota is
+    0) replaces the computed backoff, unless it is longer than `max_wait`.
+    """
+
+    RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self,
+                 attempts: int = 4,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 max_wait: float = 300.0,
+                 requeue: int = 1):
+        """
+        Initialize Retry Policy.
+
+        Args:
+            attempts: Requests per fetch, including the first
+            base_delay: Backoff before the second attempt, doubled for each further one
+            max_delay: Upper bound of the computed backoff
+            max_wait: Longest server-requested wait that is still honored rather than given up on
+            requeue: Extra passes over the files that still failed once every job has run
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.requeue = requeue
+
+    def is_retryable(self, response: httpx.Response) -> bool:
+        if response.status_code in self.RETRY_STATUSES:
+            return True
+        return response.status_code == 403 and response.headers.get('x-ratelimit-remaining') == '0'
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter backoff after the given (1-based) attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def server_retry_delay(response: httpx.Response) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After or GitHub's X-RateLimit-Reset"""
+    retry_after = response.headers.get('retry-after')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    reset = response.headers.get('x-ratelimit-reset')
+    if reset and response.headers.get('x-ratelimit-remaining') == '0':
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+class TokenBucket:
+    """
+    Request rate limiter shared by every fetch of a sync, threaded or async.
+
+    When a server asks us to back off, pause() holds off all fetches rather
+    than only the one that was told.
+    """
+
+    def __init__(self, rate: float = 50.0, capacity: float = None):
+        """
+        Initialize Token Bucket.
+
+        Args:
+            rate: Requests per second (None for no limit)
+            capacity: Burst size (default: one second's worth)
+        """
+        self.rate = rate
+        self.capacity = capacity or rate or 0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+            return delay
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class FileMetrics:
+    """
+    Timings and outcome of syncing one file, reported to the vendor's listeners.
+
+    `connect` covers DNS resolution, TCP connect and TLS handshake, and is None
+    when the request reused a pooled connection (or the transport reports no
+    trace events, e.g. httpx.MockTransport). `ttfb` runs from sending the
+    request to receiving the response headers and `transfer` from there to the
+    end of the body; all three describe the final attempt. `bytes` counts what
+    came over the network and `size` what was written, so a 304 or a cache hit
+    has bytes 0.
+    """
+
+    def __init__(self, source: str, url: str = None, path: str = None):
+        self.source = source
+        self.url = url
+        self.path = path
+        # fetched, unchanged, cached, copied or failed; 'archive' and 'tree' for requests without a path
+        self.status: Optional[str] = None
+        self.http_status: Optional[int] = None
+        self.cache: Optional[str] = None  # 'hit' when no body had to be downloaded, 'miss' otherwise
+        self.retries = 0
+        self.bytes = 0
+        self.size: Optional[int] = None
+        self.connect: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.transfer: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self._connect_started: Optional[float] = None
+
+    def trace(self, name: str, info: dict):
+        """httpx `trace` extension callback timing the connection setup"""
+        if name == 'connection.connect_tcp.started':
+            self._connect_started = time.perf_counter()
+        elif name in ('connection.connect_tcp.complete', 'connection.start_tls.complete') and self._connect_started:
+            self.connect = time.perf_counter() - self._connect_started
+
+    async def trace_async(self, name: str, info: dict):
+        self.trace(name, info)
+
+    def finish(self, ok: bool):
+        self.seconds = time.perf_counter() - self._started
+        if not ok:
+            self.status = 'failed'
+
+    def as_event(self) -> Dict:
+        return {
+            'event': 'file',
+            'source': self.source,
+            'path': self.path,
+            'url': self.url,
+            'status': self.status,
+            'http_status': self.http_status,
+            'cache': self.cache,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'size': self.size,
+            'connect': self.connect,
+            'ttfb': self.ttfb,
+            'transfer': self.transfer,
+            'seconds': self.seconds,
+            'error': self.error,
+        }
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """Nearest-rank p50/p90/p99 and max of some timings (None if there are none)"""
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+
+    def rank(q: int) -> float:
+        return values[max(0, math.ceil(len(values) * q / 100) - 1)]
+
+    return {'p50': rank(50), 'p90': rank(90), 'p99': rank(99), 'max': values[-1]}
+
+
+def summarize_metrics(records: List[FileMetrics]) -> Dict:
+    """Totals and timing percentiles over the files of a source or a whole sync"""
+    # Archive and tree requests have no path; archive members are reported as files of their own
+    files = [record for record in records if record.path is not None]
+    statuses = {}
+    for record in files:
+        statuses[record.status] = statuses.get(record.status, 0) + 1
+    return {
+        'files': len(files),
+        'statuses': statuses,
+        'cache_hits': sum(record.cache == 'hit' for record in files),
+        'cache_misses': sum(record.cache == 'miss' for record in files),
+        'requests': sum(record.http_status is not None for record in records),
+        'retries': sum(record.retries for record in records),
+        'bytes': sum(record.bytes for record in records),
+        'size': sum(record.size or 0 for record in files),
+        'connect': percentiles([record.connect for record in records]),
+        'ttfb': percentiles([record.ttfb for record in records]),
+        'transfer': percentiles([record.transfer for record in records]),
+        'file_seconds': percentiles([record.seconds for record in files]),
+    }
+
+
+class JSONLinesExporter:
+    """
+    Listener appending every sync event to a JSON-lines file, e.g. for a build dashboard.
+
+    Each line is one event (file, source or sync) with a UTC timestamp added.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict):
+        line = json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), **event})
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+
+def default_cache_dir() -> Path:
+    """~/.cache/patchwork, honoring XDG_CACHE_HOME"""
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'patchwork'
+
+
+class ContentCache:
+    """
+    Content-addressed store of fetched files, shared across sources and projects.
+
+    Objects live at objects/<sha256[:2]>/<sha256> and are indexed by URL (which
+    carries the pinned ref, e.g. open-props@2.0.0-beta.5 or .../ui/main/...).
+    Vendored files are materialized from the store as reflinks or copies (hardlinks
+    only on request), objects are checked against their digest before they are
+    reused, and the store is kept under a size bound by evicting least recently
+    used objects.
+    """
+
+    FICLONE = 0x40049409  # ioctl for copy-on-write clones on btrfs/xfs
+
+    def __init__(self, root: str = None, max_bytes: int = 512 * 1024 * 1024, hardlink: bool = False):
+        """
+        Initialize Content Cache.
+
+        Args:
+            root: Cache directory (default: ~/.cache/patchwork)
+            max_bytes: Size bound enforced by evict()
+            hardlink: Materialize as hardlinks when reflinks are unsupported, instead of copying.
+                Saves space, but an in-place edit of a vendored file then changes the cached object
+        """
+        self.root = Path(root) if root else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hardlink = hardlink
+        self._verified: set = set()  # digests checked against their content by this process
+        self.index_path = self.root / "index.json"
+        self.index = self._load()
+        self._dirty = False
+        self._added: set = set()  # URLs indexed by this process since the last save
+        # sync_all_async unpacks archives on a worker thread while the loop thread uses the cache too
+        self._mutex = threading.RLock()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            index = json.loads(self.index_path.read_text())
+            if index.get('version') == 1:
+                return index
+        except (ValueError, OSError):
+            pass
+        return {'version': 1, 'urls': {}, 'objects': {}}
+
+    def save(self):
+        """Persist the index, merged with what other builds sharing the cache saved meanwhile"""
+        with self._mutex:
+            if not self._dirty:
+                return
+            with self._locked():
+                self._merge()
+                self._write()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the index lock for a load-merge-save (without fcntl, e.g. on Windows, saves are unlocked)"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / "index.lock", 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+
+    def _merge(self):
+        """Fold the index on disk into this one; objects no longer in the store are dropped"""
+        disk = self._load()
+        objects = disk['objects']
+        for digest, entry in self.index['objects'].items():
+            merged = objects.setdefault(digest, {})
+            merged.update({key: value for key, value in entry.items() if key != 'last_used'})
+            merged['last_used'] = max(merged.get('last_used', 0), entry.get('last_used', 0))
+        objects = {digest: entry for digest, entry in objects.items() if self.object_path(digest).exists()}
+
+        # URLs this process indexed win; any other entry is as recent on disk as here
+        urls = disk['urls']
+        urls.update((url, self.index['urls'][url]) for url in self._added if url in self.index['urls'])
+        self.index = {'version': 1, 'objects': objects,
+                      'urls': {url: entry for url, entry in urls.items() if entry['sha256'] in objects}}
+
+    def _write(self):
+        replace_file(self.index_path, json.dumps(self.index).encode())
+        self._added.clear()
+        self._dirty = False
+
+    def _index_orphans(self):
+        """Index objects a build stored but died before saving, so eviction counts them"""
+        for path in (self.root / "objects").glob("??/*"):
+            if path.name in self.index['objects'] or not re.fullmatch(r'[0-9a-f]{64}', path.name):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            self.index['objects'][path.name] = {'size': stat.st_size, 'last_used': stat.st_mtime}
+            self._dirty = True
+
+    def object_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def _touch(self, digest: str):
+        with self._mutex:
+            self.index['objects'].setdefault(digest, {})['last_used'] = time.time()
+            self._dirty = True
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """Return the cache entry (sha256, size, etag, last_modified) for a URL, if its object is present and intact"""
+        entry = self.index['urls'].get(url)
+        if entry and self.verify(entry['sha256']):
+            self._touch(entry['sha256'])
+            return entry
+        return None
+
+    def verify(self, digest: str) -> bool:
+        """
+        Check that an object is present and still hashes to its digest.
+
+        A corrupted object (e.g. edited through a hardlink) is removed from the
+        store, so the file is fetched again rather than vendored damaged.
+        """
+        if digest in self._verified:
+            return True
+        path = self.object_path(digest)
+        try:
+            with open(path, 'rb') as file:
+                actual = hashlib.file_digest(file, 'sha256').hexdigest()
+        except OSError:
+            return False
+        if actual == digest:
+            self._verified.add(digest)
+            return True
+
+        print(f"✗ Cached object {digest[:12]} does not match its digest, dropping it")
+        path.unlink(missing_ok=True)
+        with self._mutex:
+            self.index['objects'].pop(digest, None)
+            self._dirty = True
+        return False
+
+    def writer(self) -> 'CacheWriter':
+        """Start streaming a new object into the store"""
+        return CacheWriter(self)
+
+    def put(self, url: str, content: bytes, etag: str = None, last_modified: str = None) -> str:
+        """
+        Store content for a URL.
+
+        Returns:
+            The sha256 of the content
+        """
+        writer = self.writer()
+        writer.write(content)
+        return writer.commit(url, etag, last_modified)
+
+    def _add(self, url: str, digest: str, size: int, etag: str = None, last_modified: str = None):
+        with self._mutex:
+            self.index['objects'][digest] = {'size': size, 'last_used': time.time()}
+            self.index['urls'][url] = {'sha256': digest, 'size': size,
+                                       'etag': etag, 'last_modified': last_modified}
+            self._added.add(url)
+            self._dirty = True
+
+    def materialize(self, digest: str, output_path: Path) -> str:
+        """
+        Place a cached object at output_path as a reflink, else a copy (or a hardlink if enabled).
+
+        Returns:
+            The method used: 'reflink', 'hardlink' or 'copy'
+        """
+        source = self.object_path(digest)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+        if tmp.exists():
+            tmp.unlink()
+
+        method = None
+        if fcntl is not None:
+            try:
+                with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+                tmp.chmod(0o644)
+                method = 'reflink'
+            except OSError:
+                tmp.unlink(missing_ok=True)
+
+        if method is None and self.hardlink:
+            try:
+                # Shares the object's read-only inode; verify() catches objects edited anyway
+                os.link(source, tmp)
+                method = 'hardlink'
+            except OSError:
+                pass
+
+        if method is None:
+            shutil.copyfile(source, tmp)
+            tmp.chmod(0o644)
+            method = 'copy'
+
+        os.replace(tmp, output_path)
+        self._touch(digest)
+        return method
+
+    def size(self) -> int:
+        return sum(entry.get('size', 0) for entry in self.index['objects'].values())
+
+    def evict(self) -> int:
+        """
+        Delete least recently used objects until the store fits in max_bytes.
+
+        The index is merged with the one on disk first, and objects nothing
+        indexed (left by a build that died before saving) are counted too.
+        Files already materialized from an evicted object are unaffected.
+
+        Returns:
+            Number of bytes freed
+        """
+        with self._mutex, self._locked():
+            self._merge()
+            self._index_orphans()
+            total = self.size()
+            freed = 0
+            by_age = sorted(self.index['objects'].items(), key=lambda item: item[1].get('last_used', 0))
+            for digest, entry in by_age:
+                if total - freed <= self.max_bytes:
+                    break
+                self.object_path(digest).unlink(missing_ok=True)
+                del self.index['objects'][digest]
+                freed += entry.get('size', 0)
+
+            if freed:
+                self.index['urls'] = {url: entry for url, entry in self.index['urls'].items()
+                                      if entry['sha256'] in self.index['objects']}
+                self._dirty = True
+                print(f"✓ Evicted {freed} bytes from {self.root}")
+            if self._dirty:
+                self._write()
+        return freed
+
+
+class CacheWriter:
+    """
+    Stream one object into a ContentCache through a temporary file.
+
+    Content is hashed as it is written, so the object is only renamed into
+    place under its sha256 once complete; an aborted write leaves nothing behind.
+    """
+
+    def __init__(self, cache: ContentCache):
+        self.cache = cache
+        incoming = cache.root / "objects"
+        incoming.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=incoming, prefix=".incoming-")
+        self._file = os.fdopen(fd, 'wb')
+        self._tmp = Path(name)
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.digest: Optional[str] = None
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, url: str, etag: str = None, last_modified: str = None) -> str:
+        """
+        Move the object into the store and index it under a URL.
+
+        Returns:
+            The sha256 of the content
+        """
+        self._file.close()
+        self.digest = self._sha256.hexdigest()
+        path = self.cache.object_path(self.digest)
+        if self.cache.verify(self.digest):
+            self._tmp.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Objects may be shared through hardlinks, so keep them read-only
+            self._tmp.chmod(0o444)
+            os.replace(self._tmp, path)
+            self.cache._verified.add(self.digest)
+        self.cache._add(url, self.digest, self.size, etag, last_modified)
+        return self.digest
+
+    def abort(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def _link_or_copy(source: str, destination: str):
+    """copytree copy_function that hardlinks, falling back to a copy (e.g. across filesystems)"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def exchange_directories(staged: Path, live: Path):
+    """
+    Swap a staged directory with the live one, so that readers see either tree but never a mix.
+
+    Uses renameat2(RENAME_EXCHANGE) on Linux, which swaps both names in one
+    atomic step. Elsewhere the live tree is renamed aside first, leaving a
+    moment in which it is missing (but never half-updated). Either way the
+    previous tree ends up at `staged`.
+    """
+    if not live.exists():
+        os.rename(staged, live)
+        staged.mkdir()
+        return
+
+    if sys.platform.startswith('linux'):
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = getattr(libc, 'renameat2', None)
+        if renameat2 is not None:
+            AT_FDCWD, RENAME_EXCHANGE = -100, 2
+            if renameat2(AT_FDCWD, os.fsencode(staged), AT_FDCWD, os.fsencode(live), RENAME_EXCHANGE) == 0:
+                return
+            print(f"✗ renameat2 failed ({os.strerror(ctypes.get_errno())}), swapping in two steps")
+
+    aside = live.with_name(f".{live.name}.{os.getpid()}.old")
+    os.rename(live, aside)
+    os.rename(staged, live)
+    os.rename(aside, staged)
+
 
 class CSSVendor:
     """Pull CSS dependencies from various sources and organize them into a structured repository"""
 
-    def __init__(self, output_dir: str = "css"):
+    LOCK_FILE = "vendor.lock.json"
+
+    def __init__(self,
+                 output_dir: str = "css",
+                 cache: Optional[ContentCache] = None,
+                 offline: bool = False,
+                 retry: Optional[RetryPolicy] = None,
+                 rate_limit: Optional[float] = 50.0,
+                 transport: Optional[httpx.BaseTransport] = None):
         """
         Initialize CSS Vendor.
 
         Args:
             output_dir: Root directory where CSS will be stored
+            cache: Content-addressed store for fetched files (default: ~/.cache/patchwork)
+            offline: Sync entirely from the cache without any network I/O
+            retry: Retry and re-queue policy for failed requests
+            rate_limit: Requests per second shared by all fetches (None for no limit)
+            transport: httpx transport for every client, e.g. an httpx.MockTransport in tests
         """
         self.output_dir = Path(output_dir)
+        self.cache = cache or ContentCache()
+        self.offline = offline
+        self.retry = retry or RetryPolicy()
+        self.bucket = TokenBucket(rate_limit)
+        self.transport = transport
+        self._client: Optional[httpx.Client] = None
+        # URLs that failed for good (e.g. a 404); re-queuing them cannot help
+        self.permanent_failures: set = set()
         self.sources: Dict[str, Dict] = {}
+        self.lock_path = self.output_dir / self.LOCK_FILE
+        lock = self._read_lock()
+        self.lock: Dict[str, Dict] = lock.get('files', {})
+        # Pinned revision of each source with a ref: {'spec', 'ref', 'pin', 'synced'}
+        self.resolved: Dict[str, Dict] = lock.get('sources', {})
+        self.stages: List[Callable[['CSSVendor', Dict[str, int]], None]] = []
+        self.listeners: List[Callable[[Dict], None]] = []
+        # Metrics of every file handled by the current (or last) sync
+        self.file_metrics: List[FileMetrics] = []
+        # Guards the lock, the pins and the metrics, which sync_all_async also updates from the
+        # worker thread unpacking an archive
+        self._mutex = threading.RLock()
 
     def add_source(self,
                    name: str,
@@ -24,90 +831,934 @@ class CSSVendor:
                    directories: Dict[str, List[str]] = None,
                    auto_pull: bool = False,
                    github_repo: str = None,
-                   local_dir: str = None):
+                   local_dir: str = None,
+                   archive: bool = False,
+                   ref: str = None,
+                   include: List[str] = None):
         """
         Add a source to pull CSS files from.
 
         Args:
             name: Name of the source (used as a subdirectory)
             base_url: Base URL to fetch files from
-            files: List of files to fetch (relative to base_url)
+            files: List of files to fetch (relative to base_url); glob patterns for a local_dir
             directories: Dictionary of directories to create with list of files to fetch in each
             auto_pull: If True, will auto-pull all files from a GitHub repository
             github_repo: GitHub repository path (e.g., "owner/repo/branch/path")
             local_dir: Local directory to copy files from (instead of fetching from URL)
+            archive: If True, auto-pull downloads the repository tarball once instead of each file
+            ref: Branch, tag, commit or npm version/dist-tag substituted for `{ref}` in base_url
+                and github_repo; resolved to a commit SHA or exact version and pinned in the lock
+            include: Glob patterns (relative to the repository path) an auto-pulled file must match
         """
-        self.sources[name] = {
+        if (ref is not None) != ('{ref}' in (base_url or '') + (github_repo or '')):
+            raise ValueError(f"Source {name} needs both a ref and a {{ref}} in its base_url or github_repo, "
+                             f"or neither")
+
+        source = {
             'base_url': base_url,
             'files': files or [],
             'directories': directories or {},
             'auto_pull': auto_pull,
             'github_repo': github_repo,
-            'local_dir': local_dir
+            'local_dir': local_dir,
+            'archive': archive,
+            'ref': ref,
+            'include': include or [],
         }
+        # The ref-independent description of the source; a pin is only reused while it is unchanged
+        source['spec'] = hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()
+        source['template'] = {'base_url': base_url, 'github_repo': github_repo}
+        source['pin'] = None
+        self.sources[name] = source
+        if ref is not None:
+            self._apply_pin(name, ref)
 
-    def fetch_file(self, url: str, output_path: Path) -> bool:
-        """Fetch a single file from URL"""
+    def add_stage(self, stage: Callable[['CSSVendor', Dict[str, int]], None]):
+        """
+        Register a post-sync pipeline stage.
+
+        Stages run in the order they were added, after every sync_all, and are
+        called with the vendor and the per-source results.
+        """
+        self.stages.append(stage)
+
+    def run_stages(self, results: Dict[str, int]):
+        """Run the post-sync pipeline stages"""
+        for stage in self.stages:
+            print(f"\nRunning {getattr(stage, '__name__', 'stage')}...")
+            stage(self, results)
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        """
+        Register a callback for structured sync events (e.g. a JSONLinesExporter).
+
+        Listeners are called with one dict per event:
+            file:   one per file synced, with the fields of FileMetrics
+            source: per-source totals and timing percentiles (see summarize_metrics)
+            sync:   the same over every source, once the sync is complete
+        """
+        self.listeners.append(listener)
+
+    def emit(self, event: Dict):
+        """Send an event to every listener; a failing listener never fails the sync"""
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"✗ Metrics listener {getattr(listener, '__name__', listener)} failed: {str(e)}")
+
+    def _source_of(self, key: str) -> Optional[str]:
+        """Name of the source a lock key belongs to (the longest matching source directory)"""
+        return max((source for source in self.sources if key.startswith(source + '/')), key=len, default=None)
+
+    def _file_metrics(self, url: Optional[str], output_path: Path) -> FileMetrics:
+        key = self._lock_key(output_path)
+        return FileMetrics(self._source_of(key), url, key)
+
+    def _report(self, metrics: FileMetrics, ok: bool = True):
+        """Finish a file's metrics, keep them for the sync summary and send them to the listeners"""
+        metrics.finish(ok)
+        with self._mutex:
+            self.file_metrics.append(metrics)
+            self.emit(metrics.as_event())
+
+    def _report_source(self, name: str, seconds: float):
+        with self._mutex:
+            records = [record for record in self.file_metrics if record.source == name]
+            self.emit({'event': 'source', 'source': name, 'seconds': seconds, **summarize_metrics(records)})
+
+    def _report_sync(self, seconds: float, concurrent: bool):
+        with self._mutex:
+            self.emit({'event': 'sync', 'sources': list(self.sources), 'concurrent': concurrent,
+                       'offline': self.offline, 'seconds': seconds, **summarize_metrics(self.file_metrics)})
+
+    def _read_lock(self) -> Dict:
+        if not self.lock_path.exists():
+            return {}
         try:
-            response = httpx.get(url)
-            if response.status_code == 200:
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                output_path.write_text(response.text)
-                print(f"✓ Fetched {output_path.relative_to(self.output_dir)}")
+            return json.loads(self.lock_path.read_text())
+        except (ValueError, OSError) as e:
+            print(f"✗ Ignoring unreadable lockfile {self.lock_path}: {str(e)}")
+            return {}
+
+    def load_lock(self) -> Dict[str, Dict]:
+        """Load the lockfile recording what was last written for each vendored file"""
+        return self._read_lock().get('files', {})
+
+    def save_lock(self):
+        """Write the lockfile, sorted so that diffs stay readable"""
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._mutex:
+            data = {'version': 1,
+                    'sources': dict(sorted(self.resolved.items())),
+                    'files': dict(sorted(self.lock.items()))}
+            replace_file(self.lock_path, (json.dumps(data, indent=2) + "\n").encode())
+
+    # ------------------------------------------------------------------
+    # Ref resolution
+    # ------------------------------------------------------------------
+
+    def _apply_pin(self, name: str, pin: str):
+        """Substitute a ref (or its resolved pin) into the URLs of a source"""
+        source = self.sources[name]
+        for key, template in source['template'].items():
+            source[key] = template.replace('{ref}', pin) if template else template
+        source['pin'] = pin
+
+    @staticmethod
+    def _static_pin(ref: str) -> Optional[str]:
+        """The pin of a ref that already names an immutable revision"""
+        return ref if COMMIT_SHA.match(ref) or EXACT_VERSION.match(ref) else None
+
+    @staticmethod
+    def _npm_package(base_url: str) -> Optional[str]:
+        """The npm package of an unpkg or jsDelivr URL template such as https://unpkg.com/open-props@{ref}"""
+        match = re.search(r'(?:unpkg\.com|cdn\.jsdelivr\.net/npm)/((?:@[^/@]+/)?[^/@]+)@\{ref\}', base_url or '')
+        return match.group(1) if match else None
+
+    def _resolve_url(self, source: Dict) -> Tuple[Optional[str], Dict[str, str]]:
+        """The request that resolves a source's ref, as (url, headers), or (None, {}) if it cannot be resolved"""
+        template = source['template']
+        if template['github_repo']:
+            owner, repo = template['github_repo'].split('/')[:2]
+            return (f"https://api.github.com/repos/{owner}/{repo}/commits/{source['ref']}",
+                    {'Accept': 'application/vnd.github.sha'})
+        package = self._npm_package(template['base_url'])
+        if package:
+            return f"https://registry.npmjs.org/{package}/{source['ref']}", {'Accept': 'application/json'}
+        return None, {}
+
+    async def _resolve_ref_async(self,
+                                 client: httpx.AsyncClient,
+                                 semaphore: asyncio.Semaphore,
+                                 name: str) -> Optional[str]:
+        """Ask upstream which commit (or version) a source's ref points to now"""
+        source = self.sources[name]
+        url, headers = self._resolve_url(source)
+        if url is None:
+            return None
+
+        async def handle(response: httpx.Response) -> Optional[str]:
+            await response.aread()
+            if response.status_code != 200:
+                print(f"✗ Failed to resolve {name}@{source['ref']}: {response.status_code}")
+                return None
+            if 'github' in response.request.headers.get('accept', ''):
+                return response.text.strip()
+            return response.json().get('version')
+
+        metrics = FileMetrics(name, url)
+        metrics.status = 'resolve'
+        try:
+            pin = await self._request_async(client, semaphore, url, handle, headers=headers, metrics=metrics)
+        except Exception as e:
+            print(f"✗ Error resolving {name}@{source['ref']}: {str(e)}")
+            metrics.error = str(e) or type(e).__name__
+            pin = None
+        self._report(metrics, pin is not None)
+        return pin
+
+    async def resolve_async(self,
+                            client: httpx.AsyncClient,
+                            semaphore: asyncio.Semaphore,
+                            update: Union[bool, Iterable[str]] = False) -> Dict[str, str]:
+        """
+        Pin every source with a ref to a commit SHA or exact version.
+
+        A pin recorded in the lock is reused as long as the source is described
+        the same way, so an unchanged manifest needs no remote resolution at
+        all. Refs that are already immutable are pinned as they are; the others
+        (branches, tags, dist-tags) are resolved upstream concurrently. When a
+        ref cannot be resolved, the previous pin is kept, or the ref itself is
+        used unpinned.
+
+        Args:
+            client: Shared async client
+            semaphore: Limit on in-flight requests
+            update: Re-resolve every ref (True) or the refs of the named sources
+
+        Returns:
+            Dictionary mapping source names to their pins
+        """
+        update = update if isinstance(update, bool) else set(update)
+        pending = []
+        for name, source in self.sources.items():
+            if source['ref'] is None:
+                continue
+            locked = self.resolved.get(name, {})
+            forced = update is True or (update and name in update)
+            if locked.get('spec') == source['spec'] and locked.get('pin') and not forced:
+                self._apply_pin(name, locked['pin'])
+                continue
+            pin = self._static_pin(source['ref'])
+            if pin is None and self.offline and locked.get('spec') == source['spec']:
+                pin = locked.get('pin')
+            if pin or self.offline:
+                self._pin(name, pin or source['ref'], pin is not None)
+                continue
+            pending.append(name)
+
+        if pending:
+            refs = [f"{name}@{self.sources[name]['ref']}" for name in pending]
+            print(f"Resolving {', '.join(refs)}...")
+            pins = await asyncio.gather(*(self._resolve_ref_async(client, semaphore, name) for name in pending))
+            for name, pin in zip(pending, pins):
+                previous = self.resolved.get(name, {})
+                if pin is None and previous.get('pin') and previous.get('spec') == self.sources[name]['spec']:
+                    print(f"✗ Keeping {name} pinned to {previous['pin'][:12]}")
+                    pin = previous['pin']
+                self._pin(name, pin or self.sources[name]['ref'], pin is not None)
+        return {name: source['pin'] for name, source in self.sources.items() if source['ref'] is not None}
+
+    def resolve(self, update: Union[bool, Iterable[str]] = False) -> Dict[str, str]:
+        """Synchronous counterpart of resolve_async, with a client of its own"""
+        async def run() -> Dict[str, str]:
+            async with self.create_async_client() as client:
+                return await self.resolve_async(client, asyncio.Semaphore(16), update)
+
+        if not any(source['ref'] is not None for source in self.sources.values()):
+            return {}
+        return asyncio.run(run())
+
+    def _pin(self, name: str, pin: str, pinned: bool):
+        """Apply a pin and record it in the lock; an unpinned ref is recorded without one"""
+        source = self.sources[name]
+        self._apply_pin(name, pin)
+        previous = self.resolved.get(name, {})
+        if pinned and previous.get('pin') != pin:
+            print(f"✓ Pinned {name}@{source['ref']} to {pin}")
+        self.resolved[name] = {
+            'spec': source['spec'],
+            'ref': source['ref'],
+            'pin': pin if pinned else None,
+            # Whether the files on disk are the ones of this pin; set once a sync of it succeeds
+            'synced': previous.get('synced') if pinned and previous.get('pin') == pin
+                      and previous.get('spec') == source['spec'] else None,
+        }
+
+    def _is_pinned(self, name: str) -> bool:
+        entry = self.resolved.get(name)
+        return bool(entry) and entry.get('pin') is not None and entry['pin'] == self.sources[name]['pin']
+
+    def _skip_pinned(self, name: str) -> Optional[int]:
+        """
+        Skip a source whose pinned revision was already synced completely.
+
+        A pin names immutable content, so as long as every file recorded for the
+        source is still on disk there is nothing to ask upstream.
+
+        Returns:
+            Number of files confirmed unchanged, or None if the source has to be synced
+        """
+        if not self._is_pinned(name) or self.resolved[name].get('synced') != self.sources[name]['pin']:
+            return None
+        jobs = self._locked_jobs(name)
+        if not jobs or not all(output_path.exists() for _, output_path, _ in jobs):
+            return None
+
+        print(f"= Unchanged {name} (pinned to {self.sources[name]['pin'][:12]})")
+        for url, output_path, _ in jobs:
+            metrics = self._file_metrics(url, output_path)
+            metrics.status, metrics.cache = 'unchanged', 'hit'
+            metrics.size = self.lock[self._lock_key(output_path)].get('size')
+            self._report(metrics)
+        return len(jobs)
+
+    def _mark_synced(self, name: str):
+        """Record that a pinned source synced without failures, so later syncs can skip it"""
+        if self._is_pinned(name):
+            with self._mutex:
+                failed = any(record.source == name and record.status == 'failed' for record in self.file_metrics)
+                self.resolved[name]['synced'] = None if failed else self.sources[name]['pin']
+
+    def _lock_key(self, output_path: Path) -> str:
+        return output_path.relative_to(self.output_dir).as_posix()
+
+    def is_locked(self, output_path: Path, blob_sha: str) -> bool:
+        """True if the file on disk was written from the given GitHub blob"""
+        entry = self.lock.get(self._lock_key(output_path))
+        return bool(entry) and entry.get('blob_sha') == blob_sha and output_path.exists()
+
+    def _conditional_headers(self, url: str, output_path: Path) -> Dict[str, str]:
+        """Build If-None-Match/If-Modified-Since headers from the lock entry or the cache for a file"""
+        entry = self.lock.get(self._lock_key(output_path))
+        if not entry or entry.get('url') != url or not output_path.exists():
+            # A cached copy can be revalidated and materialized just as well
+            entry = self.cache.lookup(url)
+            if not entry:
+                return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _check_response(self,
+                        url: str,
+                        output_path: Path,
+                        response: httpx.Response,
+                        blob_sha: str = None,
+                        metrics: FileMetrics = None) -> Optional[bool]:
+        """Handle a 304 or failed response; returns None when the body should be stored"""
+        key = self._lock_key(output_path)
+        if metrics:
+            metrics.http_status = response.status_code
+
+        if response.status_code == 304:
+            if output_path.exists():
+                print(f"= Unchanged {key}")
+                if metrics:
+                    metrics.status, metrics.cache = 'unchanged', 'hit'
+                    metrics.size = self.lock.get(key, {}).get('size')
                 return True
+            return self._fetch_from_cache(url, output_path, blob_sha, metrics)
+
+        if response.status_code != 200:
+            print(f"✗ Failed to fetch {url}: {response.status_code}")
+            if not self.retry.is_retryable(response):
+                self.permanent_failures.add(url)
+            return False
+        return None
+
+    def _store_response(self,
+                        url: str,
+                        output_path: Path,
+                        response: httpx.Response,
+                        blob_sha: str = None,
+                        metrics: FileMetrics = None) -> bool:
+        """Stream a fetched response into the cache unless it is unchanged, and record it in the lock"""
+        result = self._check_response(url, output_path, response, blob_sha, metrics)
+        if result is not None:
+            return result
+
+        writer = self.cache.writer()
+        try:
+            for chunk in response.iter_bytes(CHUNK_SIZE):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        self._write_file(url, output_path, writer,
+                         etag=response.headers.get('etag'),
+                         last_modified=response.headers.get('last-modified'),
+                         blob_sha=blob_sha,
+                         metrics=metrics)
+        return True
+
+    async def _store_response_async(self,
+                                    url: str,
+                                    output_path: Path,
+                                    response: httpx.Response,
+                                    blob_sha: str = None,
+                                    metrics: FileMetrics = None) -> bool:
+        """Async counterpart of _store_response for responses of the shared async client"""
+        result = self._check_response(url, output_path, response, blob_sha, metrics)
+        if result is not None:
+            return result
+
+        writer = self.cache.writer()
+        try:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        self._write_file(url, output_path, writer,
+                         etag=response.headers.get('etag'),
+                         last_modified=response.headers.get('last-modified'),
+                         blob_sha=blob_sha,
+                         metrics=metrics)
+        return True
+
+    def _write_file(self,
+                    url: str,
+                    output_path: Path,
+                    writer: CacheWriter,
+                    etag: str = None,
+                    last_modified: str = None,
+                    blob_sha: str = None,
+                    metrics: FileMetrics = None):
+        """Commit streamed content to the cache, materialize it unless unchanged, and record it in the lock"""
+        key = self._lock_key(output_path)
+        digest = writer.commit(url, etag, last_modified)
+        previous = self.lock.get(key, {})
+
+        if previous.get('sha256') == digest and output_path.exists():
+            print(f"= Unchanged {key}")
+            status = 'unchanged'
+        else:
+            self.cache.materialize(digest, output_path)
+            print(f"✓ Fetched {key}")
+            status = 'fetched'
+        if metrics:
+            metrics.status, metrics.cache, metrics.size = status, 'miss', writer.size
+
+        self._record(key, url, digest, writer.size, etag, last_modified, blob_sha)
+
+    def _record(self,
+                key: str,
+                url: str,
+                digest: str,
+                size: int,
+                etag: str = None,
+                last_modified: str = None,
+                blob_sha: str = None):
+        """Record what was written for a file in the lock"""
+        with self._mutex:
+            previous = self.lock.get(key, {})
+            self.lock[key] = {
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'sha256': digest,
+                'size': size,
+                'blob_sha': blob_sha or previous.get('blob_sha'),
+            }
+
+    def _fetch_from_cache(self, url: str, output_path: Path, blob_sha: str = None,
+                          metrics: FileMetrics = None) -> bool:
+        """Materialize a file from the content cache without touching the network"""
+        key = self._lock_key(output_path)
+        entry = self.cache.lookup(url)
+        if entry is None:
+            print(f"✗ Not in cache: {url}")
+            self.permanent_failures.add(url)
+            if metrics:
+                metrics.cache = 'miss'
+            return False
+
+        previous = self.lock.get(key, {})
+        if previous.get('sha256') == entry['sha256'] and output_path.exists():
+            print(f"= Unchanged {key}")
+            status = 'unchanged'
+        else:
+            method = self.cache.materialize(entry['sha256'], output_path)
+            print(f"✓ Cached {key} ({method})")
+            status = 'cached'
+        if metrics:
+            metrics.status, metrics.cache, metrics.size = status, 'hit', entry['size']
+        self._record(key, url, entry['sha256'], entry['size'],
+                     entry.get('etag'), entry.get('last_modified'), blob_sha)
+        return True
+
+    def _locked_jobs(self, name: str) -> List[Tuple[str, Path, str]]:
+        """Rebuild a source's download jobs from the lock, for syncing auto-pull sources offline"""
+        jobs = []
+        with self._mutex:
+            entries = list(self.lock.items())
+        for key, entry in entries:
+            if self._source_of(key) == name:
+                jobs.append((entry['url'], self.output_dir / key, entry.get('blob_sha')))
+        return jobs
+
+    @property
+    def client(self) -> httpx.Client:
+        """Pooled client for synchronous fetches"""
+        if self._client is None:
+            self._client = httpx.Client(transport=self.transport, follow_redirects=True)
+        return self._client
+
+    def close(self):
+        """Close the pooled synchronous client"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _retry_delay(self, url: str, attempt: int, response: httpx.Response = None,
+                     error: Exception = None) -> Optional[float]:
+        """
+        Decide whether a request is retried.
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        if attempt >= self.retry.attempts:
+            return None
+        if response is not None and not self.retry.is_retryable(response):
+            return None
+
+        hint = server_retry_delay(response) if response is not None else None
+        if hint is not None:
+            if hint > self.retry.max_wait:
+                print(f"✗ Rate limited on {url} for {hint:.0f}s, giving up")
+                return None
+            # The limit applies to every request, not only this one
+            self.bucket.pause(hint)
+            delay = hint
+        else:
+            delay = self.retry.backoff(attempt)
+
+        reason = response.status_code if response is not None else str(error) or type(error).__name__
+        print(f"↻ Retrying {url} in {delay:.1f}s ({reason})")
+        return delay
+
+    def _request(self,
+                 url: str,
+                 handle: Callable[[httpx.Response], object],
+                 headers: Dict[str, str] = None,
+                 metrics: FileMetrics = None):
+        """
+        GET a URL through the rate limiter, retrying transient failures.
+
+        The response is streamed and passed to `handle`, whose result is
+        returned; a connection dropped mid-body is retried like any other.
+        If given, `metrics` receives the timings of the final attempt.
+        """
+        attempt = 0
+        extensions = {'trace': metrics.trace} if metrics else None
+        while True:
+            attempt += 1
+            self.bucket.wait()
+            request = self.client.build_request("GET", url, headers=headers, extensions=extensions)
+            try:
+                sent = time.perf_counter()
+                response = self.client.send(request, stream=True)
+                received = time.perf_counter()
+                try:
+                    delay = self._retry_delay(url, attempt, response=response)
+                    if delay is None:
+                        try:
+                            return handle(response)
+                        finally:
+                            self._time_response(metrics, response, attempt, sent, received)
+                finally:
+                    response.close()
+            except httpx.TransportError as e:
+                delay = self._retry_delay(url, attempt, error=e)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def _request_async(self,
+                             client: httpx.AsyncClient,
+                             semaphore: asyncio.Semaphore,
+                             url: str,
+                             handle: Callable[[httpx.Response], Awaitable],
+                             headers: Dict[str, str] = None,
+                             metrics: FileMetrics = None):
+        """GET a URL through the rate limiter and semaphore, retrying transient failures (see _request)"""
+        attempt = 0
+        extensions = {'trace': metrics.trace_async} if metrics else None
+        while True:
+            attempt += 1
+            await self.bucket.wait_async()
+            request = client.build_request("GET", url, headers=headers, extensions=extensions)
+            try:
+                # The slot is held while the body streams in, but not while backing off
+                async with semaphore:
+                    sent = time.perf_counter()
+                    response = await client.send(request, stream=True)
+                    received = time.perf_counter()
+                    try:
+                        delay = self._retry_delay(url, attempt, response=response)
+                        if delay is None:
+                            try:
+                                return await handle(response)
+                            finally:
+                                self._time_response(metrics, response, attempt, sent, received)
+                    finally:
+                        await response.aclose()
+            except httpx.TransportError as e:
+                delay = self._retry_delay(url, attempt, error=e)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _time_response(metrics: Optional[FileMetrics], response: httpx.Response, attempt: int,
+                       sent: float, received: float):
+        """Record the timings of the attempt whose response was handled"""
+        if metrics:
+            metrics.retries = attempt - 1
+            metrics.http_status = response.status_code
+            metrics.ttfb = received - sent
+            metrics.transfer = time.perf_counter() - received
+            metrics.bytes = response.num_bytes_downloaded
+
+    def _requeue(self, failed: List[Tuple[str, Path, str]], rounds: int) -> List[Tuple[str, Path, str]]:
+        """Pick the failed jobs worth another pass, or none once the re-queue budget is spent"""
+        failed = [job for job in failed if job[0] not in self.permanent_failures]
+        if rounds >= self.retry.requeue or not failed:
+            return []
+        print(f"↻ Re-queuing {len(failed)} failed files")
+        return failed
+
+    def fetch_jobs(self, jobs: List[Tuple[str, Path, str]]) -> int:
+        """
+        Fetch (url, output_path, blob_sha) jobs one by one, re-queuing the ones that failed.
+
+        Returns:
+            Number of files successfully synced
+        """
+        count = 0
+        rounds = 0
+        while jobs:
+            failed = [job for job in jobs if not self.fetch_file(*job)]
+            count += len(jobs) - len(failed)
+            jobs = self._requeue(failed, rounds)
+            rounds += 1
+            if jobs:
+                time.sleep(self.retry.backoff(self.retry.attempts))
+        return count
+
+    async def fetch_jobs_async(self,
+                               client: httpx.AsyncClient,
+                               semaphore: asyncio.Semaphore,
+                               jobs: List[Tuple[str, Path, str]]) -> int:
+        """Fetch (url, output_path, blob_sha) jobs concurrently, re-queuing the ones that failed"""
+        count = 0
+        rounds = 0
+        while jobs:
+            results = await asyncio.gather(*(self.fetch_file_async(client, semaphore, *job) for job in jobs))
+            failed = [job for job, ok in zip(jobs, results) if not ok]
+            count += len(jobs) - len(failed)
+            jobs = self._requeue(failed, rounds)
+            rounds += 1
+            if jobs:
+                await asyncio.sleep(self.retry.backoff(self.retry.attempts))
+        return count
+
+    def fetch_file(self, url: str, output_path: Path, blob_sha: str = None) -> bool:
+        """Fetch a single file from URL"""
+        metrics = self._file_metrics(url, output_path)
+        ok = False
+        try:
+            if self.offline:
+                ok = self._fetch_from_cache(url, output_path, blob_sha, metrics)
             else:
-                print(f"✗ Failed to fetch {url}: {response.status_code}")
-                return False
+                ok = self._request(url,
+                                   lambda response: self._store_response(url, output_path, response,
+                                                                         blob_sha, metrics),
+                                   headers=self._conditional_headers(url, output_path),
+                                   metrics=metrics)
         except Exception as e:
             print(f"✗ Error fetching {url}: {str(e)}")
-            return False
+            metrics.error = str(e) or type(e).__name__
+        self._report(metrics, ok)
+        return ok
 
     def copy_local_file(self, source_path: Path, dest_path: Path) -> bool:
         """Copy a file from a local directory"""
+        metrics = self._file_metrics(None, dest_path)
+        ok = False
         try:
             if not source_path.exists():
                 print(f"✗ Source file does not exist: {source_path}")
-                return False
-
-            dest_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(source_path, dest_path)
-            print(f"✓ Copied {dest_path.relative_to(self.output_dir)}")
-            return True
+                metrics.error = "source file does not exist"
+            else:
+                dest_path.parent.mkdir(parents=True, exist_ok=True)
+                # Copy beside the destination and rename, so readers never see a partial file
+                tmp = dest_path.with_name(f".{dest_path.name}.{os.getpid()}.tmp")
+                shutil.copy2(source_path, tmp)
+                os.replace(tmp, dest_path)
+                print(f"✓ Copied {dest_path.relative_to(self.output_dir)}")
+                metrics.status, metrics.size = 'copied', dest_path.stat().st_size
+                ok = True
         except Exception as e:
             print(f"✗ Error copying {source_path}: {str(e)}")
-            return False
+            metrics.error = str(e)
+        self._report(metrics, ok)
+        return ok
 
-    def get_github_files(self, repo_path: str) -> List[dict]:
-        """Get all files from a GitHub repository recursively using the GitHub API"""
-        # Parse repo path
+    @staticmethod
+    def parse_github_repo(repo_path: str) -> Optional[Tuple[str, str, str, str]]:
+        """
+        Split a GitHub repository path into its parts.
+
+        Args:
+            repo_path: GitHub repository path (e.g., "owner/repo/branch/path")
+
+        Returns:
+            tuple: (owner, repo, branch, path) or None if the path is invalid
+        """
         parts = repo_path.split('/')
         if len(parts) < 3:
-            print(f"Invalid GitHub repository path: {repo_path}")
-            return []
+            return None
 
         owner, repo = parts[0], parts[1]
         branch = parts[2] if len(parts) > 2 else "main"
         path = '/'.join(parts[3:]) if len(parts) > 3 else ""
+        return owner, repo, branch, path
+
+    def _github_api_url(self, repo_path: str) -> Optional[str]:
+        """Build the recursive tree API URL for a GitHub repository path"""
+        parsed = self.parse_github_repo(repo_path)
+        if parsed is None:
+            print(f"Invalid GitHub repository path: {repo_path}")
+            return None
+
+        owner, repo, branch, _ = parsed
+        return f"https://api.github.com/repos/{owner}/{repo}/git/trees/{branch}?recursive=1"
+
+    def _filter_github_tree(self, repo_path: str, data: dict) -> List[dict]:
+        """Filter a GitHub tree API response for CSS files in the repository path"""
+        path = self.parse_github_repo(repo_path)[3]
+        files = []
+        for item in data.get('tree', []):
+            if item['type'] == 'blob' and item['path'].endswith('.css'):
+                if not path or item['path'].startswith(path):
+                    files.append(item)
+        return files
 
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{branch}?recursive=1"
+    def _github_tree_response(self, repo_path: str, response: httpx.Response) -> List[dict]:
+        if response.status_code == 200:
+            return self._filter_github_tree(repo_path, response.json())
+        print(f"Failed to fetch GitHub repository files: {response.status_code}")
+        return []
 
+    def get_github_files(self, repo_path: str) -> List[dict]:
+        """Get all files from a GitHub repository recursively using the GitHub API"""
+        api_url = self._github_api_url(repo_path)
+        if api_url is None:
+            return []
+
+        def handle(response: httpx.Response) -> List[dict]:
+            response.read()
+            return self._github_tree_response(repo_path, response)
+
+        metrics = self._tree_metrics(repo_path, api_url)
         try:
-            response = httpx.get(api_url)
-            if response.status_code == 200:
-                data = response.json()
-                # Filter for CSS files and files in the specified path
-                files = []
-                for item in data.get('tree', []):
-                    if item['type'] == 'blob' and item['path'].endswith('.css'):
-                        if not path or item['path'].startswith(path):
-                            files.append(item)
-                return files
-            else:
-                print(f"Failed to fetch GitHub repository files: {response.status_code}")
-                return []
+            files = self._request(api_url, handle, metrics=metrics)
         except Exception as e:
             print(f"Error fetching GitHub repository files: {str(e)}")
-            return []
+            metrics.error = str(e) or type(e).__name__
+            files = []
+        self._report(metrics, metrics.http_status == 200)
+        return files
+
+    def _tree_metrics(self, repo_path: str, api_url: str) -> FileMetrics:
+        """Metrics of a tree API request, reported without a path like an archive download"""
+        name = next((name for name, source in self.sources.items() if source['github_repo'] == repo_path), None)
+        metrics = FileMetrics(name, api_url)
+        metrics.status = 'tree'
+        return metrics
+
+    def _github_jobs(self, source: Dict, files: List[dict], source_dir: Path) -> List[Tuple[str, Path, str]]:
+        """Map GitHub tree entries to (url, output_path, blob_sha) download jobs"""
+        jobs = []
+        base_url = source['base_url']
+        prefix = self.parse_github_repo(source['github_repo'])[3]
+        prefix = prefix + '/' if prefix else ''
+
+        for file_info in files:
+            file_path = file_info['path']
+            # If path is specified in github_repo, remove it from file_path
+            if prefix and file_path.startswith(prefix):
+                file_path = file_path[len(prefix):]
+            if not self._included(source, file_path):
+                continue
+
+            jobs.append((f"{base_url}/{file_path}", source_dir / file_path, file_info.get('sha')))
+        return jobs
+
+    @staticmethod
+    def _included(source: Dict, file_path: str) -> bool:
+        """True if an auto-pulled file matches the include patterns of its source (all do without any)"""
+        return not source['include'] or any(PurePosixPath(file_path).full_match(pattern)
+                                            for pattern in source['include'])
+
+    def _skip_locked(self, jobs: List[Tuple[str, Path, str]]) -> Tuple[List[Tuple[str, Path, str]], int]:
+        """Drop GitHub jobs whose blob is unchanged since the last sync, returning (jobs, skipped)"""
+        pending = []
+        for url, output_path, blob_sha in jobs:
+            if blob_sha and self.is_locked(output_path, blob_sha):
+                print(f"= Unchanged {self._lock_key(output_path)}")
+                metrics = self._file_metrics(url, output_path)
+                metrics.status, metrics.cache = 'unchanged', 'hit'
+                metrics.size = self.lock[self._lock_key(output_path)].get('size')
+                self._report(metrics)
+            else:
+                pending.append((url, output_path, blob_sha))
+        return pending, len(jobs) - len(pending)
+
+    def _url_jobs(self, source: Dict, source_dir: Path) -> List[Tuple[str, Path, str]]:
+        """Map the files and directories of a URL source to (url, output_path, blob_sha) download jobs"""
+        base_url = source['base_url']
+        jobs = [(f"{base_url}/{file}", source_dir / file, None) for file in source['files']]
+
+        for dir_name, files in source['directories'].items():
+            for file in files:
+                jobs.append((f"{base_url}/{dir_name}/{file}", source_dir / dir_name / file, None))
+        return jobs
+
+    def _local_jobs(self, source: Dict, source_dir: Path) -> List[Tuple[Path, Path]]:
+        """Map the files and directories of a local source to (source_path, output_path) copy jobs"""
+        local_path = Path(source['local_dir'])
+        jobs = []
+        for file in source['files']:
+            if glob.has_magic(file):
+                jobs.extend((path, source_dir / path.relative_to(local_path))
+                            for path in sorted(local_path.glob(file)) if path.is_file())
+            else:
+                jobs.append((local_path / file, source_dir / file))
+
+        for dir_name, files in source['directories'].items():
+            for file in files:
+                jobs.append((local_path / dir_name / file, source_dir / dir_name / file))
+        return jobs
+
+    def github_archive_url(self, repo_path: str) -> Optional[str]:
+        """Build the codeload tarball URL for the pinned ref of a GitHub repository path"""
+        parsed = self.parse_github_repo(repo_path)
+        if parsed is None:
+            print(f"Invalid GitHub repository path: {repo_path}")
+            return None
+
+        owner, repo, branch, _ = parsed
+        return f"https://codeload.github.com/{owner}/{repo}/tar.gz/{branch}"
+
+    def extract_archive(self, source: Dict, source_dir: Path, chunks) -> int:
+        """
+        Write the CSS members of a streamed repository tarball into a source directory.
+
+        The archive is read member by member in stream mode and each member is
+        copied in chunks, so nothing but the selected CSS files ever touches the
+        disk and memory stays bounded however large the archive is.
+
+        Args:
+            source: Source configuration with base_url and github_repo
+            source_dir: Directory the source is vendored into
+            chunks: Iterator of gzip-compressed tarball bytes
+
+        Returns:
+            Number of files written or confirmed unchanged
+        """
+        prefix = self.parse_github_repo(source['github_repo'])[3]
+        prefix = prefix + '/' if prefix else ''
+        count = 0
+
+        reader = io.BufferedReader(_ChunkReader(chunks))
+        with tarfile.open(fileobj=reader, mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.endswith('.css'):
+                    continue
+                # Members are rooted at "<repo>-<ref>/"
+                file_path = member.name.split('/', 1)[-1]
+                if not file_path.startswith(prefix):
+                    continue
+                file_path = file_path[len(prefix):]
+                if '..' in Path(file_path).parts or not self._included(source, file_path):
+                    continue
+
+                member_url = f"{source['base_url']}/{file_path}"
+                metrics = self._file_metrics(member_url, source_dir / file_path)
+                member_file = archive.extractfile(member)
+                blob = git_blob_hasher(member.size)
+                writer = self.cache.writer()
+                try:
+                    for chunk in iter(lambda: member_file.read(CHUNK_SIZE), b''):
+                        blob.update(chunk)
+                        writer.write(chunk)
+                except BaseException:
+                    writer.abort()
+                    raise
+                self._write_file(member_url, source_dir / file_path,
+                                 writer, blob_sha=blob.hexdigest(), metrics=metrics)
+                self._report(metrics)
+                count += 1
+        return count
+
+    def sync_archive(self, name: str) -> int:
+        """
+        Sync an auto-pull source from a single tarball of its pinned ref.
+
+        This replaces the tree API call and the per-file requests with one download,
+        which also keeps concurrent builders clear of the GitHub API rate limit.
+
+        Returns:
+            Number of files successfully synced
+        """
+        source = self.sources[name]
+        source_dir = self.output_dir / name
+        url = self.github_archive_url(source['github_repo'])
+        if url is None:
+            return 0
+
+        print(f"Downloading archive for GitHub repository: {source['github_repo']}")
+        # The download itself is reported apart from the members it unpacks to
+        metrics = FileMetrics(name, url)
+        metrics.status = 'archive'
+
+        def handle(response: httpx.Response) -> int:
+            if response.status_code != 200:
+                print(f"✗ Failed to fetch {url}: {response.status_code}")
+                return 0
+            return self.extract_archive(source, source_dir, response.iter_bytes(CHUNK_SIZE))
+
+        try:
+            count = self._request(url, handle, metrics=metrics)
+        except Exception as e:
+            print(f"✗ Error fetching {url}: {str(e)}")
+            metrics.error = str(e) or type(e).__name__
+            self._report(metrics, False)
+            return 0
+
+        self._report(metrics, metrics.http_status == 200)
+        self.save_lock()
+        return count
 
     def sync_source(self, name: str) -> int:
         """
@@ -129,125 +1780,668 @@ class CSSVendor:
 
         # Handle local directory copying
         if source['local_dir']:
-            local_path = Path(source['local_dir'])
-
-            # Copy root files
-            for file in source['files']:
-                source_path = local_path / file
-                output_path = source_dir / file
+            for source_path, output_path in self._local_jobs(source, source_dir):
                 if self.copy_local_file(source_path, output_path):
                     success_count += 1
-
-            # Copy directory files
-            for dir_name, files in source['directories'].items():
-                for file in files:
-                    source_path = local_path / dir_name / file
-                    output_path = source_dir / dir_name / file
-                    if self.copy_local_file(source_path, output_path):
-                        success_count += 1
-
             return success_count
 
+        skipped = self._skip_pinned(name)
+        if skipped is not None:
+            return skipped
+
+        if self.offline and source['auto_pull']:
+            # The file list of an auto-pull source comes from the lock when offline
+            jobs = self._locked_jobs(name)
+        elif source['auto_pull'] and source['github_repo'] and source['archive']:
+            return self.sync_archive(name)
         # Auto-pull from GitHub if specified
-        if source['auto_pull'] and source['github_repo']:
+        elif source['auto_pull'] and source['github_repo']:
             print(f"Auto-pulling files from GitHub repository: {source['github_repo']}")
             files = self.get_github_files(source['github_repo'])
-            base_url = source['base_url']
-
-            for file_info in files:
-                file_path = file_info['path']
-                # If path is specified in github_repo, remove it from file_path
-                repo_parts = source['github_repo'].split('/')
-                if len(repo_parts) > 3:
-                    prefix = '/'.join(repo_parts[3:]) + '/'
-                    if file_path.startswith(prefix):
-                        file_path = file_path[len(prefix):]
-
-                url = f"{base_url}/{file_path}"
-                output_path = source_dir / file_path
-                if self.fetch_file(url, output_path):
-                    success_count += 1
+            jobs, success_count = self._skip_locked(self._github_jobs(source, files, source_dir))
+        else:
+            jobs = self._url_jobs(source, source_dir)
 
-            return success_count
-
-        # Fetch files from URL
-        base_url = source['base_url']
-
-        # Sync root files
-        for file in source['files']:
-            url = f"{base_url}/{file}"
-            output_path = source_dir / file
-            if self.fetch_file(url, output_path):
-                success_count += 1
-
-        # Sync directory files
-        for dir_name, files in source['directories'].items():
-            dir_path = source_dir / dir_name
-
-            for file in files:
-                url = f"{base_url}/{dir_name}/{file}"
-                output_path = dir_path / file
-                if self.fetch_file(url, output_path):
-                    success_count += 1
+        success_count += self.fetch_jobs(jobs)
 
+        self.save_lock()
         return success_count
 
-    def sync_all(self) -> Dict[str, int]:
+    def sync_all(self,
+                 concurrent: bool = False,
+                 max_concurrency: int = 16,
+                 update: Union[bool, Iterable[str]] = False) -> Dict[str, int]:
         """
         Sync all files from all sources.
 
+        The sync (and the post-sync stages) run against a staged copy of the
+        output directory, which is swapped in atomically at the end (see staged).
+        Refs are pinned first (see resolve_async), and a source whose pin was
+        already synced completely is skipped without a request.
+
+        Args:
+            concurrent: If True, fetch every file of every source concurrently (see sync_all_async)
+            max_concurrency: Maximum number of in-flight requests when running concurrently
+            update: Re-resolve every ref (True) or the refs of the named sources instead of
+                reusing the pins in the lock
+
         Returns:
             Dictionary mapping source names to number of files successfully synced
         """
+        if concurrent:
+            return asyncio.run(self.sync_all_async(max_concurrency=max_concurrency, update=update))
+
         results = {}
         total = 0
+        self.file_metrics = []
+        started = time.perf_counter()
+        self.resolve(update)
 
-        for name in self.sources:
-            print(f"\nSyncing {name}...")
-            count = self.sync_source(name)
-            results[name] = count
-            total += count
+        # Stages such as vendor_assets fetch through the pooled client too, so it is closed after them
+        try:
+            with self.staged():
+                for name in self.sources:
+                    print(f"\nSyncing {name}...")
+                    source_started = time.perf_counter()
+                    count = self.sync_source(name)
+                    self._mark_synced(name)
+                    self._report_source(name, time.perf_counter() - source_started)
+                    results[name] = count
+                    total += count
+                self.save_lock()
 
-        print(f"\nSync complete! Synced {total} files.")
+                print(f"\nSync complete! Synced {total} files.")
+                self._report_sync(time.perf_counter() - started, concurrent=False)
+                self.run_stages(results)
+        finally:
+            self.close()
+        self.cache.evict()
         return results
 
-def setup_openprops_vendor():
-    """Set up a CSS vendor for OpenProps and related libraries"""
-    vendor = CSSVendor("css")
-
-    # OpenProps (Beta)
-    vendor.add_source(
-        name="ui/opbeta",
-        base_url="https://unpkg.com/open-props@2.0.0-beta.5",
-        files=["index.css", "utilities.css", "animate.css"],
-        directories={
-            "css": ["media-queries.css"],
-            "css/sizes": ["media.css"],
-            "css/font": ["lineheight.css"],
-            "css/color": ["hues.oklch.css"]
+    @contextmanager
+    def staged(self) -> Iterator[Path]:
+        """
+        Point the vendor at a staged copy of the output directory and swap it in on success.
+
+        The copy is made of hardlinks, which is cheap and safe because every
+        write replaces files by rename instead of rewriting them in place.
+        Readers of the live tree (e.g. serve_css) keep seeing the old tree until
+        the swap. If the sync raises, the staged copy is discarded and the live
+        tree is left untouched.
+        """
+        live = self.output_dir
+        staging = live.with_name(f".{live.name}.staging")
+        if staging.exists():
+            shutil.rmtree(staging)
+        if live.exists():
+            shutil.copytree(live, staging, symlinks=True, copy_function=_link_or_copy)
+        else:
+            staging.mkdir(parents=True)
+
+        self.output_dir, self.lock_path = staging, staging / self.LOCK_FILE
+        try:
+            yield staging
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            self.output_dir, self.lock_path = live, live / self.LOCK_FILE
+
+        exchange_directories(staging, live)
+        shutil.rmtree(staging)
+        print(f"✓ Swapped the staged tree into {live}")
+
+    # ------------------------------------------------------------------
+    # url() assets
+    # ------------------------------------------------------------------
+
+    def _asset_url(self, css_path: Path, reference: str) -> Optional[str]:
+        """
+        Absolute URL a url() reference of a vendored file is fetched from.
+
+        Returns:
+            None for references that already resolve locally (data: URIs, fragments,
+            root-relative paths and files next to the stylesheet, e.g. assets written earlier)
+        """
+        if reference.startswith('//'):
+            return f"https:{reference}"
+        if re.match(r'^https?://', reference, re.IGNORECASE):
+            return reference
+        if is_external(reference) or reference.startswith(('#', '/')):
+            return None
+        if (css_path.parent / urlsplit(reference).path).exists():
+            return None
+        # Relative to where the stylesheet was fetched from; local sources have no origin
+        origin = self.lock.get(self._lock_key(css_path), {}).get('url')
+        return urljoin(origin, reference) if origin else None
+
+    def _fetch_asset(self, url: str, source: Optional[str]) -> Optional[Dict]:
+        """
+        Bring an asset into the content cache, returning its cache entry.
+
+        Asset URLs are resolved against pinned stylesheet URLs, so a cached copy
+        is reused without a request, like the pinned files themselves.
+        """
+        metrics = FileMetrics(source, url)
+        entry = self.cache.lookup(url)
+        if entry is not None:
+            metrics.status, metrics.cache, metrics.size = 'cached', 'hit', entry['size']
+        elif self.offline:
+            print(f"✗ Not in cache: {url}")
+        else:
+            def handle(response: httpx.Response) -> Optional[Dict]:
+                if response.status_code != 200:
+                    print(f"✗ Failed to fetch {url}: {response.status_code}")
+                    return None
+                writer = self.cache.writer()
+                try:
+                    for chunk in response.iter_bytes(CHUNK_SIZE):
+                        writer.write(chunk)
+                except BaseException:
+                    writer.abort()
+                    raise
+                writer.commit(url, response.headers.get('etag'), response.headers.get('last-modified'))
+                metrics.status, metrics.cache, metrics.size = 'fetched', 'miss', writer.size
+                return self.cache.lookup(url)
+
+            try:
+                entry = self._request(url, handle, metrics=metrics)
+            except Exception as e:
+                print(f"✗ Error fetching {url}: {str(e)}")
+                metrics.error = str(e) or type(e).__name__
+        self._report(metrics, entry is not None)
+        return entry
+
+    def _data_uri(self, url: str, digest: str) -> str:
+        """Inline a cached asset: SVG as percent-encoded text, anything else as base64"""
+        suffix = PurePosixPath(urlsplit(url).path).suffix.lower()
+        media_type = ASSET_TYPES.get(suffix) or mimetypes.guess_type(url)[0] or 'application/octet-stream'
+        data = self.cache.object_path(digest).read_bytes()
+        if media_type == 'image/svg+xml':
+            try:
+                return f"data:{media_type},{quote(data.decode(), safe=' /:=;,!*~._-')}"
+            except UnicodeDecodeError:
+                pass
+        return f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+
+    def vendor_assets(self, inline_limit: int = INLINE_LIMIT) -> Dict[str, int]:
+        """
+        Bring the url() assets of the vendored CSS (fonts, icons, images) under the output directory.
+
+        Every url() of every vendored stylesheet is resolved (relative references
+        against the URL the stylesheet was fetched from) and fetched once through
+        the vendor's client and content cache. Assets up to `inline_limit` bytes
+        are inlined as data: URIs; larger ones are written to assets/ under a
+        content-hashed name, so identical assets reached through several URLs are
+        stored once. References are rewritten in place, and assets nothing
+        references any more are removed.
+
+        Args:
+            inline_limit: Largest asset, in bytes, inlined as a data: URI (0 to never inline)
+
+        Returns:
+            Counts of inlined references, written files, duplicate URLs stored once and failed URLs
+        """
+        assets_dir = self.output_dir / ASSETS_DIR
+        stylesheets = {path: path.read_text() for path in sorted(self.output_dir.rglob('*.css'))
+                       if not is_generated(path) and not path.is_relative_to(assets_dir)}
+
+        # Every URL is fetched once, on behalf of the first stylesheet that references it
+        references: Dict[Path, Dict[str, str]] = {}
+        sources: Dict[str, Optional[str]] = {}
+        # Lock keys of the assets some url() resolves to, whether rewritten now or by an earlier sync
+        referenced = set()
+        for path, text in stylesheets.items():
+            for match in URL_PATTERN.finditer(text):
+                reference = match.group(2).strip()
+                url = self._asset_url(path, reference)
+                if url is not None:
+                    references.setdefault(path, {})[reference] = url
+                    sources.setdefault(urlsplit(url)._replace(fragment='').geturl(),
+                                       self._source_of(self._lock_key(path)))
+                elif not is_external(reference) and not reference.startswith(('#', '/')):
+                    target = Path(os.path.normpath(path.parent / urlsplit(reference).path))
+                    if target.is_relative_to(assets_dir):
+                        referenced.add(self._lock_key(target))
+        entries = {url: self._fetch_asset(url, source) for url, source in sources.items()}
+
+        # One file per content, named after the first URL (in sorted order) that has it
+        names: Dict[str, str] = {}
+        for url in sorted(entries):
+            entry = entries[url]
+            if entry is not None and entry['sha256'] not in names:
+                asset = PurePosixPath(urlsplit(url).path)
+                names[entry['sha256']] = f"{asset.stem or 'asset'}.{entry['sha256'][:8]}{asset.suffix}"
+
+        stats = {'inlined': 0, 'written': 0, 'duplicates': 0, 'failed': 0}
+        stats['failed'] = sum(entry is None for entry in entries.values())
+        stats['duplicates'] = sum(entry is not None for entry in entries.values()) - len(names)
+        written = set()
+
+        def replacement(path: Path, reference: str) -> Optional[str]:
+            url = references.get(path, {}).get(reference)
+            fragment = urlsplit(url).fragment if url else ''
+            entry = entries.get(urlsplit(url)._replace(fragment='').geturl()) if url else None
+            if entry is None:
+                return None
+            if not fragment and entry['size'] <= inline_limit:
+                stats['inlined'] += 1
+                return self._data_uri(url, entry['sha256'])
+            name = names[entry['sha256']]
+            target = assets_dir / name
+            if name not in written:
+                key = self._lock_key(target)
+                if self.lock.get(key, {}).get('sha256') != entry['sha256'] or not target.exists():
+                    self.cache.materialize(entry['sha256'], target)
+                    print(f"✓ Wrote {key}")
+                    stats['written'] += 1
+                self._record(key, url, entry['sha256'], entry['size'], entry.get('etag'), entry.get('last_modified'))
+                written.add(name)
+            referenced.add(self._lock_key(target))
+            relative = Path(os.path.relpath(target, path.parent)).as_posix()
+            return f"{relative}#{fragment}" if fragment else relative
+
+        for path, text in stylesheets.items():
+            if path not in references:
+                continue
+            count = 0
+
+            def rewrite(match):
+                nonlocal count
+                new = replacement(path, match.group(2).strip())
+                if new is None:
+                    return match.group(0)
+                count += 1
+                return f'url("{new}")'
+
+            rewritten = URL_PATTERN.sub(rewrite, text)
+            if rewritten != text:
+                replace_file(path, rewritten.encode())
+                print(f"✓ Rewrote {count} url() references in {self._lock_key(path)}")
+
+        # Assets of a previous sync that no url() resolves to any more
+        for key in [key for key in self.lock if key.startswith(f"{ASSETS_DIR}/")]:
+            if key not in referenced:
+                (self.output_dir / key).unlink(missing_ok=True)
+                del self.lock[key]
+                print(f"✓ Removed unused {key}")
+
+        self.save_lock()
+        print(f"✓ Vendored {len(entries)} url() assets ({stats['inlined']} references inlined, "
+              f"{stats['written']} files written, {stats['duplicates']} duplicates stored once, "
+              f"{stats['failed']} failed)")
+        return stats
+
+    # ------------------------------------------------------------------
+    # Async sync engine
+    # ------------------------------------------------------------------
+
+    def create_async_client(self, max_concurrency: int = 16, http2: bool = True) -> httpx.AsyncClient:
+        """
+        Create the pooled client shared by every fetch of an async sync.
+
+        Args:
+            max_concurrency: Maximum number of pooled connections
+            http2: Negotiate HTTP/2 when the optional `h2` package is installed
+        """
+        limits = httpx.Limits(max_connections=max_concurrency,
+                              max_keepalive_connections=max_concurrency)
+        return httpx.AsyncClient(http2=http2 and HTTP2_AVAILABLE,
+                                 limits=limits,
+                                 transport=self.transport,
+                                 follow_redirects=True)
+
+    async def fetch_file_async(self,
+                               client: httpx.AsyncClient,
+                               semaphore: asyncio.Semaphore,
+                               url: str,
+                               output_path: Path,
+                               blob_sha: str = None) -> bool:
+        """Fetch a single file from URL using the shared async client"""
+        metrics = self._file_metrics(url, output_path)
+        ok = False
+        try:
+            if self.offline:
+                ok = self._fetch_from_cache(url, output_path, blob_sha, metrics)
+            else:
+                async def handle(response: httpx.Response) -> bool:
+                    return await self._store_response_async(url, output_path, response, blob_sha, metrics)
+
+                ok = await self._request_async(client, semaphore, url, handle,
+                                               headers=self._conditional_headers(url, output_path),
+                                               metrics=metrics)
+        except Exception as e:
+            print(f"✗ Error fetching {url}: {str(e)}")
+            metrics.error = str(e) or type(e).__name__
+        self._report(metrics, ok)
+        return ok
+
+    async def get_github_files_async(self,
+                                     client: httpx.AsyncClient,
+                                     semaphore: asyncio.Semaphore,
+                                     repo_path: str) -> List[dict]:
+        """Get all files from a GitHub repository recursively using the shared async client"""
+        api_url = self._github_api_url(repo_path)
+        if api_url is None:
+            return []
+
+        async def handle(response: httpx.Response) -> List[dict]:
+            await response.aread()
+            return self._github_tree_response(repo_path, response)
+
+        metrics = self._tree_metrics(repo_path, api_url)
+        try:
+            files = await self._request_async(client, semaphore, api_url, handle, metrics=metrics)
+        except Exception as e:
+            print(f"Error fetching GitHub repository files: {str(e)}")
+            metrics.error = str(e) or type(e).__name__
+            files = []
+        self._report(metrics, metrics.http_status == 200)
+        return files
+
+    async def sync_source_async(self,
+                                name: str,
+                                client: httpx.AsyncClient,
+                                semaphore: asyncio.Semaphore) -> int:
+        """
+        Sync all files from a given source concurrently.
+
+        Returns:
+            Number of files successfully synced
+        """
+        if name not in self.sources:
+            print(f"Unknown source: {name}")
+            return 0
+
+        source = self.sources[name]
+        source_dir = self.output_dir / name
+        source_dir.mkdir(parents=True, exist_ok=True)
+
+        # Local copies are cheap and never touch the network
+        if source['local_dir']:
+            return self.sync_source(name)
+
+        skipped = self._skip_pinned(name)
+        if skipped is not None:
+            return skipped
+
+        if self.offline and source['auto_pull']:
+            jobs, skipped = self._locked_jobs(name), 0
+        # A single streamed download; tarfile reads synchronously, so run it off the loop
+        # (the lock, pins, metrics and cache index it updates are guarded by their _mutex)
+        elif source['auto_pull'] and source['github_repo'] and source['archive']:
+            async with semaphore:
+                return await asyncio.to_thread(self.sync_archive, name)
+        elif source['auto_pull'] and source['github_repo']:
+            print(f"Auto-pulling files from GitHub repository: {source['github_repo']}")
+            files = await self.get_github_files_async(client, semaphore, source['github_repo'])
+            jobs, skipped = self._skip_locked(self._github_jobs(source, files, source_dir))
+        else:
+            jobs, skipped = self._url_jobs(source, source_dir), 0
+
+        count = await self.fetch_jobs_async(client, semaphore, jobs)
+        self.save_lock()
+        return skipped + count
+
+    async def sync_all_async(self,
+                             max_concurrency: int = 16,
+                             http2: bool = True,
+                             update: Union[bool, Iterable[str]] = False) -> Dict[str, int]:
+        """
+        Sync all files from all sources concurrently over one pooled client.
+
+        Every source shares the same connection pool and the same concurrency limit,
+        so a full sync takes roughly as long as its slowest file rather than the sum.
+        Like sync_all, it runs against a staged copy that is swapped in at the end.
+
+        Args:
+            max_concurrency: Maximum number of in-flight requests across all sources
+            http2: Negotiate HTTP/2 when the optional `h2` package is installed
+            update: Re-resolve every ref (True) or the refs of the named sources (see resolve_async)
+
+        Returns:
+            Dictionary mapping source names to number of files successfully synced
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        self.file_metrics = []
+        started = time.perf_counter()
+
+        async def sync_timed(name: str, client: httpx.AsyncClient) -> int:
+            source_started = time.perf_counter()
+            count = await self.sync_source_async(name, client, semaphore)
+            self._mark_synced(name)
+            self._report_source(name, time.perf_counter() - source_started)
+            return count
+
+        # Archive downloads and stages such as vendor_assets use the pooled sync client, closed after them
+        try:
+            with self.staged():
+                async with self.create_async_client(max_concurrency, http2) as client:
+                    await self.resolve_async(client, semaphore, update)
+                    names = list(self.sources)
+                    print(f"\nSyncing {', '.join(names)} (concurrency {max_concurrency})...")
+                    counts = await asyncio.gather(*(sync_timed(name, client) for name in names))
+
+                self.save_lock()
+                results = dict(zip(names, counts))
+                print(f"\nSync complete! Synced {sum(counts)} files.")
+                self._report_sync(time.perf_counter() - started, concurrent=True)
+                self.run_stages(results)
+        finally:
+            self.close()
+        self.cache.evict()
+        return results
+
+    # ------------------------------------------------------------------
+    # Watch mode
+    # ------------------------------------------------------------------
+
+    def _watched_copies(self) -> Dict[str, Path]:
+        """Map every file of the local sources, with their globs expanded now, to where it is vendored"""
+        copies = {}
+        for name, source in self.sources.items():
+            if source['local_dir']:
+                for source_path, output_path in self._local_jobs(source, self.output_dir / name):
+                    copies[os.path.abspath(source_path)] = output_path
+        return copies
+
+    def watch(self, entries: List[str] = None, poll_interval: float = 0.05, rescan_interval: float = 1.0):
+        """
+        Watch local sources and incrementally rebuild on change.
+
+        Only changed files are copied, and only bundles whose import graph
+        includes one of them are rebuilt. The globs of the local sources are
+        expanded again every `rescan_interval` seconds (and after each change),
+        so files created while watching are vendored too. Runs until interrupted.
+
+        Args:
+            entries: Entry stylesheets to keep bundled (default: ui/main.css and custom/custom.css)
+            poll_interval: Seconds between scans when inotify is unavailable
+            rescan_interval: Seconds between re-expansions of the local sources' globs
+        """
+        if not any(source['local_dir'] for source in self.sources.values()):
+            print("No local sources to watch.")
+            return
+        copies = self._watched_copies()
+
+        bundler = CSSBundler(str(self.output_dir))
+        entries = [Path(entry) for entry in entries or default_entries(str(self.output_dir)) if Path(entry).exists()]
+        dependencies = {}
+        for entry in entries:
+            bundler.bundle(str(entry))
+            dependencies[entry] = bundler.files
+
+        watcher = FileWatcher([Path(path) for path in copies], poll_interval)
+        print(f"\nWatching {len(copies)} files ({watcher.mode}). Press Ctrl+C to stop.")
+        try:
+            while True:
+                changed = set(watcher.poll(rescan_interval))
+                added = {path: output_path for path, output_path in self._watched_copies().items()
+                         if path not in copies}
+                if added:
+                    copies.update(added)
+                    watcher.add([Path(path) for path in added])
+                    changed |= {Path(path) for path in added}
+                if not changed:
+                    continue
+                started = time.perf_counter()
+
+                outputs = set()
+                for path in sorted(changed):
+                    output_path = copies[os.path.abspath(path)]
+                    if self.copy_local_file(path, output_path):
+                        outputs.add(output_path.resolve())
+
+                rebuilt = 0
+                for entry, files in dependencies.items():
+                    if files & outputs:
+                        bundler.bundle(str(entry))
+                        dependencies[entry] = bundler.files
+                        rebuilt += 1
+
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"↻ {len(outputs)} copied, {rebuilt} bundles rebuilt in {elapsed:.1f} ms")
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        finally:
+            watcher.close()
+
+def load_manifest(path: str = MANIFEST_FILE) -> Dict:
+    """
+    Read a vendor manifest and turn it into CSSVendor arguments.
+
+    The manifest declares each source under `[sources."<name>"]` with one of
+    `url` (files fetched relative to it), `github` ("owner/repo", auto-pulled
+    from `path` and filtered by the `include` globs) or `local` (a directory
+    whose `files` may be globs), plus an optional `ref` substituted for `{ref}`
+    in the URL. Relative paths are resolved against the manifest's directory.
+
+    Args:
+        path: Path to the TOML manifest
+
+    Returns:
+        Dictionary with the output_dir and the add_source keyword arguments of each source
+
+    Raises:
+        ValueError: If a source is not described by exactly one of url, github and local
+    """
+    path = Path(path)
+    with open(path, 'rb') as f:
+        data = tomllib.load(f)
+    root = path.parent
+
+    sources = []
+    for name, entry in data.get('sources', {}).items():
+        kinds = [kind for kind in ('url', 'github', 'local') if kind in entry]
+        if len(kinds) != 1:
+            raise ValueError(f"Source {name} in {path} needs exactly one of url, github or local")
+        unknown = set(entry) - {'url', 'github', 'local', 'ref', 'path', 'files', 'directories', 'include', 'archive'}
+        if unknown:
+            raise ValueError(f"Source {name} in {path} has unknown keys: {', '.join(sorted(unknown))}")
+
+        options = {
+            'name': name,
+            'files': entry.get('files'),
+            'directories': entry.get('directories'),
+            'ref': entry.get('ref'),
         }
-    )
-
-    # OpenProps UI - Simplified with auto-pull
-    vendor.add_source(
-        name="ui",
-        base_url="https://raw.githubusercontent.com/felix-bohlin/ui/main/src",
-        auto_pull=True,
-        github_repo="felix-bohlin/ui/main/src"
-    )
-
-    # Use the local custom directory
-    vendor.add_source(
-        name="custom",  # This will be created as css/custom
-        base_url=None,
-        local_dir="custom",  # This is the source directory at project root
-        files=["layout.css", "utils.css", "custom.css"]
-    )
+        if 'url' in entry:
+            options['base_url'] = entry['url']
+        elif 'github' in entry:
+            repo_path = '/'.join(part for part in (entry['github'], '{ref}', entry.get('path', '').strip('/')) if part)
+            options.update(base_url=f"https://raw.githubusercontent.com/{repo_path}",
+                           github_repo=repo_path,
+                           auto_pull=True,
+                           archive=entry.get('archive', False),
+                           include=entry.get('include'),
+                           ref=entry.get('ref', 'main'))
+        else:
+            options.update(base_url=None, local_dir=str(root / entry['local']))
+        sources.append(options)
+
+    return {'output_dir': str(root / data.get('output_dir', 'css')), 'sources': sources}
+
 
+def vendor_from_manifest(path: str = MANIFEST_FILE,
+                         cache: ContentCache = None,
+                         offline: bool = False,
+                         retry: RetryPolicy = None,
+                         rate_limit: float = 50.0,
+                         transport: httpx.BaseTransport = None) -> CSSVendor:
+    """Set up a CSS vendor with the sources declared in a manifest (see load_manifest)"""
+    manifest = load_manifest(path)
+    vendor = CSSVendor(manifest['output_dir'], cache=cache, offline=offline, retry=retry,
+                       rate_limit=rate_limit, transport=transport)
+    for options in manifest['sources']:
+        vendor.add_source(**options)
     return vendor
 
+
+def setup_openprops_vendor(cache: ContentCache = None,
+                           offline: bool = False,
+                           retry: RetryPolicy = None,
+                           rate_limit: float = 50.0,
+                           manifest: str = MANIFEST_FILE):
+    """Set up a CSS vendor for OpenProps and related libraries, as declared in patchwork.toml"""
+    return vendor_from_manifest(manifest, cache=cache, offline=offline, retry=retry, rate_limit=rate_limit)
+
+def optimize_stage(vendor: CSSVendor, results: Dict[str, int]):
+    """Bundle, minify and precompress the vendored tree (see bundle.optimize_tree)"""
+    optimize_tree(str(vendor.output_dir))
+
+
+def assets_stage(inline_limit: int = INLINE_LIMIT) -> Callable[[CSSVendor, Dict[str, int]], None]:
+    """Post-sync stage inlining or hashing the url() assets of the vendored CSS (see CSSVendor.vendor_assets)"""
+    def vendor_assets(vendor: CSSVendor, results: Dict[str, int]):
+        vendor.vendor_assets(inline_limit)
+    return vendor_assets
+
 # Example usage
 if __name__ == "__main__":
-    vendor = setup_openprops_vendor()
-    results = vendor.sync_all()
+    parser = argparse.ArgumentParser(description="Pull CSS dependencies into the css folder")
+    parser.add_argument("--optimize", action="store_true",
+                        help="After syncing, bundle, minify and write .gz/.br siblings")
+    parser.add_argument("--assets", action="store_true",
+                        help="After syncing, fetch the url() assets of the vendored CSS and inline or hash them")
+    parser.add_argument("--inline-limit", type=int, default=INLINE_LIMIT, metavar="BYTES",
+                        help="Largest url() asset inlined as a data: URI with --assets (0 to never inline)")
+    parser.add_argument("--watch", action="store_true",
+                        help="After syncing, watch local sources and rebuild affected bundles on change")
+    parser.add_argument("--offline", action="store_true",
+                        help="Sync entirely from the local content cache, without network I/O")
+    parser.add_argument("--cache-dir", default=None, help="Content cache directory (default: ~/.cache/patchwork)")
+    parser.add_argument("--cache-size", type=int, default=512, metavar="MB",
+                        help="Evict least recently used cache objects beyond this size")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="Hardlink vendored files to cache objects when reflinks are unsupported, "
+                             "instead of copying them")
+    parser.add_argument("--retries", type=int, default=4, metavar="N",
+                        help="Attempts per request before a file is re-queued")
+    parser.add_argument("--rate-limit", type=float, default=50.0, metavar="RPS",
+                        help="Requests per second shared by all fetches (0 for no limit)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Append per-file, per-source and per-sync timing events to this JSON-lines file")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, metavar="PATH",
+                        help=f"Vendor manifest declaring the sources (default: {MANIFEST_FILE})")
+    parser.add_argument("--update", nargs="*", metavar="SOURCE",
+                        help="Re-resolve the refs of these sources (all without names) instead of "
+                             "reusing the pins in the lockfile")
+    args = parser.parse_args()
+
+    cache = ContentCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024, hardlink=args.hardlink)
+    vendor = setup_openprops_vendor(cache=cache, offline=args.offline,
+                                    retry=RetryPolicy(attempts=max(1, args.retries)),
+                                    rate_limit=args.rate_limit or None, manifest=args.manifest)
+    if args.metrics:
+        vendor.add_listener(JSONLinesExporter(args.metrics))
+    if args.assets:
+        # Before optimizing, so the bundles are built from the rewritten stylesheets
+        vendor.add_stage(assets_stage(args.inline_limit))
+    if args.optimize:
+        vendor.add_stage(optimize_stage)
+    update = False if args.update is None else args.update or True
+    results = vendor.sync_all(concurrent=True, update=update)
     print(f"Results by source: {results}")
+
+    if args.watch:
+        vendor.watch()